@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Measures what a burst of logins does to the backend's event loop, with and without the password pool.
+
+  inline  bcrypt.checkpw called on the event loop, as ClassroomDatabase.authenticate does
+  pool    PasswordVerifier with a queue large enough for the whole burst
+  bounded PasswordVerifier with --queue; checks past it are refused at once
+
+All logins of the burst are started together, like a class logging in at
+the start of a lesson. Meanwhile a probe task wakes every --probe-interval
+seconds and records how late it woke: that is how long any other request
+on the backend would have waited. How often it woke at all (probes) shows
+whether the loop got to do anything else during the burst. The database is
+not involved; the hashes are made up front at --cost.
+
+Example:
+    python benchmarks/bench_auth.py --logins 200 --cost 12
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bcrypt
+from utils.auth_pool import PasswordVerifier, AuthQueueFull, DEFAULT_AUTH_QUEUE
+
+
+async def probe_lag(interval, lags, stop):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.perf_counter() - started - interval))
+
+
+async def run_burst(mode, credentials, args):
+    verifier = None
+    if mode != "inline":
+        queue = args.queue if mode == "bounded" else len(credentials)
+        verifier = PasswordVerifier(args.workers, queue)
+        await verifier.start()
+
+    async def login(password, hashed):
+        if verifier is None:
+            return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+        return await verifier.verify(password, hashed)
+
+    lags, stop = [], asyncio.Event()
+    probe = asyncio.create_task(probe_lag(args.probe_interval, lags, stop))
+    await asyncio.sleep(args.probe_interval * 2) # Let the probe start first
+    started = time.perf_counter()
+    results = await asyncio.gather(*(login(p, h) for p, h in credentials), return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe
+    if verifier:
+        verifier.close()
+
+    accepted = sum(1 for r in results if r is True)
+    rejected = sum(1 for r in results if isinstance(r, AuthQueueFull))
+    lags.sort()
+    return {
+        "accepted": accepted,
+        "rejected": rejected,
+        "seconds": elapsed,
+        "logins_s": accepted / elapsed if elapsed else 0.0,
+        "probes": len(lags),
+        "lag_p99_ms": lags[max(0, int(len(lags) * 0.99) - 1)] * 1000 if lags else 0.0,
+        "lag_max_ms": lags[-1] * 1000 if lags else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Login burst: event loop lag and throughput")
+    parser.add_argument("--logins", type=int, default=200, help="Logins in the burst")
+    parser.add_argument("--cost", type=int, default=12, help="bcrypt cost factor of the password hashes")
+    parser.add_argument("--users", type=int, default=8, help="Distinct password hashes to log in with")
+    parser.add_argument("--workers", type=int, default=None, help="Pool worker processes (default: one per core)")
+    parser.add_argument("--queue", type=int, default=DEFAULT_AUTH_QUEUE,
+                        help="Waiting checks allowed in the bounded mode")
+    parser.add_argument("--probe-interval", type=float, default=0.01, help="Seconds between event loop lag probes")
+    parser.add_argument("--modes", nargs="+", choices=("inline", "pool", "bounded"),
+                        default=["inline", "pool", "bounded"])
+    args = parser.parse_args()
+
+    print(f"[*] Hashing {args.users} passwords at cost {args.cost}...")
+    hashes = [(f"password{i}", bcrypt.hashpw(f"password{i}".encode("utf-8"), bcrypt.gensalt(args.cost)).decode("utf-8"))
+              for i in range(args.users)]
+    credentials = [hashes[i % len(hashes)] for i in range(args.logins)]
+    print(f"[*] {args.logins} logins, {args.workers or os.cpu_count()} worker(s), {os.cpu_count()} core(s)")
+
+    print(f"{'mode':<8} {'ok':>5} {'busy':>5} {'seconds':>8} {'logins/s':>9} {'probes':>7} {'lag p99 ms':>11} {'lag max ms':>11}")
+    for mode in args.modes:
+        r = asyncio.run(run_burst(mode, credentials, args))
+        print(f"{mode:<8} {r['accepted']:>5} {r['rejected']:>5} {r['seconds']:>8.2f} {r['logins_s']:>9.1f} "
+              f"{r['probes']:>7} {r['lag_p99_ms']:>11.1f} {r['lag_max_ms']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
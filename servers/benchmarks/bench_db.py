@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Measures the per-query cost of ClassroomDatabase, per-query connections vs long-lived ones.
+
+  per-query   what _get_cursor used to do: sqlite3.connect, PRAGMA foreign_keys,
+              PRAGMA journal_mode=WAL, the query, close
+  persistent  the current ClassroomDatabase: one connection per thread, opened
+              once with CONNECTION_PRAGMAS, and its statement cache
+
+Timed on a scratch database (a room of --students students, all of them in
+active_clients):
+
+  get_client_id         one lookup
+  get_students_in_room  the room's roster
+  notify                what handle_notify does for that room: teacher,
+                        sender, roster, then get_client_ids for the roster
+
+Example:
+    python benchmarks/bench_db.py --students 50 --iterations 2000
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.sqlite_db import ClassroomDatabase
+
+
+class PerQueryConnectionDatabase(ClassroomDatabase):
+    """ClassroomDatabase with the old _get_cursor: a new connection for every cursor block."""
+
+    @contextmanager
+    def _get_cursor(self, commit_on_exit: bool = True):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.row_factory = sqlite3.Row
+        try:
+            cursor = conn.cursor()
+            yield cursor
+            if commit_on_exit:
+                conn.commit()
+        except sqlite3.Error:
+            if commit_on_exit:
+                conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+
+def populate(db_path, students):
+    db = ClassroomDatabase(db_path)
+    with db._get_cursor() as cursor:
+        cursor.execute("INSERT INTO users VALUES ('teacher', 'x', 'teacher')")
+        cursor.executemany("INSERT INTO users VALUES (?, 'x', 'student')", [(f"stu{i}",) for i in range(students)])
+        cursor.execute("INSERT INTO rooms (room_id, teacher) VALUES ('room-1', 'teacher')")
+        cursor.executemany("INSERT INTO room_participants (room_id, student_username, student_name, mssv) "
+                           "VALUES ('room-1', ?, ?, ?)",
+                           [(f"stu{i}", f"Student {i}", f"2152{i:04d}") for i in range(students)])
+        cursor.executemany("INSERT INTO active_clients VALUES (?, ?, '2025-01-01T00:00:00')",
+                           [(f"stu{i}", f"client-{i}") for i in range(students)] + [("teacher", "client-t")])
+    db.close()
+
+
+def notify_lookups(db):
+    db.get_room_teacher("room-1")
+    db.get_username("client-t")
+    db.get_client_ids(db.get_students_in_room("room-1"))
+
+
+def time_per_call(func, iterations, repeats):
+    """Best of `repeats` runs, in microseconds per call."""
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        best = min(best, (time.perf_counter() - started) / iterations)
+    return best * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ClassroomDatabase per-query overhead benchmark")
+    parser.add_argument("--students", type=int, default=50, help="Students in the benchmark room")
+    parser.add_argument("--iterations", type=int, default=2000, help="Calls per timed run")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed runs per case; the best is reported")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        populate(db_path, args.students)
+        before, after = PerQueryConnectionDatabase(db_path), ClassroomDatabase(db_path)
+        cases = {
+            "get_client_id": (lambda db: db.get_client_id("stu7"), args.iterations),
+            "get_students_in_room": (lambda db: db.get_students_in_room("room-1"), args.iterations),
+            "notify": (notify_lookups, max(1, args.iterations // args.students)),
+        }
+        print(f"[*] {args.students} students, sqlite {sqlite3.sqlite_version}")
+        print(f"{'case':<22} {'per-query us':>13} {'persistent us':>14} {'speedup':>8}")
+        for name, (func, iterations) in cases.items():
+            t_before = time_per_call(lambda: func(before), iterations, args.repeats)
+            t_after = time_per_call(lambda: func(after), iterations, args.repeats)
+            print(f"{name:<22} {t_before:>13.1f} {t_after:>14.1f} {t_before / t_after:>7.1f}x")
+        after.close()
+
+
+if __name__ == "__main__":
+    main()
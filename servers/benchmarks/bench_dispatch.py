@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""Measures the backend's per-message dispatch cost, before and after the handler registry.
+
+  before  what handle_connection used to do: decode, json.loads into a dict,
+          walk the if/elif chain on request_data.get("type"), then
+          Model.model_validate(dict), so the message is parsed twice
+  after   parse_message(): one TypeAdapter.validate_json pass over the
+          discriminated union of all packets, then a HANDLERS lookup
+
+Handlers are not run; only parsing, validation and routing are timed. Each
+message type is measured separately, plus invalid JSON and an unknown type.
+
+Example:
+    python benchmarks/bench_dispatch.py --iterations 20000 --image-size 65536
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pydantic import ValidationError
+from utils.packets import (
+    PacketLogin, PacketCreateRoom, PacketLogout, PacketJoinRoom, PacketRefresh, PacketNotify,
+    PacketStreaming, PacketScreenData, PacketRequestApp, PacketReturnApp
+)
+from utils.parser import describe_error
+from features.registry import HANDLERS, parse_message
+
+
+def sample_messages(image_size, apps):
+    return {
+        "login": {"type": "login", "username": "stu1", "password": "secret", "role": "student"},
+        "create_room": {"type": "create_room", "room_id": "room-1", "teacher": "teacher"},
+        "logout": {"type": "logout", "room_id": "room-1", "teacher": "teacher"},
+        "join_room": {"type": "join_room", "room_id": "room-1", "username": "stu1", "mssv": "21520001",
+                      "student_name": "Student One"},
+        "refresh": {"type": "refresh", "room_id": "room-1"},
+        "notify": {"type": "notify", "room_id": "room-1", "noti_message": "Quiz starts in 5 minutes"},
+        "streaming": {"type": "streaming", "target_username": "stu1"},
+        "screen_data": {"type": "screen_data", "image_data": "A" * image_size,
+                        "sender_client_id": "8c1f7a52-3d5e-4a8b-9f0e-2b6d4c9e1a77"},
+        "request_app": {"type": "request_app", "target_username": "stu1"},
+        "return_app": {"type": "return_app", "sender_client_id": "8c1f7a52-3d5e-4a8b-9f0e-2b6d4c9e1a77",
+                       "app_data": [{"process_name": f"proc{i}.exe", "main_window_title": f"Window {i}"}
+                                    for i in range(apps)]},
+    }
+
+
+def dispatch_before(data: bytes):
+    """The old handle_connection routing, with the handler calls left out."""
+    try:
+        request_data = json.loads(data.decode("utf-8"))
+        request_type = request_data.get("type")
+        if request_type == "login":
+            return PacketLogin.model_validate(request_data)
+        elif request_type == "create_room":
+            return PacketCreateRoom.model_validate(request_data)
+        elif request_type == "logout":
+            return PacketLogout.model_validate(request_data)
+        elif request_type == "join_room":
+            return PacketJoinRoom.model_validate(request_data)
+        elif request_type == "refresh":
+            return PacketRefresh.model_validate(request_data)
+        elif request_type == "notify":
+            return PacketNotify.model_validate(request_data)
+        elif request_type == "streaming":
+            return PacketStreaming.model_validate(request_data)
+        elif request_type == "screen_data":
+            return PacketScreenData.model_validate(request_data)
+        elif request_type == "request_app":
+            return PacketRequestApp.model_validate(request_data)
+        elif request_type == "return_app":
+            return PacketReturnApp.model_validate(request_data)
+        return None
+    except json.JSONDecodeError:
+        return None
+    except ValidationError:
+        return None
+
+
+def dispatch_after(data: bytes):
+    try:
+        packet = parse_message(data)
+        return HANDLERS.get(packet.type), packet
+    except ValidationError as e:
+        return describe_error(e)
+
+
+def time_per_call(func, data, iterations, repeats):
+    """Best of `repeats` runs, in microseconds per call."""
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            func(data)
+        best = min(best, (time.perf_counter() - started) / iterations)
+    return best * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend request dispatch microbenchmark")
+    parser.add_argument("--iterations", type=int, default=20000, help="Messages dispatched per timed run")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed runs per message type; the best is reported")
+    parser.add_argument("--image-size", type=int, default=16384, help="Bytes of image_data in screen_data messages")
+    parser.add_argument("--apps", type=int, default=40, help="Processes listed in return_app messages")
+    args = parser.parse_args()
+
+    cases = {name: json.dumps(message).encode("utf-8")
+             for name, message in sample_messages(args.image_size, args.apps).items()}
+    cases["(invalid json)"] = b'{"type": "login", "username": '
+    cases["(unknown type)"] = b'{"type": "no_such_type", "room_id": "room-1"}'
+
+    print(f"{'type':<16} {'bytes':>8} {'before us':>10} {'after us':>10} {'speedup':>8}")
+    for name, data in cases.items():
+        before = time_per_call(dispatch_before, data, args.iterations, args.repeats)
+        after = time_per_call(dispatch_after, data, args.iterations, args.repeats)
+        print(f"{name:<16} {len(data):>8} {before:>10.2f} {after:>10.2f} {before / after:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""Compares event loop implementations (--loop) on the LB and backend hot paths.
+
+For every loop that is installed it measures two paths with closed-loop
+clients (each waits for its answer before sending the next message):
+
+  lb       client -> LB -> fake backend -> LB -> client. The fake backend
+           answers at once, so the time is spent in the LB's forwarding.
+  backend  fake LB -> main.py -> fake LB, using the LB envelope. Requests use
+           an unknown type, so they go through framing, JSON parsing and
+           dispatch without touching the database.
+
+Reports messages per second and p50/p99 latency. The load generator always
+runs on the default asyncio loop so only the server under test changes.
+
+Example:
+    python benchmarks/bench_event_loops.py --loops asyncio,uvloop --duration 5
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+SERVERS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(SERVERS_DIR)
+
+from utils.loops import available_loops
+from bench_lb_workers import run_backend, wait_for_port, LB_SCRIPT
+
+BACKEND_SCRIPT = os.path.join(SERVERS_DIR, "main.py")
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+async def _measure(clients, warmup, duration, run_client):
+    """Runs the clients, then returns (messages per second, sorted latencies) for the measured window."""
+    latencies = []
+    state = {"recording": False}
+    tasks = [asyncio.create_task(run_client(i, latencies, state)) for i in range(clients)]
+    await asyncio.sleep(warmup)
+    state["recording"] = True
+    await asyncio.sleep(duration)
+    state["recording"] = False
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    latencies.sort()
+    return len(latencies) / duration, latencies
+
+
+async def bench_lb_path(port, clients, payload_bytes, warmup, duration):
+    payload = json.dumps({"type": "bench", "pad": "x" * payload_bytes}).encode("utf-8")
+    frame = struct.pack("!I", len(payload)) + payload
+
+    async def run_client(_, latencies, state):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            while True:
+                started = time.perf_counter()
+                writer.write(frame)
+                len_data = await reader.readexactly(4)
+                await reader.readexactly(struct.unpack("!I", len_data)[0])
+                if state["recording"]:
+                    latencies.append(time.perf_counter() - started)
+        finally:
+            writer.close()
+
+    return await _measure(clients, warmup, duration, run_client)
+
+
+async def bench_backend_path(port, clients, connections, payload_bytes, warmup, duration):
+    payload = json.dumps({"type": "bench", "pad": "x" * payload_bytes}).encode("utf-8")
+    links = [await asyncio.open_connection("127.0.0.1", port) for _ in range(connections)]
+    waiting = {} # Map: client id -> Future for its response
+
+    async def read_responses(reader):
+        while True:
+            len_data = await reader.readexactly(4)
+            message = await reader.readexactly(struct.unpack("!I", len_data)[0])
+            future = waiting.pop(message[1:1 + message[0]].decode("utf-8"), None)
+            if future and not future.done():
+                future.set_result(None)
+
+    async def run_client(i, latencies, state):
+        client_id = f"bench-{i}".encode("utf-8")
+        _, writer = links[i % connections]
+        frame = struct.pack("!IB", len(client_id) + 1 + len(payload), len(client_id)) + client_id + payload
+        loop = asyncio.get_running_loop()
+        while True:
+            future = loop.create_future()
+            waiting[client_id.decode("utf-8")] = future
+            started = time.perf_counter()
+            writer.write(frame)
+            await future
+            if state["recording"]:
+                latencies.append(time.perf_counter() - started)
+
+    readers = [asyncio.create_task(read_responses(reader)) for reader, _ in links]
+    try:
+        return await _measure(clients, warmup, duration, run_client)
+    finally:
+        for task in readers:
+            task.cancel()
+        for _, writer in links:
+            writer.close()
+
+
+def run_server(cmd, port, bench):
+    """Starts a server process, runs bench() against it and stops it again."""
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_for_port(port):
+            raise RuntimeError(f"{cmd[1]} did not start")
+        time.sleep(1.0) # LB: let it connect to the backend
+        return asyncio.run(bench())
+    finally:
+        proc.send_signal(signal.SIGINT) # Both servers shut down cleanly on Ctrl+C
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+        time.sleep(0.3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Event loop benchmark for the LB and backend")
+    parser.add_argument("--loops", type=str, default=",".join(available_loops()),
+                        help=f"Comma-separated loops to compare (default: installed ones: {','.join(available_loops())})")
+    parser.add_argument("--paths", type=str, default="lb,backend", help="Which paths to measure: lb, backend or both")
+    parser.add_argument("--clients", type=int, default=50, help="Concurrent closed-loop clients")
+    parser.add_argument("--connections", type=int, default=4, help="LB->backend connections for the backend path")
+    parser.add_argument("--payload-bytes", type=int, default=200, help="Padding in each request")
+    parser.add_argument("--warmup", type=float, default=1.0, help="Seconds of load before measuring")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds measured per loop and path")
+    parser.add_argument("--lb-port", type=int, default=8200)
+    parser.add_argument("--backend-port", type=int, default=9200)
+    args = parser.parse_args()
+
+    loops = [name.strip() for name in args.loops.split(",") if name.strip()]
+    missing = set(loops) - set(available_loops())
+    if missing:
+        parser.error(f"not installed: {', '.join(sorted(missing))}")
+    paths = [name.strip() for name in args.paths.split(",")]
+
+    fake_backend_port = args.backend_port + 1
+    fake_backend = multiprocessing.Process(target=run_backend, args=(fake_backend_port, False), daemon=True)
+    fake_backend.start()
+    if not wait_for_port(fake_backend_port):
+        parser.error("fake backend did not start")
+
+    print(f"[*] clients={args.clients} payload={args.payload_bytes}B duration={args.duration}s")
+    print(f"{'path':<9} {'loop':<9} {'msgs/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    print("-" * 47)
+    with tempfile.TemporaryDirectory(prefix="bench-loops-") as tmp:
+        servers_file = os.path.join(tmp, "servers.json")
+        with open(servers_file, "w") as f:
+            json.dump([{"host": "127.0.0.1", "port": fake_backend_port}], f)
+
+        for path in paths:
+            for loop in loops:
+                if path == "lb":
+                    cmd = [sys.executable, LB_SCRIPT, "--port", str(args.lb_port), "--loop", loop,
+                           "--servers-file", servers_file, "--health-check-interval", "0"]
+                    rate, latencies = run_server(cmd, args.lb_port, lambda: bench_lb_path(
+                        args.lb_port, args.clients, args.payload_bytes, args.warmup, args.duration))
+                elif path == "backend":
+                    cmd = [sys.executable, BACKEND_SCRIPT, "--port", str(args.backend_port), "--loop", loop,
+                           "--no-register"]
+                    rate, latencies = run_server(cmd, args.backend_port, lambda: bench_backend_path(
+                        args.backend_port, args.clients, args.connections, args.payload_bytes,
+                        args.warmup, args.duration))
+                else:
+                    parser.error(f"unknown path: {path}")
+                print(f"{path:<9} {loop:<9} {rate:>9.0f} {percentile(latencies, 50) * 1000:>8.2f} "
+                      f"{percentile(latencies, 99) * 1000:>8.2f}")
+
+    fake_backend.terminate()
+
+
+if __name__ == "__main__":
+    main()
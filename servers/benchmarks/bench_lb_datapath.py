@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""Compares the LB's backend transports (--transport streams|buffered).
+
+Two measurements:
+
+  micro  In one process, a sender streams v2 response frames over a local
+         TCP connection and a receiver splits them the way the LB does:
+         StreamReader.readexactly() plus slicing, or BackendFrameProtocol
+         with memoryview parsing. Reports frames/s, MB/s and the peak of
+         Python allocations (tracemalloc, measured in a separate pass so
+         it does not slow the timed one).
+  e2e    Starts the LB with each transport in front of a fake v2 backend
+         that answers every request with --response-bytes, and drives it
+         with closed-loop clients. Reports responses/s, MB/s, LB CPU
+         seconds per GB forwarded and the LB's peak RSS.
+
+Example:
+    python benchmarks/bench_lb_datapath.py --modes micro,e2e --response-bytes 200000
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+SERVERS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(SERVERS_DIR)
+sys.path.append(os.path.join(SERVERS_DIR, "loadbalancer"))
+
+from utils.envelope import EnvelopeCodec, PROTOCOL_V1, PROTOCOL_V2, KIND_CONTROL, KIND_RESPONSE, V2_HEADER_SIZE
+from zerocopy import BackendFrameProtocol
+from bench_lb_workers import wait_for_port, LB_SCRIPT
+
+TRANSPORTS = ("streams", "buffered")
+CLIENT_ID = "00000000-0000-4000-8000-000000000001"
+
+
+def response_payload(size):
+    pad = max(0, size - 40)
+    return json.dumps({"type": "screen_data", "pad": "x" * pad}).encode("utf-8")
+
+
+# --- micro: receive path only ---
+
+async def _micro(transport, frame_bytes, frames, trace):
+    codec = EnvelopeCodec(PROTOCOL_V2)
+    frame = codec.encode(KIND_RESPONSE, CLIENT_ID, response_payload(frame_bytes))
+    batch = frame * max(1, (1 << 20) // len(frame)) # About 1 MB per write
+    per_batch = len(batch) // len(frame)
+    batches = max(1, frames // per_batch)
+    total = batches * per_batch
+    done = asyncio.get_running_loop().create_future()
+    received = [0, 0] # frames, payload bytes
+
+    def on_frame(message):
+        payload = bytes(message[V2_HEADER_SIZE:]) # The LB copies each payload out exactly once too
+        received[0] += 1
+        received[1] += len(payload)
+        if received[0] == total and not done.done():
+            done.set_result(None)
+
+    async def send(_, writer):
+        for _ in range(batches):
+            writer.write(batch)
+            await writer.drain()
+        await done
+        writer.close()
+
+    server = await asyncio.start_server(send, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    loop = asyncio.get_running_loop()
+    if trace:
+        tracemalloc.start()
+    started = time.perf_counter()
+    if transport == "buffered":
+        _, protocol = await loop.create_connection(lambda: BackendFrameProtocol(10 * 1024 * 1024), "127.0.0.1", port)
+        protocol.set_frame_handler(on_frame)
+        await done
+        protocol.close()
+    else:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        while received[0] < total:
+            len_data = await reader.readexactly(4)
+            on_frame(await reader.readexactly(struct.unpack("!I", len_data)[0]))
+        writer.close()
+    elapsed = time.perf_counter() - started
+    peak = 0
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    server.close()
+    await server.wait_closed()
+    return total / elapsed, received[1] / elapsed, peak
+
+
+def run_micro(args):
+    print(f"[*] micro: {args.frames} frames of {args.response_bytes}B")
+    print(f"{'transport':<10} {'frames/s':>10} {'MB/s':>9} {'peak alloc KB':>14}")
+    print("-" * 46)
+    for transport in TRANSPORTS:
+        rate, byte_rate, _ = asyncio.run(_micro(transport, args.response_bytes, args.frames, False))
+        _, _, peak = asyncio.run(_micro(transport, args.response_bytes, max(1, args.frames // 4), True))
+        print(f"{transport:<10} {rate:>10.0f} {byte_rate / 1e6:>9.1f} {peak / 1024:>14.0f}")
+
+
+# --- e2e: client -> LB -> fake backend -> LB -> client ---
+
+async def _serve_backend(port, response_bytes):
+    payload = response_payload(response_bytes)
+
+    async def handle(reader, writer):
+        codec = EnvelopeCodec(PROTOCOL_V1)
+        try:
+            while True:
+                len_data = await reader.readexactly(4)
+                kind, _, client_id, data = codec.decode(await reader.readexactly(struct.unpack("!I", len_data)[0]))
+                if kind == KIND_CONTROL:
+                    control = json.loads(data)
+                    if control.get("type") == "hello":
+                        writer.write(codec.encode(KIND_CONTROL, None, json.dumps(
+                            {"type": "hello", "version": max(control.get("versions", [PROTOCOL_V1]))}).encode()))
+                        codec.version = max(control.get("versions", [PROTOCOL_V1]))
+                    else:
+                        writer.write(codec.encode(KIND_CONTROL, None, json.dumps(
+                            {"type": "pong", "seq": control.get("seq")}).encode()))
+                    continue
+                writer.write(codec.encode(KIND_RESPONSE, client_id, payload))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError, BrokenPipeError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", port)
+    async with server:
+        await server.serve_forever()
+
+
+def run_backend(port, response_bytes):
+    try:
+        asyncio.run(_serve_backend(port, response_bytes))
+    except KeyboardInterrupt:
+        pass
+
+
+def read_proc_stats(pid):
+    """Returns (CPU seconds used, peak RSS in KB) of a process, from /proc."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    peak_rss = 0
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                peak_rss = int(line.split()[1])
+    return cpu, peak_rss
+
+
+async def _drive_lb(port, clients, warmup, duration):
+    request = json.dumps({"type": "bench"}).encode("utf-8")
+    frame = struct.pack("!I", len(request)) + request
+    counts = [0, 0] # responses, payload bytes
+    state = {"recording": False}
+
+    async def run_client():
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            while True:
+                writer.write(frame)
+                len_data = await reader.readexactly(4)
+                size = struct.unpack("!I", len_data)[0]
+                await reader.readexactly(size)
+                if state["recording"]:
+                    counts[0] += 1
+                    counts[1] += size
+        finally:
+            writer.close()
+
+    tasks = [asyncio.create_task(run_client()) for _ in range(clients)]
+    await asyncio.sleep(warmup)
+    state["recording"] = True
+    await asyncio.sleep(duration)
+    state["recording"] = False
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return counts
+
+
+def run_e2e(args):
+    backend = multiprocessing.Process(target=run_backend, args=(args.backend_port, args.response_bytes), daemon=True)
+    backend.start()
+    if not wait_for_port(args.backend_port):
+        raise SystemExit("[!] fake backend did not start")
+
+    print(f"[*] e2e: clients={args.clients} response={args.response_bytes}B loop={args.loop} duration={args.duration}s")
+    print(f"{'transport':<10} {'responses/s':>12} {'MB/s':>9} {'CPU s/GB':>9} {'peak RSS MB':>12}")
+    print("-" * 56)
+    with tempfile.TemporaryDirectory(prefix="bench-datapath-") as tmp:
+        servers_file = os.path.join(tmp, "servers.json")
+        with open(servers_file, "w") as f:
+            json.dump([{"host": "127.0.0.1", "port": args.backend_port}], f)
+        for transport in TRANSPORTS:
+            lb = subprocess.Popen(
+                [sys.executable, LB_SCRIPT, "--port", str(args.lb_port), "--transport", transport,
+                 "--loop", args.loop, "--servers-file", servers_file, "--health-check-interval", "0"],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            try:
+                if not wait_for_port(args.lb_port):
+                    raise RuntimeError("load balancer did not start")
+                time.sleep(1.0) # Let it connect to the backend
+                cpu_before, _ = read_proc_stats(lb.pid)
+                responses, payload_bytes = asyncio.run(_drive_lb(args.lb_port, args.clients, args.warmup, args.duration))
+                cpu_after, peak_rss = read_proc_stats(lb.pid)
+                # CPU is sampled around warmup + duration; scale it to the measured window
+                cpu = (cpu_after - cpu_before) * args.duration / (args.warmup + args.duration)
+                gb = payload_bytes / 1e9
+                print(f"{transport:<10} {responses / args.duration:>12.0f} {payload_bytes / 1e6 / args.duration:>9.1f} "
+                      f"{(cpu / gb if gb else 0):>9.2f} {peak_rss / 1024:>12.1f}")
+            finally:
+                lb.terminate()
+                lb.wait()
+                time.sleep(0.5) # Let the port go before the next run
+    backend.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LB backend transport benchmark (streams vs buffered)")
+    parser.add_argument("--modes", type=str, default="micro,e2e", help="Which measurements to run: micro, e2e or both")
+    parser.add_argument("--response-bytes", type=int, default=200 * 1024,
+                        help="Size of each backend response (default: a 200 KB screen frame)")
+    parser.add_argument("--frames", type=int, default=20000, help="Frames received per transport (micro)")
+    parser.add_argument("--clients", type=int, default=20, help="Concurrent closed-loop clients (e2e)")
+    parser.add_argument("--loop", type=str, default="asyncio", help="--loop passed to the LB (e2e)")
+    parser.add_argument("--warmup", type=float, default=1.0, help="Seconds of load before measuring (e2e)")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds measured per transport (e2e)")
+    parser.add_argument("--lb-port", type=int, default=8300)
+    parser.add_argument("--backend-port", type=int, default=9300)
+    args = parser.parse_args()
+
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    for mode in modes:
+        if mode == "micro":
+            run_micro(args)
+        elif mode == "e2e":
+            run_e2e(args)
+        else:
+            parser.error(f"unknown mode: {mode}")
+
+
+if __name__ == "__main__":
+    main()
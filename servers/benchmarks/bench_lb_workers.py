@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""Measures load balancer throughput with 1, 2, 4 and 8 --workers.
+
+Starts a few fake backends that answer every frame straight away (and, with
+--push, also push a frame to another random client, which usually belongs to
+a different LB worker and has to be forwarded), then drives the LB from
+several client processes that each keep --window requests outstanding per
+connection. Reports frames delivered to clients per second for each worker
+count. Scaling is bounded by the cores on the machine: the LB workers, the
+fake backends and the load generators all compete for them.
+
+Example:
+    python benchmarks/bench_lb_workers.py --workers 1,2,4,8 --push
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+LB_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "loadbalancer", "loadbalancer.py")
+
+RESPONSE = json.dumps({"status": "success", "message": "ok"}).encode("utf-8")
+
+
+# --- Fake backend ---
+
+def _backend_frame(client_id_bytes, payload):
+    return struct.pack("!IB", len(client_id_bytes) + 1 + len(payload), len(client_id_bytes)) + client_id_bytes + payload
+
+
+async def _serve_backend(port, push):
+    known_clients = []
+    seen = set()
+    rng = random.Random(port)
+
+    async def handle(reader, writer):
+        # Clients are forgotten with the LB connection that brought them, so a
+        # later run never pushes to clients of an LB that has already exited
+        local = set()
+        try:
+            while True:
+                len_data = await reader.readexactly(4)
+                message = await reader.readexactly(struct.unpack("!I", len_data)[0])
+                client_id_bytes = message[1:1 + message[0]]
+                if not client_id_bytes:
+                    # LB health-check ping
+                    ping = json.loads(message[1:])
+                    writer.write(_backend_frame(b"", json.dumps({"type": "pong", "seq": ping.get("seq")}).encode()))
+                    continue
+                if client_id_bytes not in seen:
+                    seen.add(client_id_bytes)
+                    local.add(client_id_bytes)
+                    known_clients.append(client_id_bytes)
+                writer.write(_backend_frame(client_id_bytes, RESPONSE))
+                if push:
+                    target = known_clients[rng.randrange(len(known_clients))]
+                    writer.write(_backend_frame(target, b'{"type": "bench_push", "payload": "' + b"x" * 64 + b'"}'))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError, BrokenPipeError, OSError):
+            pass
+        finally:
+            seen.difference_update(local)
+            known_clients[:] = [c for c in known_clients if c not in local]
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", port)
+    async with server:
+        await server.serve_forever()
+
+
+def run_backend(port, push):
+    try:
+        asyncio.run(_serve_backend(port, push))
+    except KeyboardInterrupt:
+        pass
+
+
+# --- Load generator ---
+
+async def _client(port, window, payload, counts, start_at):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    credits = asyncio.Semaphore(window)
+    frame = struct.pack("!I", len(payload)) + payload
+
+    async def send_loop():
+        while True:
+            await credits.acquire()
+            writer.write(frame)
+            await writer.drain()
+
+    await asyncio.sleep(max(0.0, start_at - time.time()))
+    sender = asyncio.create_task(send_loop())
+    try:
+        while True:
+            len_data = await reader.readexactly(4)
+            data = await reader.readexactly(struct.unpack("!I", len_data)[0])
+            if data.startswith(b'{"status"'):
+                counts[0] += 1
+                credits.release()
+            else:
+                counts[1] += 1
+    except (asyncio.IncompleteReadError, ConnectionResetError, OSError, asyncio.CancelledError):
+        pass
+    finally:
+        sender.cancel()
+        writer.close()
+
+
+async def _generate_load(port, clients, window, payload_bytes, start_at, warmup, duration):
+    counts = [0, 0] # responses, pushes
+    payload = json.dumps({"type": "bench", "pad": "x" * payload_bytes}).encode("utf-8")
+    tasks = [asyncio.create_task(_client(port, window, payload, counts, start_at)) for _ in range(clients)]
+    await asyncio.sleep(max(0.0, start_at + warmup - time.time()))
+    before = list(counts)
+    await asyncio.sleep(duration)
+    after = list(counts)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return after[0] - before[0], after[1] - before[1]
+
+
+def run_load(port, clients, window, payload_bytes, start_at, warmup, duration, results):
+    results.put(asyncio.run(_generate_load(port, clients, window, payload_bytes, start_at, warmup, duration)))
+
+
+# --- Driver ---
+
+def wait_for_port(port, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def measure(args, workers, servers_file):
+    lb = subprocess.Popen(
+        [sys.executable, LB_SCRIPT, "--port", str(args.lb_port), "--workers", str(workers),
+         "--servers-file", servers_file, "--health-check-interval", "0", "--pool-size", str(args.pool_size)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        if not wait_for_port(args.lb_port):
+            raise RuntimeError("load balancer did not start")
+        time.sleep(1.0 + 0.2 * workers) # Let every worker connect to the backends and its peers
+
+        results = multiprocessing.Queue()
+        start_at = time.time() + 1.0
+        per_proc = max(1, args.clients // args.client_procs)
+        procs = [
+            multiprocessing.Process(target=run_load, args=(args.lb_port, per_proc, args.window, args.payload_bytes,
+                                                           start_at, args.warmup, args.duration, results))
+            for _ in range(args.client_procs)
+        ]
+        for proc in procs:
+            proc.start()
+        totals = [0, 0]
+        for _ in procs:
+            responses, pushes = results.get()
+            totals[0] += responses
+            totals[1] += pushes
+        for proc in procs:
+            proc.join()
+        return totals[0] / args.duration, totals[1] / args.duration
+    finally:
+        lb.terminate()
+        lb.wait()
+        time.sleep(0.5) # Let the port go before the next run
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load balancer --workers throughput benchmark")
+    parser.add_argument("--workers", type=str, default="1,2,4,8", help="Comma-separated worker counts to compare")
+    parser.add_argument("--backends", type=int, default=2, help="Fake backend processes")
+    parser.add_argument("--clients", type=int, default=400, help="Client connections in total")
+    parser.add_argument("--client-procs", type=int, default=4, help="Processes generating the load")
+    parser.add_argument("--window", type=int, default=4, help="Requests outstanding per client connection")
+    parser.add_argument("--payload-bytes", type=int, default=200, help="Padding in each request")
+    parser.add_argument("--pool-size", type=int, default=1, help="--pool-size passed to the LB")
+    parser.add_argument("--push", action="store_true",
+                        help="Backends also push one frame to a random client per request (exercises forwarding)")
+    parser.add_argument("--warmup", type=float, default=1.0, help="Seconds of load before measuring")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds measured per worker count")
+    parser.add_argument("--lb-port", type=int, default=8100)
+    parser.add_argument("--backend-port", type=int, default=9100)
+    args = parser.parse_args()
+
+    backend_ports = [args.backend_port + i for i in range(args.backends)]
+    backends = [multiprocessing.Process(target=run_backend, args=(port, args.push), daemon=True)
+                for port in backend_ports]
+    for backend in backends:
+        backend.start()
+    for port in backend_ports:
+        if not wait_for_port(port):
+            parser.error(f"fake backend on port {port} did not start")
+
+    with tempfile.TemporaryDirectory(prefix="bench-lb-") as tmp:
+        servers_file = os.path.join(tmp, "servers.json")
+        with open(servers_file, "w") as f:
+            json.dump([{"host": "127.0.0.1", "port": port} for port in backend_ports], f)
+
+        print(f"[*] cpus={os.cpu_count()} backends={args.backends} clients={args.clients} window={args.window} "
+              f"push={args.push} duration={args.duration}s")
+        print(f"{'workers':>8} {'responses/s':>12} {'pushes/s':>10} {'frames/s':>10} {'speedup':>8}")
+        print("-" * 52)
+        baseline = None
+        for workers in [int(v) for v in args.workers.split(",")]:
+            responses, pushes = measure(args, workers, servers_file)
+            total = responses + pushes
+            if baseline is None:
+                baseline = total or 1.0
+            print(f"{workers:>8} {responses:>12.0f} {pushes:>10.0f} {total:>10.0f} {total / baseline:>7.2f}x")
+
+    for backend in backends:
+        backend.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Compares tail latency of the LB backend selection strategies under skewed load.
+
+Runs a discrete-event simulation: requests arrive as a Poisson stream and each
+backend serves its queue one request at a time, like the backend's
+handle_connection loop. Backends run at different speeds (e.g. one stuck
+hashing passwords), so strategies that ignore load queue work behind the slow
+one. The selectors are the real classes from loadbalancer/balancing.py.
+
+Example:
+    python benchmarks/bench_selectors.py --speeds 1,1,1,0.2 --utilization 0.8
+"""
+import argparse
+import heapq
+import os
+import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "loadbalancer"))
+
+from balancing import Backend, make_selector, SELECTION_STRATEGIES
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def simulate(strategy, speeds, weights, utilization, mean_service_ms, requests, clients, seed):
+    rng = random.Random(seed)
+    selector = make_selector(strategy)
+    backends = [Backend("sim", 9000 + i, weight) for i, weight in enumerate(weights)]
+    selector.set_members(backends)
+    if hasattr(selector, "_rng"):
+        selector._rng = random.Random(seed + 1)
+
+    capacity = sum(speeds) / mean_service_ms # requests per ms
+    arrival_rate = capacity * utilization
+    free_at = [0.0] * len(backends)
+    completions = [] # heap of (finish_time, backend_index)
+    latencies = []
+    now = 0.0
+    index_of = {backend: i for i, backend in enumerate(backends)}
+
+    for _ in range(requests):
+        now += rng.expovariate(arrival_rate)
+        # Retire everything that finished before this arrival so in-flight counts are current
+        while completions and completions[0][0] <= now:
+            _, finished = heapq.heappop(completions)
+            selector.on_complete(backends[finished])
+
+        backend = selector.pick(f"client-{rng.randrange(clients)}")
+        i = index_of[backend]
+        selector.on_dispatch(backend)
+        service = rng.expovariate(1.0 / mean_service_ms) / speeds[i]
+        finish = max(now, free_at[i]) + service
+        free_at[i] = finish
+        heapq.heappush(completions, (finish, i))
+        latencies.append(finish - now)
+
+    latencies.sort()
+    return {
+        "mean": sum(latencies) / len(latencies),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "p999": percentile(latencies, 99.9),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend selection strategy tail-latency benchmark")
+    parser.add_argument("--speeds", type=str, default="1,1,1,0.2",
+                        help="Comma-separated relative speed of each backend (default: 1,1,1,0.2)")
+    parser.add_argument("--weights", type=str, default=None,
+                        help="Comma-separated weights for 'weighted' and 'rendezvous' (default: proportional to speeds)")
+    parser.add_argument("--utilization", type=float, default=0.8, help="Offered load as a fraction of total capacity")
+    parser.add_argument("--service-ms", type=float, default=2.0, help="Mean service time on a speed-1 backend")
+    parser.add_argument("--requests", type=int, default=200000, help="Requests simulated per strategy")
+    parser.add_argument("--clients", type=int, default=1000, help="Distinct client ids sending the requests")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    speeds = [float(v) for v in args.speeds.split(",")]
+    if args.weights:
+        weights = [int(v) for v in args.weights.split(",")]
+    else:
+        weights = [max(1, round(speed * 10)) for speed in speeds]
+    if len(weights) != len(speeds):
+        parser.error("--weights must list one weight per backend")
+
+    print(f"[*] Backends: speeds={speeds} weights={weights} utilization={args.utilization:.0%} "
+          f"requests={args.requests} clients={args.clients}")
+    print(f"{'strategy':<18} {'mean ms':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'p99.9':>9}")
+    print("-" * 66)
+    for strategy in sorted(SELECTION_STRATEGIES):
+        result = simulate(strategy, speeds, weights, args.utilization, args.service_ms, args.requests,
+                          args.clients, args.seed)
+        print(f"{strategy:<18} {result['mean']:>9.2f} {result['p50']:>9.2f} {result['p95']:>9.2f} "
+              f"{result['p99']:>9.2f} {result['p999']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""Awaitable access to ClassroomDatabase, with every query run off the event loop.
+
+ClassroomDatabase is synchronous, and sqlite3 waits up to its busy timeout
+(10 s) for a lock held by another connection. Called from a handler, that
+wait froze the whole backend. AsyncClassroomDatabase runs the same methods
+on dedicated threads instead:
+
+  - reads on a small pool of reader threads (WAL lets them run alongside a
+    writer);
+  - writes on a single writer thread, coalesced: writes issued while the
+    writer is busy, or in the same event loop tick, go to SQLite together
+    in one transaction (ClassroomDatabase.batch). Each keeps its own result
+    and errors, and resolves once the transaction has committed.
+
+The threads hand the timings of the cursor blocks they ran back with each
+result (ClassroomDatabase.collect_query_times), and the query metrics are
+updated from them on the event loop, their only writer.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import bcrypt
+
+from database.sqlite_db import ClassroomDatabase
+
+DEFAULT_READERS = 4
+DEFAULT_MAX_BATCH = 256
+
+
+QueryTimes = List[Tuple[float, bool]]
+
+
+def _run_call(db: ClassroomDatabase, func: Callable, args: tuple) -> Tuple[bool, object, QueryTimes]:
+    # Runs on a reader thread. Returns (ok, result or exception, the cursor blocks' timings).
+    with db.collect_query_times() as times:
+        try:
+            return True, func(*args), times
+        except Exception as e:
+            return False, e, times
+
+
+def _run_batch(db: ClassroomDatabase, calls: List[Tuple[Callable, tuple]]
+               ) -> Tuple[Optional[Exception], List[Tuple[bool, object]], QueryTimes]:
+    # Runs on the writer thread. Returns (the transaction's own error if it failed, (ok, result or
+    # exception) per call in order, the cursor blocks' timings).
+    results = []
+    with db.collect_query_times() as times:
+        try:
+            with db.batch():
+                for func, args in calls:
+                    try:
+                        results.append((True, func(*args)))
+                    except Exception as e:
+                        results.append((False, e))
+        except Exception as e:
+            return e, results, times
+    return None, results, times
+
+
+class AsyncClassroomDatabase:
+    def __init__(self, db: ClassroomDatabase, readers: int = DEFAULT_READERS, max_batch: int = DEFAULT_MAX_BATCH):
+        self.sync_db = db
+        self.max_batch = max_batch
+        self.password_verifier = None # Optional PasswordVerifier; authenticate checks passwords on a reader thread without one
+        self.on_query_time = None # Optional callable(seconds), told how long each call took, waiting included; runs on the loop
+        self.on_cursor_time = None # Optional callable(seconds), told how long each cursor block took; runs on the loop
+        self._readers = ThreadPoolExecutor(readers, thread_name_prefix="db-read")
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix="db-write")
+        self._writes: List[Tuple[Callable, tuple, asyncio.Future]] = [] # Not yet handed to the writer thread
+        self._write_task: Optional[asyncio.Task] = None
+        self.write_batches = 0 # Transactions committed by the writer thread
+        self.batched_writes = 0 # Writes in those transactions
+        # Totals over every cursor block, for metrics
+        self.query_count = 0
+        self.query_errors = 0
+        self.query_seconds = 0.0
+
+    @property
+    def writes_waiting(self) -> int:
+        return len(self._writes)
+
+    def close(self):
+        self._readers.shutdown(wait=True, cancel_futures=True)
+        self._writer.shutdown(wait=True) # Let a batch in progress commit
+        self.sync_db.close()
+
+    def _waited(self, started: float):
+        if self.on_query_time:
+            self.on_query_time(time.perf_counter() - started)
+
+    def _count_queries(self, times: QueryTimes):
+        for seconds, failed in times:
+            self.query_count += 1
+            self.query_seconds += seconds
+            if failed:
+                self.query_errors += 1
+            if self.on_cursor_time:
+                self.on_cursor_time(seconds)
+
+    async def _read(self, func: Callable, *args):
+        started = time.perf_counter()
+        try:
+            ok, value, times = await asyncio.get_running_loop().run_in_executor(
+                self._readers, _run_call, self.sync_db, func, args)
+        finally:
+            self._waited(started)
+        self._count_queries(times)
+        if not ok:
+            raise value
+        return value
+
+    async def _write(self, func: Callable, *args):
+        started = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self._writes.append((func, args, future))
+        if self._write_task is None:
+            self._write_task = asyncio.create_task(self._write_batches(), name="DBWriter")
+        try:
+            return await future
+        finally:
+            self._waited(started)
+
+    async def _write_batches(self):
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.sleep(0) # Writes issued in the rest of this tick join the first batch
+            while self._writes:
+                batch, self._writes = self._writes[:self.max_batch], self._writes[self.max_batch:]
+                calls = [(func, args) for func, args, _ in batch]
+                try:
+                    error, results, times = await loop.run_in_executor(self._writer, _run_batch, self.sync_db, calls)
+                    self._count_queries(times)
+                    if error is not None:
+                        raise error
+                except Exception as e:
+                    # The transaction itself failed (e.g. still locked after the busy timeout): nothing was written
+                    print(f"[!] DB write batch of {len(batch)} failed: {type(e).__name__} - {e}")
+                    for _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                self.write_batches += 1
+                self.batched_writes += len(batch)
+                for (_, _, future), (ok, value) in zip(batch, results):
+                    if future.done(): # The caller was cancelled
+                        continue
+                    if ok:
+                        future.set_result(value)
+                    else:
+                        future.set_exception(value)
+        finally:
+            self._write_task = None
+
+    # --- User Authentication ---
+
+    async def authenticate(self, username: str, password: str, role: str) -> bool:
+        """Checks a login. The bcrypt check runs in password_verifier if there is one, else on a reader thread.
+
+        Raises AuthQueueFull (utils.auth_pool) if the verifier has too many checks waiting.
+        """
+        hashed_pw = await self._read(self.sync_db.get_password_hash, username, role)
+        if not hashed_pw:
+            return False
+        if self.password_verifier is not None:
+            return await self.password_verifier.verify(password, hashed_pw)
+        # On a reader thread (bcrypt releases the GIL), and not counted as database time
+        return await asyncio.get_running_loop().run_in_executor(
+            self._readers, bcrypt.checkpw, password.encode('utf-8'), hashed_pw.encode('utf-8'))
+
+    async def get_role(self, username: str) -> Optional[str]:
+        return await self._read(self.sync_db.get_role, username)
+
+    # --- Active Client Mapping ---
+
+    async def register_client(self, username: str, client_id: str) -> bool:
+        return await self._write(self.sync_db.register_client, username, client_id)
+
+    async def unregister_client(self, username: str) -> bool:
+        return await self._write(self.sync_db.unregister_client, username)
+
+    async def unregister_client_by_id(self, client_id: str) -> bool:
+        return await self._write(self.sync_db.unregister_client_by_id, client_id)
+
+    async def unregister_clients_by_ids(self, client_ids: List[str]) -> int:
+        return await self._write(self.sync_db.unregister_clients_by_ids, client_ids)
+
+    async def get_client_id(self, username: str) -> Optional[str]:
+        return await self._read(self.sync_db.get_client_id, username)
+
+    async def get_client_ids(self, usernames: List[str]) -> Dict[str, str]:
+        return await self._read(self.sync_db.get_client_ids, usernames)
+
+    async def get_username(self, client_id: str) -> Optional[str]:
+        return await self._read(self.sync_db.get_username, client_id)
+
+    # --- Room Management ---
+
+    async def create_room(self, room_id: str, teacher: str) -> bool:
+        return await self._write(self.sync_db.create_room, room_id, teacher)
+
+    async def get_room_teacher(self, room_id: str) -> Optional[str]:
+        return await self._read(self.sync_db.get_room_teacher, room_id)
+
+    async def room_exists(self, room_id: str) -> bool:
+        return await self._read(self.sync_db.room_exists, room_id)
+
+    async def delete_room(self, room_id: str) -> bool:
+        return await self._write(self.sync_db.delete_room, room_id)
+
+    # --- Participant Management ---
+
+    async def join_room(self, room_id: str, student_username: str, student_name: str, mssv: str) -> bool:
+        return await self._write(self.sync_db.join_room, room_id, student_username, student_name, mssv)
+
+    async def leave_room(self, room_id: str, student_username: str) -> bool:
+        return await self._write(self.sync_db.leave_room, room_id, student_username)
+
+    async def get_students_in_room(self, room_id: str) -> List[str]:
+        return await self._read(self.sync_db.get_students_in_room, room_id)
+
+    async def get_room_participants(self, room_id: str) -> List[Dict]:
+        return await self._read(self.sync_db.get_room_participants, room_id)
+
+    async def leave_all_rooms(self, username: str) -> bool:
+        return await self._write(self.sync_db.leave_all_rooms, username)
+
+    # --- Sessions ---
+
+    async def add_active_session(self, username: str) -> None:
+        return await self._write(self.sync_db.add_active_session, username)
+
+    async def remove_active_session(self, username: str) -> None:
+        return await self._write(self.sync_db.remove_active_session, username)
+
+    async def get_active_session(self, username: str) -> bool:
+        return await self._read(self.sync_db.get_active_session, username)
@@ -1,40 +1,140 @@
 
 import sqlite3
 from contextlib import contextmanager
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 import os
 import datetime
+import time
+import threading
 import bcrypt
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
 default_db_path = os.path.join(script_dir, 'classroom.db')
 
+# Statements each connection keeps compiled; the queries below are few and always the same
+DEFAULT_CACHED_STATEMENTS = 256
+# Applied once per connection when it is opened
+CONNECTION_PRAGMAS = (
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA journal_mode = WAL",     # Readers and one writer at the same time
+    "PRAGMA synchronous = NORMAL",   # With WAL: no fsync per commit; a power cut may lose the last commits, not corrupt
+    "PRAGMA cache_size = -16384",    # Page cache of 16 MiB per connection
+    "PRAGMA mmap_size = 67108864",   # Read the file through a 64 MiB memory map
+    "PRAGMA temp_store = MEMORY",
+)
+# Usernames per IN (...) lookup; older SQLite builds allow at most 999 parameters per statement
+MAX_LOOKUP_PARAMS = 500
+
 class ClassroomDatabase:
     """SQLite database for users, rooms, participants, and active client mappings."""
     def __init__(self, db_path: str = default_db_path):
         self.db_path = db_path
+        # Per thread: its long-lived connection, whether a batch() is open on it, and the
+        # list collect_query_times() is filling, if any
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = [] # Every thread's connection, for close()
+        self._connections_lock = threading.Lock()
         self._initialize_db()
 
+    def _connection(self) -> sqlite3.Connection:
+        """Returns this thread's connection, opening it on first use. Connections stay open until close()."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Only ever used by this thread; not checking lets close() run from another one
+            conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False,
+                                   cached_statements=DEFAULT_CACHED_STATEMENTS)
+            for pragma in CONNECTION_PRAGMAS:
+                conn.execute(pragma)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        """Closes every thread's connection. Call once no thread is using the database any more."""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                print(f"[!] DB Error closing connection: {e}")
+        self._local = threading.local()
+
+    @contextmanager
+    def batch(self):
+        """Runs every cursor block opened inside it on this thread in one transaction, committed at the end.
+
+        Each cursor block gets a savepoint, so one that fails is rolled back on
+        its own (as it would have been outside the batch) and the rest still
+        commit. Used by AsyncClassroomDatabase to coalesce writes.
+        """
+        conn = self._connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE") # Take the write lock up front rather than upgrading to it midway
+            self._local.batch_conn = conn
+            try:
+                yield
+            finally:
+                self._local.batch_conn = None
+            conn.commit()
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
+    @contextmanager
+    def collect_query_times(self) -> Iterator[List[Tuple[float, bool]]]:
+        """Collects (seconds, failed) for every cursor block this thread runs inside it.
+
+        Timings are handed back to the caller rather than counted here, so
+        that the thread owning the metrics (the event loop, in
+        AsyncClassroomDatabase) is the only one writing them.
+        """
+        times: List[Tuple[float, bool]] = []
+        self._local.query_times = times
+        try:
+            yield times
+        finally:
+            self._local.query_times = None
+
     @contextmanager
     def _get_cursor(self, commit_on_exit: bool = True):
         """Provides a database cursor within a context manager."""
-        # Using WAL mode can improve concurrency for readers and one writer
-        conn = sqlite3.connect(self.db_path, timeout=10) # Add timeout
-        conn.execute("PRAGMA foreign_keys = ON")  # 
-        conn.execute("PRAGMA journal_mode=WAL;") # Enable WAL mode
-        conn.row_factory = sqlite3.Row
+        started = time.perf_counter()
+        failed = False
+        batch_conn = getattr(self._local, "batch_conn", None)
+        if batch_conn is not None:
+            conn = batch_conn
+            conn.execute("SAVEPOINT cursor_block")
+        else:
+            conn = self._connection()
+        cursor = conn.cursor()
         try:
-            cursor = conn.cursor()
             yield cursor
-            if commit_on_exit:
+            if batch_conn is not None:
+                conn.execute("RELEASE cursor_block")
+            elif commit_on_exit:
                 conn.commit()
-        except sqlite3.Error as e:
-            print(f"[!] Database Error: {e}")
-            if commit_on_exit:
+        except Exception as e:
+            if isinstance(e, sqlite3.Error):
+                print(f"[!] Database Error: {e}")
+                failed = True
+            if batch_conn is not None:
+                # Undo this block only; the batch's transaction carries on
+                conn.execute("ROLLBACK TO cursor_block")
+                conn.execute("RELEASE cursor_block")
+            elif commit_on_exit:
                  conn.rollback()
             raise # Re-raise the exception after logging/rollback
         finally:
-            conn.close()
+            cursor.close()
+            if batch_conn is None and conn.in_transaction:
+                conn.rollback() # Nothing is left open on the connection for the next block
+            times = getattr(self._local, "query_times", None)
+            if times is not None:
+                times.append((time.perf_counter() - started, failed))
         
     def fetch_all(self, query: str, params: tuple = ()) -> List[sqlite3.Row]:
         try:
@@ -115,18 +215,21 @@ class ClassroomDatabase:
             print("[*] Database initialized/verified.")
 
     # --- User Authentication --- 
-    def authenticate(self, username: str, password: str, role: str) -> bool:
+    def get_password_hash(self, username: str, role: str) -> Optional[str]:
         with self._get_cursor(commit_on_exit=False) as cursor:
             cursor.execute('''
                 SELECT password FROM users 
                 WHERE username = ? AND role = ?
             ''', (username, role))
             row = cursor.fetchone()
-            if row:
-                hashed_pw = row['password']
-                # bcrypt expects bytes
-                return bcrypt.checkpw(password.encode('utf-8'), hashed_pw.encode('utf-8'))
-            return False
+            return row['password'] if row else None
+
+    def authenticate(self, username: str, password: str, role: str) -> bool:
+        hashed_pw = self.get_password_hash(username, role)
+        if hashed_pw:
+            # bcrypt expects bytes
+            return bcrypt.checkpw(password.encode('utf-8'), hashed_pw.encode('utf-8'))
+        return False
 
     def get_role(self, username: str) -> Optional[str]:
         with self._get_cursor(commit_on_exit=False) as cursor:
@@ -200,6 +303,21 @@ class ClassroomDatabase:
             print(f"[!] DB Error unregistering client by ClientID 	'{client_id}': {e}")
             return False
 
+    def unregister_clients_by_ids(self, client_ids: List[str]) -> int:
+        """Removes the active client mappings of several client_ids in one transaction. Returns how many were removed."""
+        if not client_ids:
+            return 0
+        try:
+            with self._get_cursor() as cursor:
+                cursor.executemany("DELETE FROM active_clients WHERE client_id = ?", [(c,) for c in client_ids])
+                removed = cursor.rowcount
+                if removed > 0:
+                    print(f"[*] DB: Unregistered {removed} client(s) in one batch of {len(client_ids)} ClientID(s).")
+                return max(removed, 0)
+        except sqlite3.Error as e:
+            print(f"[!] DB Error unregistering {len(client_ids)} client(s) by ClientID: {e}")
+            return 0
+
     def get_client_id(self, username: str) -> Optional[str]:
         """Retrieves the active client_id for a username."""
         try:
@@ -212,6 +330,23 @@ class ClassroomDatabase:
             print(f"[!] DB Error getting client_id for user 	'{username}': {e}")
             return None
 
+    def get_client_ids(self, usernames: List[str]) -> Dict[str, str]:
+        """Retrieves the active client_ids of several usernames at once. Users with none are left out."""
+        usernames = list(usernames)
+        client_ids = {}
+        try:
+            with self._get_cursor(commit_on_exit=False) as cursor:
+                for start in range(0, len(usernames), MAX_LOOKUP_PARAMS):
+                    chunk = usernames[start:start + MAX_LOOKUP_PARAMS]
+                    placeholders = ", ".join("?" * len(chunk))
+                    cursor.execute(f"SELECT username, client_id FROM active_clients WHERE username IN ({placeholders})",
+                                   chunk)
+                    client_ids.update((row['username'], row['client_id']) for row in cursor.fetchall())
+            return client_ids
+        except sqlite3.Error as e:
+            print(f"[!] DB Error getting client_ids for {len(usernames)} user(s): {e}")
+            return {}
+
     def get_username(self, client_id: str) -> Optional[str]:
         """Retrieves the username for an active client_id."""
         try:
@@ -0,0 +1,78 @@
+import asyncio
+import sqlite3
+import threading
+
+import pytest
+
+from database.sqlite_db import ClassroomDatabase
+from database.async_db import AsyncClassroomDatabase
+
+
+def make_db(tmp_path):
+    sync_db = ClassroomDatabase(str(tmp_path / "classroom.db"))
+    with sync_db._get_cursor() as cursor:
+        cursor.executemany("INSERT INTO users VALUES (?, 'x', 'student')", [("stu1",), ("stu2",), ("stu3",)])
+    return AsyncClassroomDatabase(sync_db)
+
+
+def active_clients(db):
+    with sqlite3.connect(db.sync_db.db_path) as conn:
+        return sorted(conn.execute("SELECT username, client_id FROM active_clients").fetchall())
+
+
+def test_failing_write_is_rolled_back_alone_within_its_batch(tmp_path):
+    db = make_db(tmp_path)
+
+    def half_done_then_fail():
+        with db.sync_db._get_cursor() as cursor:
+            cursor.execute("INSERT INTO active_clients VALUES ('stu2', 'client-2', '2025-01-01T00:00:00')")
+            cursor.execute("INSERT INTO active_clients VALUES ('nobody', 'client-x', '2025-01-01T00:00:00')")
+
+    async def scenario():
+        # Issued in the same tick, so the writer runs all three in one transaction
+        return await asyncio.gather(db.register_client("stu1", "client-1"), db._write(half_done_then_fail),
+                                    db.register_client("stu3", "client-3"), return_exceptions=True)
+
+    try:
+        first, failed, last = asyncio.run(scenario())
+        assert first is True and last is True
+        assert isinstance(failed, sqlite3.IntegrityError) # Unknown user: foreign key
+        assert (db.write_batches, db.batched_writes) == (1, 3)
+        # The failing block's first insert went with it; its neighbours committed
+        assert active_clients(db) == [("stu1", "client-1"), ("stu3", "client-3")]
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize("online", [0, 2, 1200])
+def test_get_client_ids_leaves_offline_users_out(tmp_path, online):
+    db = make_db(tmp_path)
+    with db.sync_db._get_cursor() as cursor:
+        cursor.executemany("INSERT INTO users VALUES (?, 'x', 'student')", [(f"s{n}",) for n in range(online)])
+        cursor.executemany("INSERT INTO active_clients VALUES (?, ?, '2025-01-01T00:00:00')",
+                           [(f"s{n}", f"c{n}") for n in range(online)])
+    usernames = [f"s{n}" for n in range(online)] + ["stu1", "nobody"]
+    try:
+        client_ids = asyncio.run(db.get_client_ids(usernames))
+    finally:
+        db.close()
+    assert client_ids == {f"s{n}": f"c{n}" for n in range(online)}
+
+
+def test_query_times_are_counted_on_the_loop(tmp_path):
+    db = make_db(tmp_path)
+    threads = set()
+    db.on_cursor_time = lambda seconds: threads.add(threading.get_ident())
+
+    async def scenario():
+        await asyncio.gather(db.get_client_id("stu1"), db.get_role("stu2"), db.register_client("stu1", "client-1"),
+                             db.register_client("nobody", "client-x"))
+        return threading.get_ident()
+
+    try:
+        loop_thread = asyncio.run(scenario())
+    finally:
+        db.close()
+    assert threads == {loop_thread}
+    assert (db.query_count, db.query_errors) == (4, 1)
+    assert db.query_seconds > 0
@@ -1,9 +1,9 @@
 # /home/ubuntu/server_modular/servers/features/create_room_handler.py
 
-from database.sqlite_db import ClassroomDatabase
+from database.async_db import AsyncClassroomDatabase
 from utils.packets import PacketCreateRoom  # Make sure this packet is defined
 
-async def handle_create_room(db: ClassroomDatabase, client_id: str, create_room_packet: PacketCreateRoom) -> tuple[str, str]:
+async def handle_create_room(db: AsyncClassroomDatabase, client_id: str, create_room_packet: PacketCreateRoom) -> tuple[str, str]:
     """Handles the logic for room creation by a teacher.
 
     Args:
@@ -20,13 +20,13 @@ async def handle_create_room(db: ClassroomDatabase, client_id: str, create_room_
         room_id = create_room_packet.room_id
 
         # Step 1: Ensure user is logged in
-        if not db.get_active_session(username):
+        if not await db.get_active_session(username):
             print(f"[!] Room creation denied for {username} (Client {client_id}): not logged in.")
             return "error", "User is not logged in"
 
       
         # Step 2: Try creating the room
-        if db.create_room(room_id, username):
+        if await db.create_room(room_id, username):
             print(f"[*] Room '{room_id}' created by teacher '{username}' (Client {client_id})")
             return "success", "Room created successfully"
         else:
@@ -1,8 +1,8 @@
 # /home/ubuntu/server_modular/servers/features/joinroom_handler.py
-from database.sqlite_db import ClassroomDatabase
+from database.async_db import AsyncClassroomDatabase
 from utils.packets import PacketJoinRoom
 
-async def handle_joinroom(db: ClassroomDatabase, client_id: str, join_packet: PacketJoinRoom) -> tuple[str, str]:
+async def handle_joinroom(db: AsyncClassroomDatabase, client_id: str, join_packet: PacketJoinRoom) -> tuple[str, str]:
     """Handles a student joining a room using the database's join_room method.
 
     Args:
@@ -14,7 +14,7 @@ async def handle_joinroom(db: ClassroomDatabase, client_id: str, join_packet: Pa
         A tuple containing the status ("success" or "error") and a message.
     """
     try:
-        success = db.join_room(
+        success = await db.join_room(
             room_id=join_packet.room_id,
             student_username=join_packet.username,
             student_name=join_packet.student_name,
@@ -1,10 +1,11 @@
 # /home/ubuntu/server_modular/servers/features/login_handler.py
 import json
 from pydantic import ValidationError
-from database.sqlite_db import ClassroomDatabase
+from database.async_db import AsyncClassroomDatabase
 from utils.packets import PacketLogin
+from utils.auth_pool import AuthQueueFull
 
-async def handle_login(db: ClassroomDatabase, client_id: str, login_packet: PacketLogin) -> tuple[str, str]:
+async def handle_login(db: AsyncClassroomDatabase, client_id: str, login_packet: PacketLogin) -> tuple[str, str]:
     """Handles the login authentication logic.
 
     Args:
@@ -16,20 +17,24 @@ async def handle_login(db: ClassroomDatabase, client_id: str, login_packet: Pack
         A tuple containing the status ("success" or "error") and a message.
     """
     try:
-        is_authenticated = db.authenticate(
+        # The bcrypt check runs in the password verifier's process pool, not on the event loop
+        is_authenticated = await db.authenticate(
             login_packet.username,
             login_packet.password,
             login_packet.role
         )
 
         if is_authenticated:
-            db.add_active_session(login_packet.username)
+            await db.add_active_session(login_packet.username)
             print(f"[*] Login SUCCESS for user {login_packet.username} (Client ID: {client_id})")
             return "success", "Login successful"
         else:
             print(f"[*] Login FAILED for user {login_packet.username} (Client ID: {client_id})")
             return "error", "Invalid credentials or role"
 
+    except AuthQueueFull:
+        print(f"[!] Login REJECTED for user {login_packet.username} (Client ID: {client_id}): password check queue full")
+        return "error", "Server busy, please try logging in again"
     except Exception as e:
         print(f"[!] Unexpected error during authentication for client {client_id}: {e}")
         return "error", "Internal server error during authentication"
@@ -1,8 +1,8 @@
 # /home/ubuntu/server_modular/servers/features/logout_handler.py
-from database.sqlite_db import ClassroomDatabase
+from database.async_db import AsyncClassroomDatabase
 from utils.packets import PacketLogout
 
-async def handle_logout(db: ClassroomDatabase, client_id: str, logout_packet: PacketLogout) -> tuple[str, str]:
+async def handle_logout(db: AsyncClassroomDatabase, client_id: str, logout_packet: PacketLogout) -> tuple[str, str]:
     """Handles teacher logout:
     - Verifies active session
     - Deletes their room
@@ -21,18 +21,18 @@ async def handle_logout(db: ClassroomDatabase, client_id: str, logout_packet: Pa
 
     try:
         # Check if user is logged in
-        if not db.get_active_session(username):
+        if not await db.get_active_session(username):
             print(f"[!] Logout FAILED: No active session for {username} (Client ID: {client_id})")
             return "error", f"User '{username}' is not logged in."
 
         # Attempt to delete the room
-        if db.delete_room(room_id):
+        if await db.delete_room(room_id):
             print(f"[*] Room '{room_id}' deleted successfully during logout of '{username}'")
         else:
             print(f"[!] Warning: Failed to delete room '{room_id}' (maybe already deleted?)")
 
         # Remove active session
-        db.remove_active_session(username)
+        await db.remove_active_session(username)
         print(f"[*] Logout SUCCESS for user {username} (Client ID: {client_id})")
         return "success", f"User '{username}' logged out and room '{room_id}' deleted."
 
@@ -8,7 +8,7 @@ from typing import TYPE_CHECKING, Callable, Awaitable
 # import os
 # sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from database.sqlite_db import ClassroomDatabase
+from database.async_db import AsyncClassroomDatabase
 from utils.packets import PacketNotify
 
 # Type hint for the sender function passed from main.py
@@ -16,7 +16,7 @@ if TYPE_CHECKING:
     from main import NotificationSender # Assuming NotificationSender type is defined in main
 
 async def handle_notify(
-    db: ClassroomDatabase, 
+    db: AsyncClassroomDatabase, 
     sender_func: 'NotificationSender', 
     sender_client_id: str, 
     notify_packet: PacketNotify
@@ -27,8 +27,9 @@ async def handle_notify(
 
     Args:
         db: The database instance (provides methods like get_room_teacher, 
-            get_students_in_room, get_client_id, get_username).
-        sender_func: The async function (bound to a writer) to send notifications via the LB.
+            get_students_in_room, get_client_ids, get_username).
+        sender_func: The PushSender (bound to a writer) used to send notifications via the LB;
+            its multicast() sends one frame for the whole room.
         sender_client_id: The client_id of the user initiating the notification.
         notify_packet: The validated notify packet containing room_id and message.
 
@@ -42,15 +43,13 @@ async def handle_notify(
 
     try:
         # 1. Get the teacher of the room from the database
-        # Uses the synchronous db method
-        teacher_username = db.get_room_teacher(room_id)
+        teacher_username = await db.get_room_teacher(room_id)
         if not teacher_username:
             print(f"[!] Room '{room_id}' not found or has no teacher in database during notification.")
             return "error", f"Room '{room_id}' does not exist or is invalid."
         
         # 2. Verify sender is the teacher using database lookup
-        # Uses the synchronous db method
-        sender_username = db.get_username(sender_client_id)
+        sender_username = await db.get_username(sender_client_id)
         if not sender_username:
              # This case should ideally not happen if the client_id is valid and registered
              print(f"[!] Could not find username for sender client_id '{sender_client_id}' in DB.")
@@ -63,8 +62,7 @@ async def handle_notify(
             print(f"[*] Notification sender '{sender_username}' confirmed as teacher for room '{room_id}'.")
 
         # 3. Get all student usernames currently listed in the room from the database
-        # Uses the synchronous db method
-        student_usernames = db.get_students_in_room(room_id)
+        student_usernames = await db.get_students_in_room(room_id)
         print(f"[*] Students found in room '{room_id}': {student_usernames}")
 
         # 4. Combine all intended recipients (teacher + students)
@@ -86,36 +84,38 @@ async def handle_notify(
         notify_payload_json_str = json.dumps(notify_payload)
         print(f"[*] Prepared notification payload for room '{room_id}': {notify_payload_json_str}")
 
-        # 6. Attempt to send the notification to each recipient
+        # 6. Look up the recipients' client ids, then send the notification to all of them at once
         sent_count = 0
         send_errors = []
         offline_users = []
+        target_client_ids = []
         print(f"[*] Attempting to send notification to recipients in room '{room_id}': {list(recipient_usernames)}")
 
+        # Look up every recipient's client_id in one query
+        client_ids = await db.get_client_ids(list(recipient_usernames))
         for username in recipient_usernames:
-            # Look up the target client_id from the database
-            # Uses the synchronous db method
-            target_client_id = db.get_client_id(username)
-            
+            target_client_id = client_ids.get(username)
+
             if target_client_id:
-                try:
-                    print(f"[*] Found active client for '{username}': {target_client_id}. Sending notification via sender_func...")
-                    # Use the async sender_func passed from main.py
-                    await sender_func(target_client_id, notify_payload)
-                    sent_count += 1
-                    print(f"[*] Successfully initiated send for notification to '{username}' ({target_client_id}).")
-                except Exception as e:
-                    # Catch errors during the async send operation
-                    error_msg = f"Failed to send notification to user '{username}' (Client ID: {target_client_id}): {type(e).__name__} - {e}"
-                    print(f"[!] {error_msg}")
-                    send_errors.append(error_msg)
-                    # Remove from DB if send fails? Or rely on disconnect cleanup?
-                    # db.unregister_client(username) # Be careful with this
+                print(f"[*] Found active client for '{username}': {target_client_id}.")
+                target_client_ids.append(target_client_id)
             else:
                 # User is in the room list but has no active client_id in the DB
                 print(f"[!] Could not find active client_id for user '{username}' in room '{room_id}' via DB. User is likely offline.")
                 offline_users.append(username)
 
+        if target_client_ids:
+            try:
+                # One multicast frame: the payload is encoded once and the LB fans it out
+                await sender_func.multicast(target_client_ids, notify_payload)
+                sent_count = len(target_client_ids)
+                print(f"[*] Successfully initiated multicast of notification to {sent_count} client(s) in room '{room_id}'.")
+            except Exception as e:
+                # Catch errors during the async send operation
+                error_msg = f"Failed to send notification to {len(target_client_ids)} recipient(s) in room '{room_id}': {type(e).__name__} - {e}"
+                print(f"[!] {error_msg}")
+                send_errors.append(error_msg)
+
         # 7. Compile and return the final status message to the *sender*
         total_recipients = len(recipient_usernames)
         result_message = f"Notification processed for room '{room_id}'. Attempted send to {sent_count}/{total_recipients - len(offline_users)} online recipients."
@@ -1,8 +1,8 @@
 # /home/ubuntu/server_modular/servers/features/refresh_handler.py
-from database.sqlite_db import ClassroomDatabase
+from database.async_db import AsyncClassroomDatabase
 from utils.packets import PacketRefresh
 
-async def handle_refresh(db: ClassroomDatabase, client_id: str, refresh_packet: PacketRefresh) -> tuple[str, dict]:
+async def handle_refresh(db: AsyncClassroomDatabase, client_id: str, refresh_packet: PacketRefresh) -> tuple[str, dict]:
     """Handles refreshing the list of participants in a given room.
 
     Args:
@@ -14,7 +14,7 @@ async def handle_refresh(db: ClassroomDatabase, client_id: str, refresh_packet:
         A tuple of ("success"/"error", data or message)
     """
     try:
-        participants = db.get_room_participants(refresh_packet.room_id)
+        participants = await db.get_room_participants(refresh_packet.room_id)
         if participants is None:
             print(f"[!] Refresh FAILED: Room '{refresh_packet.room_id}' not found (Client ID: {client_id})")
             return "error", {"message": f"Room '{refresh_packet.room_id}' not found."}
@@ -0,0 +1,86 @@
+"""Which handler serves each request type, and how.
+
+handle_connection looks the validated packet's type up in HANDLERS instead
+of walking an if/elif chain, and parse_message accepts exactly the packet
+models listed here. Each entry says:
+
+    model        the packet class (utils/packets.py) the request validates into
+    handler      coroutine returning (status, message)
+    label        how the type is named in "Invalid <label> data" errors
+    needs_sender the handler pushes to other clients, so it gets sender_func
+    responds     the result goes back to the requester as a response; False
+                 when the answer arrives as a push instead (request_app)
+    concurrency  what the handler mostly waits on (CONCURRENCY_*), which
+                 picks the limit it runs under in ClientRequestQueues: CPU
+                 handlers (login) under the password check pool's, the
+                 others under --max-concurrent
+    droppable    only the newest one matters (a screen frame): a newer one
+                 from the same client replaces it while it is still queued,
+                 and it is shed first when the client's queue is full
+"""
+from typing import Awaitable, Callable, Dict, NamedTuple, Type
+
+from utils.parser import make_message_parser
+from utils.packets import (
+    PacketBase, PacketLogin, PacketCreateRoom, PacketLogout, PacketJoinRoom, PacketRefresh,
+    PacketNotify, PacketStreaming, PacketScreenData, PacketRequestApp, PacketReturnApp
+)
+from features.login_handler import handle_login
+from features.create_room_handler import handle_create_room
+from features.logout_handler import handle_logout
+from features.joinroom_handler import handle_joinroom
+from features.refresh_handler import handle_refresh
+from features.notify_handler import handle_notify
+from features.streaming_handler import handle_streaming_request
+from features.screen_data_handler import handle_screen_data
+from features.send_app_handler import handle_app_request, handle_app_return
+
+CONCURRENCY_CPU = "cpu"     # CPU-bound (password hashing)
+CONCURRENCY_DB = "db"       # Database reads and writes
+CONCURRENCY_RELAY = "relay" # Looks up another client and pushes to it
+
+
+class HandlerSpec(NamedTuple):
+    model: Type[PacketBase]
+    handler: Callable[..., Awaitable[tuple]]
+    label: str
+    needs_sender: bool = False
+    responds: bool = True
+    concurrency: str = CONCURRENCY_DB
+    droppable: bool = False
+
+
+async def login(db, client_id, packet: PacketLogin):
+    status, message = await handle_login(db, client_id, packet)
+    # Register the client mapping so pushes for this user find their connection
+    if status == "success" and not await db.register_client(packet.username, client_id):
+        print(f"[!] Failed to register client '{packet.username}' in DB.") # The login itself stands
+    return status, message
+
+
+async def logout(db, client_id, packet: PacketLogout):
+    status, message = await handle_logout(db, client_id, packet)
+    if status == "success" and not await db.unregister_client(packet.teacher):
+        print(f"[!] Failed to unregister client '{packet.teacher}' from DB.")
+    return status, message
+
+
+HANDLERS: Dict[str, HandlerSpec] = {spec.model.model_fields["type"].default: spec for spec in (
+    HandlerSpec(PacketLogin, login, "login", concurrency=CONCURRENCY_CPU),
+    HandlerSpec(PacketCreateRoom, handle_create_room, "create room"),
+    HandlerSpec(PacketLogout, logout, "logout"),
+    HandlerSpec(PacketJoinRoom, handle_joinroom, "join room"),
+    HandlerSpec(PacketRefresh, handle_refresh, "refresh"),
+    HandlerSpec(PacketNotify, handle_notify, "notify", needs_sender=True),
+    HandlerSpec(PacketStreaming, handle_streaming_request, "streaming request", needs_sender=True,
+                concurrency=CONCURRENCY_RELAY),
+    HandlerSpec(PacketScreenData, handle_screen_data, "screen", needs_sender=True,
+                concurrency=CONCURRENCY_RELAY, droppable=True),
+    HandlerSpec(PacketRequestApp, handle_app_request, "request app", needs_sender=True, responds=False,
+                concurrency=CONCURRENCY_RELAY),
+    HandlerSpec(PacketReturnApp, handle_app_return, "return app", needs_sender=True,
+                concurrency=CONCURRENCY_RELAY),
+)}
+
+# Parses a client request into its packet model; a type with no handler is an unknown type
+parse_message = make_message_parser(spec.model for spec in HANDLERS.values())
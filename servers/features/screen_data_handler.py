@@ -2,7 +2,7 @@
 
 from pydantic import ValidationError
 from utils.packets import PacketScreenData
-from database.sqlite_db import ClassroomDatabase
+from database.async_db import AsyncClassroomDatabase
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
@@ -10,7 +10,7 @@ if TYPE_CHECKING:
 
 
 async def handle_screen_data(
-    db: ClassroomDatabase,
+    db: AsyncClassroomDatabase,
     sender_func: 'NotificationSender',
     client_id: str,
     screen_data_packet: PacketScreenData
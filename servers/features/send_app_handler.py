@@ -1,6 +1,6 @@
 import json
 from typing import TYPE_CHECKING, Callable, Awaitable
-from database.sqlite_db import ClassroomDatabase
+from database.async_db import AsyncClassroomDatabase
 from utils.packets import PacketRequestApp, PacketReturnApp
 
 '''
@@ -12,7 +12,7 @@ request payload
 '''
 
 async def handle_app_request(
-    db: ClassroomDatabase, 
+    db: AsyncClassroomDatabase, 
     sender_func,
     sender_client_id: str, 
     packet_request_app: PacketRequestApp
@@ -22,7 +22,7 @@ async def handle_app_request(
     print(f"[*] Handling running application request from client '{sender_client_id}' targeting user '{target_username}'.")
 
     try:
-        target_client_id = db.get_client_id(target_username)
+        target_client_id = await db.get_client_id(target_username)
 
         if not target_client_id:
             print(f"[!] Target user '{target_username}' not found or is offline (no active client_id in DB).")
@@ -77,7 +77,7 @@ retrun packet
 '''
 
 async def handle_app_return(
-    db: ClassroomDatabase,
+    db: AsyncClassroomDatabase,
     sender_func,
     client_id: str,
     packet_return_app: PacketReturnApp
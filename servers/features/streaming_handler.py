@@ -3,7 +3,7 @@
 import json
 from typing import TYPE_CHECKING, Callable, Awaitable
 
-from database.sqlite_db import ClassroomDatabase
+from database.async_db import AsyncClassroomDatabase
 from utils.packets import PacketStreaming
 
 # Type hint for the sender function passed from main.py
@@ -11,7 +11,7 @@ if TYPE_CHECKING:
     from main import NotificationSender # Reuse the sender type hint
 
 async def handle_streaming_request(
-    db: ClassroomDatabase, 
+    db: AsyncClassroomDatabase, 
     sender_func: 'NotificationSender', 
     sender_client_id: str, 
     streaming_packet: PacketStreaming
@@ -22,7 +22,7 @@ async def handle_streaming_request(
 
     try:
         # 1. Find the target user's current client_id from the database
-        target_client_id = db.get_client_id(target_username)
+        target_client_id = await db.get_client_id(target_username)
 
         if not target_client_id:
             print(f"[!] Target user 	'{target_username}' not found or is offline (no active client_id in DB).")
@@ -0,0 +1,446 @@
+import hashlib
+import math
+import random
+from functools import reduce
+from typing import Optional
+
+
+class Backend:
+    """Selection and health state for one backend server."""
+    __slots__ = ("host", "port", "weight", "in_flight",
+                 "rtt", "failures", "ejections", "ejected_until", "admitted_at", "draining",
+                 "load_lag", "load_pending", "load_interval", "load_reported_at", "load_factor")
+
+    def __init__(self, host: str, port: int, weight: int = 1):
+        self.host = host
+        self.port = port
+        self.weight = max(1, int(weight))
+        self.in_flight = 0 # Requests forwarded but not yet answered
+        self.rtt = None # EWMA of health-check ping round trips, in seconds
+        self.failures = 0 # Consecutive failures (write errors, timeouts, missed pings)
+        self.ejections = 0 # Ejections since the backend last stayed healthy; drives the backoff
+        self.ejected_until = 0.0 # Loop time before which an ejected backend is not re-probed; 0 if admitted
+        self.admitted_at = 0.0
+        self.draining = False # Takes no new requests; closed once the ones in flight are answered
+        # From the backend's load reports (see LoadWeighting)
+        self.load_lag = 0.0 # EWMA of the backend's event loop lag, in seconds
+        self.load_pending = 0.0 # EWMA of requests in its handlers plus jobs waiting for its executor
+        self.load_interval = 0.0 # Seconds between the backend's reports, as it announced
+        self.load_reported_at = 0.0 # Loop time of the latest report; 0 if none yet
+        self.load_factor = 1.0 # Share of its configured weight the backend currently gets, in (0, 1]
+
+    @property
+    def ejected(self) -> bool:
+        return self.ejected_until != 0.0
+
+    @property
+    def effective_weight(self) -> float:
+        """Configured weight scaled down by the backend's reported load."""
+        return self.weight * self.load_factor
+
+    def record_rtt(self, rtt: float, alpha: float):
+        self.rtt = rtt if self.rtt is None else alpha * rtt + (1 - alpha) * self.rtt
+
+    def record_load(self, lag: float, pending: float, interval: float, now: float, alpha: float):
+        if not self.load_reported_at:
+            self.load_lag, self.load_pending = lag, pending
+        else:
+            self.load_lag = alpha * lag + (1 - alpha) * self.load_lag
+            self.load_pending = alpha * pending + (1 - alpha) * self.load_pending
+        self.load_interval = interval
+        self.load_reported_at = now
+
+    @property
+    def key(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    def __repr__(self):
+        return f"Backend({self.key}, weight={self.weight}, in_flight={self.in_flight})"
+
+
+class BackendSelector:
+    """Base class for backend selection strategies.
+
+    Members are the backends that can currently take traffic (healthy and
+    connected). The LB calls on_dispatch/on_complete around every request so
+    strategies can keep their own bookkeeping in step with in-flight counts.
+    Every strategy picks in O(1); membership changes may cost O(N).
+    """
+    name = "base"
+
+    def __init__(self):
+        self._members = []
+        self._member_set = set()
+
+    def __len__(self):
+        return len(self._members)
+
+    def __contains__(self, backend):
+        return backend in self._member_set
+
+    @property
+    def members(self):
+        return list(self._members)
+
+    def add(self, backend: Backend):
+        if backend not in self._member_set:
+            self._members.append(backend)
+            self._member_set.add(backend)
+            self._rebuild()
+
+    def remove(self, backend: Backend):
+        if backend in self._member_set:
+            self._members.remove(backend)
+            self._member_set.discard(backend)
+            self._rebuild()
+
+    def set_members(self, backends):
+        """Replaces the member set, keeping the existing order where possible."""
+        backends = list(backends)
+        if backends != self._members:
+            self._members = backends
+            self._member_set = set(backends)
+            self._rebuild()
+
+    def pick(self, client_id: Optional[str] = None) -> Optional[Backend]:
+        raise NotImplementedError
+
+    def on_dispatch(self, backend: Backend):
+        backend.in_flight += 1
+
+    def on_complete(self, backend: Backend):
+        if backend.in_flight > 0:
+            backend.in_flight -= 1
+
+    def refresh(self):
+        """Recomputes derived state after member weights changed in place."""
+        self._rebuild()
+
+    def on_load_change(self):
+        """Called after members' load factors changed. Strategies reading effective_weight per pick need nothing."""
+
+    def forget(self, client_id: str):
+        """Called when a client disconnects, for strategies that keep per-client state."""
+
+    def _rebuild(self):
+        """Hook for strategies that precompute state from the member list."""
+
+
+class RoundRobinSelector(BackendSelector):
+    name = "round_robin"
+
+    def __init__(self):
+        super().__init__()
+        self._next = 0
+
+    def pick(self, client_id=None):
+        members = self._members
+        if not members:
+            return None
+        if self._next >= len(members):
+            self._next = 0
+        backend = members[self._next]
+        self._next += 1
+        return backend
+
+
+class WeightedRoundRobinSelector(BackendSelector):
+    """Smooth weighted round robin using a precomputed schedule.
+
+    The interleaved sequence (same order nginx's smooth WRR produces) is built
+    once per membership change, so a pick is a single index step. Effective
+    weights are rounded to tenths of the configured weight, and the schedule
+    is rebuilt only when a rounded value changes.
+    """
+    name = "weighted"
+    LOAD_STEPS = 10 # Resolution of the load factor in the schedule
+
+    def __init__(self):
+        super().__init__()
+        self._schedule = []
+        self._weights = []
+        self._next = 0
+
+    def _scaled_weights(self):
+        return [max(1, round(b.weight * b.load_factor * self.LOAD_STEPS)) for b in self._members]
+
+    def on_load_change(self):
+        if self._scaled_weights() != self._weights:
+            self._rebuild()
+
+    def _rebuild(self):
+        self._schedule = []
+        self._weights = self._scaled_weights()
+        if not self._members:
+            return
+        divisor = reduce(math.gcd, self._weights)
+        weights = [w // divisor for w in self._weights]
+        total = sum(weights)
+        current = [0] * len(weights)
+        for _ in range(total):
+            for i, w in enumerate(weights):
+                current[i] += w
+            best = max(range(len(weights)), key=current.__getitem__)
+            current[best] -= total
+            self._schedule.append(self._members[best])
+
+    def pick(self, client_id=None):
+        if not self._schedule:
+            return None
+        if self._next >= len(self._schedule):
+            self._next = 0
+        backend = self._schedule[self._next]
+        self._next += 1
+        return backend
+
+
+class LeastInFlightSelector(BackendSelector):
+    """Picks the backend with the fewest in-flight requests.
+
+    Backends are grouped into buckets by in-flight count and the lowest
+    non-empty bucket is tracked; counts only ever move by one, so dispatch,
+    completion and pick are all O(1). Ties rotate because a dispatched
+    backend moves to the back of the next bucket.
+    """
+    name = "least_in_flight"
+
+    def __init__(self):
+        super().__init__()
+        self._buckets = {} # Map: in_flight count -> {Backend: None} (ordered set)
+        self._min_count = 0
+
+    def _rebuild(self):
+        self._buckets = {}
+        for backend in self._members:
+            self._buckets.setdefault(backend.in_flight, {})[backend] = None
+        self._min_count = min(self._buckets) if self._buckets else 0
+
+    def _move(self, backend, old_count, new_count):
+        bucket = self._buckets[old_count]
+        del bucket[backend]
+        if not bucket:
+            del self._buckets[old_count]
+        self._buckets.setdefault(new_count, {})[backend] = None
+        if new_count < self._min_count:
+            self._min_count = new_count
+        elif old_count == self._min_count and old_count not in self._buckets:
+            self._min_count = new_count
+
+    def pick(self, client_id=None):
+        bucket = self._buckets.get(self._min_count)
+        if not bucket:
+            return None
+        return next(iter(bucket))
+
+    def on_dispatch(self, backend):
+        old_count = backend.in_flight
+        super().on_dispatch(backend)
+        if backend in self._member_set:
+            self._move(backend, old_count, backend.in_flight)
+
+    def on_complete(self, backend):
+        old_count = backend.in_flight
+        super().on_complete(backend)
+        if backend in self._member_set and backend.in_flight != old_count:
+            self._move(backend, old_count, backend.in_flight)
+
+
+class PowerOfTwoSelector(BackendSelector):
+    """Samples two backends at random and takes the less loaded one.
+
+    Load is in-flight requests relative to the backend's effective weight.
+    """
+    name = "p2c"
+
+    def __init__(self, rng: Optional[random.Random] = None):
+        super().__init__()
+        self._rng = rng or random.Random()
+
+    def pick(self, client_id=None):
+        members = self._members
+        count = len(members)
+        if count == 0:
+            return None
+        if count == 1:
+            return members[0]
+        i = self._rng.randrange(count)
+        j = self._rng.randrange(count - 1)
+        if j >= i:
+            j += 1
+        a, b = members[i], members[j]
+        # Compare in_flight/weight without dividing
+        return a if a.in_flight * b.effective_weight <= b.in_flight * a.effective_weight else b
+
+
+class RendezvousSelector(BackendSelector):
+    """Client affinity via weighted rendezvous (highest random weight) hashing.
+
+    Every client scores each backend with a hash of (client_id, host:port)
+    and its configured weight, and goes to the highest score, so all of a
+    client's frames land on the same backend. When a backend leaves only its
+    own clients move; when one joins (or is admitted again) only the clients
+    whose top choice it now is move to it, roughly weight/total of them.
+    Assignments are cached so a pick is a dict lookup; a client is scored
+    (O(N)) when it is first seen or its backend left, and every assigned
+    client is rescored when a backend joins or weights change.
+
+    Load only spills: a new client whose top choice reports a load factor
+    below spill_below goes to the best-scored backend that does not, and
+    stays there. Load never moves clients already assigned, and scores do
+    not depend on it, so load reports cannot reshuffle the classroom.
+    """
+    name = "rendezvous"
+
+    def __init__(self):
+        super().__init__()
+        self.spill_below = 0.25 # New clients skip a backend whose load factor is below this, if another is not
+        self._assignments = {} # Map: client_id -> (assigned Backend, top-scored Backend)
+
+    @staticmethod
+    def _score(client_id: str, backend: Backend) -> float:
+        digest = hashlib.blake2b(f"{client_id}|{backend.key}".encode("utf-8"), digest_size=8).digest()
+        # Map the hash into (0, 1) and weight it: -w / ln(u)
+        u = (int.from_bytes(digest, "big") + 1) / 18446744073709551617.0
+        return -backend.weight / math.log(u)
+
+    def _rescore(self, moves):
+        """Recomputes assigned clients' top choices (O(clients x N)).
+
+        A client whose top choice changed is unassigned, so its next pick
+        moves it there, if moves(new_top, old_top) says the change should
+        move it; otherwise it stays put and only the recorded top changes.
+        """
+        for client_id, (backend, top) in list(self._assignments.items()):
+            new_top = max(self._members, key=lambda b: self._score(client_id, b))
+            if new_top is top:
+                continue
+            if new_top is not backend and moves(new_top, top):
+                del self._assignments[client_id]
+            else:
+                self._assignments[client_id] = (backend, new_top)
+
+    def add(self, backend):
+        joining = backend not in self._member_set
+        super().add(backend)
+        if joining:
+            self._rescore(lambda new_top, top: new_top is backend)
+
+    def set_members(self, backends):
+        before = set(self._member_set)
+        super().set_members(backends)
+        joined = self._member_set - before
+        if joined and self._members:
+            self._rescore(lambda new_top, top: new_top in joined)
+
+    def pick(self, client_id=None):
+        if not self._members:
+            return None
+        if client_id is None:
+            return self._members[0]
+        assigned = self._assignments.get(client_id)
+        if assigned is not None and assigned[0] in self._member_set:
+            return assigned[0]
+        ranked = sorted(self._members, key=lambda b: self._score(client_id, b), reverse=True)
+        # Spill past overloaded backends; if every one is, load does not pick and the top choice takes it
+        backend = next((b for b in ranked if b.load_factor >= self.spill_below), ranked[0])
+        self._assignments[client_id] = (backend, ranked[0])
+        return backend
+
+    def refresh(self):
+        # Weights changed in place: move the clients whose top choice changed because of them
+        super().refresh()
+        if self._members:
+            self._rescore(lambda new_top, top: top in self._member_set)
+
+    def forget(self, client_id):
+        self._assignments.pop(client_id, None)
+
+
+class LeastLatencySelector(PowerOfTwoSelector):
+    """Power of two choices scored by expected wait: (in_flight + 1) x ping RTT.
+
+    Uses the latency measured by the LB's health checks, so a backend that is
+    slow to answer (e.g. busy hashing passwords) sheds new work before its
+    in-flight count shows it.
+    """
+    name = "least_latency"
+    DEFAULT_RTT = 0.001 # Assumed for backends that have not been pinged yet
+
+    def _cost(self, backend):
+        rtt = backend.rtt if backend.rtt is not None else self.DEFAULT_RTT
+        return (backend.in_flight + 1) * rtt / backend.effective_weight
+
+    def pick(self, client_id=None):
+        members = self._members
+        count = len(members)
+        if count == 0:
+            return None
+        if count == 1:
+            return members[0]
+        i = self._rng.randrange(count)
+        j = self._rng.randrange(count - 1)
+        if j >= i:
+            j += 1
+        a, b = members[i], members[j]
+        return a if self._cost(a) <= self._cost(b) else b
+
+
+class LoadWeighting:
+    """Turns backends' load reports into load factors that scale their weights.
+
+    A backend reports its event loop lag and how much work is waiting in it
+    (see utils/loadreport.py); both are smoothed with an EWMA. The factor is
+
+        1 / (1 + lag / lag_target + pending / pending_target)
+
+    so a backend lagging by lag_target gets half its share of new work,
+    floored at min_factor so a loaded backend is never starved outright.
+    A busy loop cannot send reports, so a report that is overdue counts as
+    lag for as long as it is overdue. Reports older than stale_after are
+    ignored (factor 1): a backend that stopped reporting for that long is
+    either an older build or a matter for the health checks.
+    """
+
+    def __init__(self, lag_target: float = 0.05, pending_target: float = 8.0, stale_after: float = 10.0,
+                 alpha: float = 0.3, min_factor: float = 0.05):
+        self.lag_target = lag_target
+        self.pending_target = pending_target
+        self.stale_after = stale_after
+        self.alpha = alpha # Weight of the newest report in the moving averages
+        self.min_factor = min_factor
+
+    def factor(self, backend: Backend, now: float) -> float:
+        if not backend.load_reported_at:
+            return 1.0
+        age = now - backend.load_reported_at
+        if age > self.stale_after:
+            return 1.0
+        lag = max(backend.load_lag, age - backend.load_interval)
+        pressure = lag / self.lag_target + backend.load_pending / self.pending_target
+        return max(self.min_factor, 1.0 / (1.0 + pressure))
+
+    def update(self, backends, now: float) -> bool:
+        """Recomputes the load factors. Returns True if any changed by more than 1%."""
+        changed = False
+        for backend in backends:
+            factor = self.factor(backend, now)
+            if abs(factor - backend.load_factor) > 0.01:
+                changed = True
+            backend.load_factor = factor
+        return changed
+
+
+SELECTION_STRATEGIES = {
+    cls.name: cls
+    for cls in (RoundRobinSelector, WeightedRoundRobinSelector, LeastInFlightSelector,
+                PowerOfTwoSelector, RendezvousSelector, LeastLatencySelector)
+}
+
+DEFAULT_STRATEGY = RendezvousSelector.name
+
+
+def make_selector(strategy: str) -> BackendSelector:
+    try:
+        return SELECTION_STRATEGIES[strategy]()
+    except KeyError:
+        raise ValueError(f"Unknown selection strategy: {strategy}") from None
@@ -0,0 +1,178 @@
+import re
+import struct
+
+# Client framing modes
+FRAMING_AUTO = "auto"      # Detect from the first byte a client sends
+FRAMING_JSON = "json"      # Legacy clients: bare JSON objects back to back
+FRAMING_LENGTH = "length"  # 4-byte big-endian length prefix + payload
+
+FRAMING_MODES = (FRAMING_AUTO, FRAMING_JSON, FRAMING_LENGTH)
+
+DEFAULT_MAX_FRAME_SIZE = 10 * 1024 * 1024 # Same bound as the backend->LB check
+
+# A length prefix for any frame under 16MB starts with a zero byte, which no
+# JSON text can start with, so auto-detection only needs to look at one byte.
+_MAX_LENGTH_PREFIXED_FRAME = 0xFFFFFF
+
+_WHITESPACE = b" \t\r\n"
+_OPENERS = b"{["
+# Outside a string only brackets and quotes matter; inside a string only the
+# closing quote and escapes do. Jumping between these with a regex keeps
+# scanning of large base64 payloads (screen_data) out of the Python loop.
+_STRUCTURAL = re.compile(rb'[{}\[\]"]')
+_STRING_SPECIAL = re.compile(rb'["\\]')
+
+# Both the C# clients and json.dumps in the backend put "type" first, so the
+# message type can be read from the head of a frame without parsing it.
+_TYPE_FIELD = re.compile(rb'"type"\s*:\s*"([A-Za-z0-9_]{1,64})"')
+_TYPE_PEEK_BYTES = 128
+
+_QUOTE = ord('"')
+_BACKSLASH = ord("\\")
+_OPEN_BRACE = ord("{")
+_OPEN_BRACKET = ord("[")
+
+
+def peek_message_type(payload) -> str:
+    """Returns the "type" of a JSON message from its first bytes, or None."""
+    match = _TYPE_FIELD.search(payload, 0, _TYPE_PEEK_BYTES)
+    return match.group(1).decode("ascii") if match else None
+
+
+class FramingError(Exception):
+    """Raised when a client sends data that cannot be split into frames."""
+
+
+class FrameTooLarge(FramingError):
+    """Raised when a single client frame exceeds the configured size limit."""
+
+
+class ClientFrameDecoder:
+    """Incrementally splits a client byte stream into whole messages.
+
+    Legacy clients write bare JSON objects with no delimiter, so the decoder
+    tracks bracket depth (ignoring brackets inside strings) to find where each
+    object ends. Clients that send a 4-byte length prefix are framed by length
+    instead. Scan state is kept between feeds, so each byte is examined once
+    no matter how many reads a frame arrives in.
+    """
+
+    def __init__(self, mode: str = FRAMING_AUTO, max_frame_size: int = DEFAULT_MAX_FRAME_SIZE):
+        if mode not in FRAMING_MODES:
+            raise ValueError(f"Unknown framing mode: {mode}")
+        if mode != FRAMING_JSON and max_frame_size > _MAX_LENGTH_PREFIXED_FRAME:
+            raise ValueError("max_frame_size must be below 16MB when length-prefixed framing is enabled")
+        self.mode = mode
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray()
+        # JSON scan state for the frame currently being assembled
+        self._depth = 0
+        self._in_string = False
+        self._scan_pos = 0
+
+    @property
+    def buffered(self) -> int:
+        """Number of bytes held for a partially received frame."""
+        return len(self._buffer)
+
+    def feed(self, data: bytes) -> list:
+        """Adds received bytes and returns every frame completed by them."""
+        self._buffer += data
+        frames = []
+        while self._buffer:
+            if self.mode == FRAMING_AUTO:
+                self.mode = FRAMING_LENGTH if self._buffer[0] == 0 else FRAMING_JSON
+            if self.mode == FRAMING_LENGTH:
+                frame = self._next_length_frame()
+            else:
+                frame = self._next_json_frame()
+            if frame is None:
+                break
+            frames.append(frame)
+        return frames
+
+    def encode(self, payload: bytes) -> bytes:
+        """Frames an outbound payload the same way this client frames its requests."""
+        if self.mode == FRAMING_LENGTH:
+            return struct.pack("!I", len(payload)) + payload
+        return payload
+
+    def encode_parts(self, payload: bytes) -> tuple:
+        """Like encode(), but returns the prefix and payload as separate buffers for writelines()."""
+        if self.mode == FRAMING_LENGTH:
+            return (struct.pack("!I", len(payload)), payload)
+        return (payload,)
+
+    def _next_length_frame(self):
+        buf = self._buffer
+        if len(buf) < 4:
+            return None
+        frame_len = struct.unpack_from("!I", buf)[0]
+        if frame_len > self.max_frame_size:
+            raise FrameTooLarge(f"Frame of {frame_len} bytes exceeds limit of {self.max_frame_size} bytes")
+        end = 4 + frame_len
+        if len(buf) < end:
+            return None
+        frame = bytes(buf[4:end])
+        del buf[:end]
+        return frame
+
+    def _next_json_frame(self):
+        buf = self._buffer
+        if self._depth == 0:
+            # Between frames: drop separator whitespace and expect an opener
+            start = 0
+            while start < len(buf) and buf[start] in _WHITESPACE:
+                start += 1
+            if start:
+                del buf[:start]
+            if not buf:
+                return None
+            if buf[0] not in _OPENERS:
+                raise FramingError(f"Expected a JSON object, got byte 0x{buf[0]:02x}")
+            self._depth = 1
+            self._in_string = False
+            self._scan_pos = 1
+
+        pos = self._scan_pos
+        while True:
+            if self._in_string:
+                match = _STRING_SPECIAL.search(buf, pos)
+                if match is None:
+                    pos = len(buf)
+                    break
+                idx = match.start()
+                if buf[idx] == _BACKSLASH:
+                    if idx + 1 >= len(buf):
+                        pos = idx # Escape split across reads; re-examine it next time
+                        break
+                    pos = idx + 2
+                    continue
+                self._in_string = False
+                pos = idx + 1
+            else:
+                match = _STRUCTURAL.search(buf, pos)
+                if match is None:
+                    pos = len(buf)
+                    break
+                idx = match.start()
+                ch = buf[idx]
+                pos = idx + 1
+                if ch == _QUOTE:
+                    self._in_string = True
+                elif ch == _OPEN_BRACE or ch == _OPEN_BRACKET:
+                    self._depth += 1
+                else:
+                    self._depth -= 1
+                    if self._depth == 0:
+                        if pos > self.max_frame_size:
+                            raise FrameTooLarge(f"Frame of {pos} bytes exceeds limit of {self.max_frame_size} bytes")
+                        frame = bytes(buf[:pos])
+                        del buf[:pos]
+                        self._scan_pos = 0
+                        return frame
+
+        self._scan_pos = pos
+        if len(buf) > self.max_frame_size:
+            raise FrameTooLarge(f"Frame exceeds limit of {self.max_frame_size} bytes")
+        return None
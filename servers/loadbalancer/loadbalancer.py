@@ -2,155 +2,685 @@
 import json
 import asyncio
 import struct
-import itertools
 import argparse
 import sys
 import os
 import uuid
+import zlib
+import multiprocessing
+import shutil
+import tempfile
+import signal
+import socket
+import time
+from collections import deque
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
+from framing import (
+    ClientFrameDecoder, FramingError, FrameTooLarge, peek_message_type,
+    FRAMING_AUTO, FRAMING_MODES, DEFAULT_MAX_FRAME_SIZE
+)
+from balancing import Backend, LoadWeighting, make_selector, SELECTION_STRATEGIES, DEFAULT_STRATEGY
+from outbound import (
+    ClientOutbound, OutboundStats, OVERFLOW_POLICIES, OVERFLOW_DROP_OLDEST,
+    DEFAULT_HIGH_WATERMARK, DEFAULT_LOW_WATERMARK
+)
+from workers import WorkerRouter, MAX_WORKERS
+from zerocopy import BackendFrameProtocol
+from ratelimit import RateLimits, ClientRateLimiter, TokenBucket, load_limits
+from memory import MemoryGovernor, reader_buffered, DEFAULT_CLIENT_MEMORY_LIMIT, DEFAULT_MEMORY_LIMIT
+from timerwheel import TimerWheel
+
+# Shared helpers live in the servers package root (one level up)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.loops import install_event_loop, LOOP_CHOICES, LOOP_AUTO
+from utils.histogram import LatencyRecorder
+from utils.metrics import MetricsRegistry, MetricsServer, LoopLagMonitor
+from utils.loadreport import LOAD_REPORT_TYPE
+from utils.envelope import (
+    pack_v1, pack_v2, header_v1, header_v2, client_id_to_wire, client_id_from_wire,
+    split_multicast, PROTOCOL_V1, PROTOCOL_V2, SUPPORTED_VERSIONS, SUPPORTED_FEATURES, FEATURE_CORRELATION,
+    FEATURE_LOAD_REPORT,
+    KIND_REQUEST, KIND_CONTROL, KIND_MULTICAST, V2_HEADER_SIZE, FLAG_CORRELATED, CORRELATION_ID, MAX_CORRELATION_ID
+)
+
 servers_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "servers.json")
 
+# How a client's frames are spread over a backend's connection pool
+POOL_SELECT_HASH = "hash"                  # Stable per client, keeps each client's frames in order
+POOL_SELECT_LEAST_QUEUED = "least_queued"  # Connection with the fewest unsent bytes
+POOL_SELECT_MODES = (POOL_SELECT_HASH, POOL_SELECT_LEAST_QUEUED)
+
+# How the LB reads from its backend connections
+TRANSPORT_STREAMS = "streams"   # asyncio StreamReader/StreamWriter
+TRANSPORT_BUFFERED = "buffered" # BackendFrameProtocol: preallocated receive buffer, frames parsed in place
+TRANSPORT_MODES = (TRANSPORT_STREAMS, TRANSPORT_BUFFERED)
+
+BACKEND_MAX_FRAME_SIZE = 10 * 1024 * 1024
+
+PRESENCE_BATCH_MAX = 10000 # Client ids per clients_connected/clients_gone frame
+
+# Per request type: time from reading a request off the client socket to writing it to a backend (queue),
+# writing it (write), from then to the backend's response (backend) and in all (total)
+LB_PHASES = ("queue", "write", "backend", "total")
+
+# Clients that send heartbeats are answered by the LB itself and from then on
+# disconnected if they go quiet for longer than the idle timeout. Clients that
+# never send one are left to TCP keepalive, which finds half-open connections
+# without their help.
+HEARTBEAT_TYPE = "heartbeat"
+HEARTBEAT_ACK_TYPE = "heartbeat_ack"
+
 class ServerListHandler(FileSystemEventHandler):
     def __init__(self, lb):
         self.lb = lb
         self.loop = asyncio.get_event_loop()
 
+    def _notify(self, path):
+        if path.endswith(self.lb.servers_path):
+            # A single save can fire several events; the LB coalesces them
+            self.loop.call_soon_threadsafe(self.lb.schedule_update)
+        elif self.lb.limits_path and path.endswith(self.lb.limits_path):
+            self.loop.call_soon_threadsafe(self.lb.reload_limits)
+
     def on_modified(self, event):
-        if event.src_path.endswith(servers_path):
-            # Schedule update_servers to run in the main event loop
-            asyncio.run_coroutine_threadsafe(self.lb.update_servers(), self.loop)
+        self._notify(event.src_path)
+
+    def on_created(self, event):
+        self._notify(event.src_path)
+
+    def on_moved(self, event):
+        # Editors that save atomically write a temp file and rename it over servers.json
+        self._notify(event.dest_path)
+
+class BackendConnection:
+    """One pooled TCP connection from the LB to a backend server.
+
+    With the buffered transport there is no reader: writer is the
+    BackendFrameProtocol, which both receives frames and sends them.
+    """
+    __slots__ = ("reader", "writer", "read_task", "slot", "pending_pings", "version", "correlated")
+
+    def __init__(self, reader, writer, slot):
+        self.reader = reader
+        self.writer = writer
+        self.read_task = None
+        self.slot = slot # Position in the pool when it was opened, for log messages
+        self.pending_pings = {} # Map: ping seq -> Future resolved by the backend's pong
+        self.version = PROTOCOL_V1 # Envelope version negotiated with the backend
+        self.correlated = False # The backend echoes correlation ids in its responses (v2 only)
+
+    def control_frame(self, payload: bytes) -> bytes:
+        """Wraps a payload addressed to the backend itself."""
+        if self.version == PROTOCOL_V2:
+            return pack_v2(KIND_CONTROL, bytes(16), payload)
+        return pack_v1(b"", payload) # v1 control frames carry an empty client id
+
+    def queued_bytes(self):
+        """Bytes written to this connection that the kernel has not accepted yet."""
+        transport = self.writer.transport
+        return transport.get_write_buffer_size() if transport else 0
+
+class PendingRequest:
+    """A request forwarded to a backend and not yet answered."""
+    __slots__ = ("backend", "sent_at", "timed", "msg_type", "correlation_id", "received_at", "written_at")
+
+    def __init__(self, backend, sent_at, timed, msg_type=None, correlation_id=None):
+        self.backend = backend
+        self.sent_at = sent_at # Loop time, for the response timeout
+        self.timed = timed # False if the answer may legitimately take long (or is already counted as timed out)
+        self.msg_type = msg_type
+        self.correlation_id = correlation_id # Set if the backend will echo it in its response
+        # perf_counter() stamps for the latency histograms (loop.time() is too coarse on some loops)
+        self.received_at = None # The client's bytes were read
+        self.written_at = None # The write to the backend finished
+
+class ClientConnection:
+    """A connected client: its stream, frame decoder, outbound queue and rate limiter."""
+    __slots__ = ("client_id", "wire_id", "reader", "writer", "decoder", "outbound", "limiter", "backends",
+                 "last_active")
+
+    def __init__(self, client_id, reader, writer, decoder, outbound):
+        self.client_id = client_id
+        self.wire_id = client_id_to_wire(client_id) # 16-byte form used by the v2 envelope
+        self.reader = reader
+        self.writer = writer
+        self.decoder = decoder
+        self.outbound = outbound
+        self.limiter = ClientRateLimiter()
+        self.backends = set() # Keys of the backends told about this client (client_connected)
+        self.last_active = 0 # Idle wheel tick of the latest read from the client
+
+    def send(self, payload: bytes, droppable: bool = False) -> bool:
+        """Sends or queues a payload for the client, framed the way the client frames its own messages."""
+        return self.outbound.write_or_enqueue(self.decoder.encode_parts(payload), droppable)
+
+    def close(self, flush: bool = False):
+        self.outbound.close(flush=flush)
 
 class LoadBalancer:
     def __init__(self):
-        self.backend_servers = [] # List of (host, port) tuples
-        self.server_connections = {} # Map: server_index -> (reader, writer, read_task)
-        self.healthy_indices = set() # Set of indices of healthy servers
-        self.round_robin_pool = None
-        self.client_connections = {} # Map: client_id -> (reader, writer)
+        # Backends are identified by their "host:port" key, which stays the same
+        # however servers.json is reordered or edited around them.
+        self.backends = {} # Map: key -> Backend, in servers.json order
+        self.server_connections = {} # Map: key -> list of BackendConnection (the pool)
+        self.healthy_keys = set() # Keys of backends that passed their last health check
+        self.selector = make_selector(DEFAULT_STRATEGY) # Holds the healthy, connected backends
+        self.client_in_flight = {} # Map: client_id -> deque of PendingRequest, oldest first
+        self.client_connections = {} # Map: client_id -> ClientConnection
+        self.wire_clients = {} # Map: 16-byte client id -> ClientConnection, for v2 frames
+        self.protocol_version = PROTOCOL_V2 # Highest envelope version offered to backends
+        self.servers_path = servers_path
+        self.router = None # WorkerRouter when running as one of several --workers
         self.observer = None
+        self.update_debounce = 0.5 # Seconds of quiet after a servers.json event before reloading
+        self.drain_timeout = 30.0 # Longest a draining backend is kept for its in-flight requests (0: close at once)
+        self._drains = {} # Map: key -> (Backend, drain task, requested by the backend itself)
+        self.presence_batch_delay = 0.05 # Client disconnects are gathered this long and sent per backend in one frame
+        self._gone_pending = {} # Map: key -> client ids that disconnected and the backend has not been told about
+        self._presence_flush_handle = None
+        self._update_handle = None
         self.health_check_timeout = 1.0
+        self.health_check_interval = 5.0 # Seconds between active ping rounds
+        self.response_timeout = 10.0 # A request unanswered this long counts against its backend
+        self.untimed_types = {"request_app"} # Answered by another client's push, so no response deadline
+        # Request types answered by a push rather than a response: request type -> the push type that answers it
+        self.reply_push_types = {"request_app": "return_app"}
+        self.eject_threshold = 3 # Consecutive failures before a backend is ejected
+        self.eject_backoff = 2.0 # First ejection lasts this long; each further one doubles it
+        self.eject_backoff_max = 60.0
+        self.rtt_alpha = 0.3 # Weight of the newest ping in the RTT moving average
+        self._ping_seq = 0
+        self.load_feedback = True # Ask backends for load reports and scale their weights by them
+        self.load_weighting = LoadWeighting()
+        self.load_update_interval = 0.25 # Seconds between load factor refreshes (overdue reports count as lag)
+        self.client_framing = FRAMING_AUTO
+        self.max_frame_size = DEFAULT_MAX_FRAME_SIZE
+        self.client_read_size = 64 * 1024
+        self.pool_size = 1 # Connections opened to each backend
+        self.pool_select = POOL_SELECT_HASH
+        self.transport = TRANSPORT_STREAMS
+        self.outbound_stats = OutboundStats()
+        self.client_queue_high = DEFAULT_HIGH_WATERMARK
+        self.client_queue_low = DEFAULT_LOW_WATERMARK
+        self.overflow_policy = OVERFLOW_DROP_OLDEST
+        self.droppable_types = {"screen_data"} # Push types that may be shed for slow clients
+        self.client_memory_limit = DEFAULT_CLIENT_MEMORY_LIMIT # Read, reassembly and outbound buffers of one client
+        self.memory = MemoryGovernor(self.client_connections, self.outbound_stats, DEFAULT_MEMORY_LIMIT)
+        self.limits_path = None # limits.json; None or a missing file means no rate limits
+        self.limits = RateLimits()
+        self.accept_share = 1.0 # Fraction of the configured accept rate this process enforces (1/workers)
+        self._accept_bucket = None
+        self.throttled_messages = 0
+        self.throttle_disconnects = 0
+        self.rejected_connections = 0
+        self.idle_timeout = 60.0 # Seconds a client that sends heartbeats may stay silent (0: never reaped)
+        self.tcp_keepalive = 60.0 # Seconds of silence before the kernel probes a client connection (0: off)
+        self.idle_wheel = TimerWheel(self._on_idle_timer) # Idle timers of heartbeating clients, by client_id
+        self.heartbeats = 0
+        self.idle_reaped = 0
+        self.latency = LatencyRecorder(LB_PHASES)
+        self._correlation_seq = 0
+        self.metrics = MetricsRegistry()
+        self.messages_in = self.metrics.counter("lb_messages_in_total", "Client messages received, by type", ("type",))
+        self.messages_out = self.metrics.counter("lb_messages_out_total", "Backend frames delivered to clients, by type",
+                                                 ("type",))
+        self.bytes_in = self.metrics.counter("lb_bytes_in_total", "Bytes read from clients")
+        self.bytes_out = self.metrics.counter("lb_bytes_out_total", "Payload bytes delivered to clients")
+        self._register_metrics()
         self._update_lock = asyncio.Lock() # Lock to prevent concurrent updates
 
-    async def _close_server_connection(self, server_index):
-        """Safely close connection and cancel reader task for a server index."""
-        if server_index in self.server_connections:
-            reader, writer, read_task = self.server_connections.pop(server_index)
-            host, port = self.backend_servers[server_index]
-            peer_name = f"server {host}:{port} (idx {server_index})"
-            print(f"[*] Closing connection to {peer_name}")
-            if writer and not writer.is_closing():
-                writer.close()
-                try:
-                    await writer.wait_closed()
-                except Exception as e:
-                    print(f"[!] Error closing writer for {peer_name}: {e}")
-            if read_task and not read_task.done():
-                read_task.cancel()
-                try:
-                    await read_task # Allow task to handle cancellation
-                except asyncio.CancelledError:
-                    print(f"[*] Reader task for {peer_name} cancelled.")
-                except Exception as e:
-                    print(f"[!] Error awaiting cancelled reader task for {peer_name}: {e}")
+    async def _close_server_connection(self, key):
+        """Safely close every pooled connection to a backend and take it out of selection."""
+        if key in self.server_connections:
+            pool = self.server_connections.pop(key)
+            peer_name = f"server {key}"
+            print(f"[*] Closing {len(pool)} connection(s) to {peer_name}")
+            await asyncio.gather(*(self._close_backend_connection(conn, peer_name) for conn in pool),
+                                 return_exceptions=True)
             print(f"[*] Connection to {peer_name} closed successfully.")
-        if server_index in self.healthy_indices:
-             self.healthy_indices.discard(server_index)
+        backend = self.backends.get(key)
+        if backend:
+            self.selector.remove(backend)
+        self.healthy_keys.discard(key)
+
+    async def _close_backend_connection(self, conn, peer_name):
+        """Closes one pooled connection and cancels its reader task."""
+        writer, read_task = conn.writer, conn.read_task
+        if writer and not writer.is_closing():
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception as e:
+                print(f"[!] Error closing writer for {peer_name} conn {conn.slot}: {e}")
+        if read_task and not read_task.done() and read_task is not asyncio.current_task():
+            read_task.cancel()
+            try:
+                await read_task # Allow task to handle cancellation
+            except asyncio.CancelledError:
+                print(f"[*] Reader task for {peer_name} conn {conn.slot} cancelled.")
+            except Exception as e:
+                print(f"[!] Error awaiting cancelled reader task for {peer_name} conn {conn.slot}: {e}")
+
+    async def _drop_pool_connection(self, key, conn):
+        """Removes one failed connection from a backend's pool.
+
+        The backend stays in rotation on its remaining connections; it is only
+        closed (and taken out of selection) when the last one goes.
+        """
+        pool = self.server_connections.get(key)
+        if not pool or conn not in pool:
+            return
+        pool.remove(conn)
+        peer_name = f"server {key}"
+        print(f"[*] Dropping connection {conn.slot} to {peer_name} ({len(pool)} left in pool)")
+        await self._close_backend_connection(conn, peer_name)
+        if not pool:
+            await self._close_server_connection(key)
+
+    # --- Client presence notices to backends ---
+
+    def _send_control(self, conn, control):
+        if not conn.writer.is_closing():
+            conn.writer.write(conn.control_frame(json.dumps(control).encode("utf-8")))
+
+    def _open_connection(self, key):
+        """Any open pooled connection to a backend, or None."""
+        for conn in self.server_connections.get(key, ()):
+            if not conn.writer.is_closing():
+                return conn
+        return None
+
+    def _queue_client_gone(self, client):
+        """Queues a disconnect notice for every backend that was told about the client."""
+        if not client.backends:
+            return
+        for key in client.backends:
+            self._gone_pending.setdefault(key, []).append(client.client_id)
+        if self._presence_flush_handle is None:
+            self._presence_flush_handle = asyncio.get_running_loop().call_later(
+                self.presence_batch_delay, self._flush_client_gone)
+
+    def _flush_client_gone(self, only_key=None):
+        """Sends queued disconnects, one frame per backend. Backends that are down keep theirs until they reconnect."""
+        if only_key is None:
+            self._presence_flush_handle = None
+        for key in ([only_key] if only_key else list(self._gone_pending)):
+            conn = self._open_connection(key)
+            if conn is None:
+                if key not in self.backends and key not in self._drains:
+                    self._gone_pending.pop(key, None) # No longer listed: nobody left to tell
+                continue
+            client_ids = self._gone_pending.pop(key, None)
+            if not client_ids:
+                continue
+            if len(client_ids) == 1:
+                self._send_control(conn, {"type": "client_disconnected", "client_id": client_ids[0]})
+                continue
+            for i in range(0, len(client_ids), PRESENCE_BATCH_MAX):
+                self._send_control(conn, {"type": "clients_gone", "client_ids": client_ids[i:i + PRESENCE_BATCH_MAX]})
+
+    def _announce_clients(self, key):
+        """After (re)connecting to a backend: reports clients that left meanwhile and the ones still here."""
+        conn = self._open_connection(key)
+        if conn is None:
+            return
+        self._flush_client_gone(only_key=key)
+        client_ids = [client.client_id for client in self.client_connections.values() if key in client.backends]
+        for i in range(0, len(client_ids), PRESENCE_BATCH_MAX):
+            self._send_control(conn, {"type": "clients_connected", "client_ids": client_ids[i:i + PRESENCE_BATCH_MAX]})
+
+    def _start_draining(self, key, backend, reason, by_backend=False):
+        """Stops sending new requests to a backend and closes it once its in-flight requests are answered.
+
+        Responses and pushes keep flowing from it meanwhile, so clients it was
+        serving see no errors and do not have to reconnect and log in again.
+        """
+        if backend is None or backend.draining or key not in self.server_connections:
+            return False
+        if self.drain_timeout <= 0:
+            return False
+        backend.draining = True
+        self.selector.remove(backend)
+        print(f"[*] Draining backend {key} ({reason}): {backend.in_flight} request(s) in flight, "
+              f"timeout {self.drain_timeout:g}s.")
+        task = asyncio.create_task(self._drain_backend(key, backend), name=f"Drain-{key}")
+        self._drains[key] = (backend, task, by_backend)
+        return True
+
+    async def _drain_backend(self, key, backend):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.drain_timeout
+        try:
+            while backend.in_flight > 0 and key in self.server_connections and loop.time() < deadline:
+                await asyncio.sleep(0.1)
+            if key not in self.server_connections:
+                print(f"[*] Draining backend {key} disconnected before it finished.")
+            elif backend.in_flight > 0:
+                print(f"[!] Drain timeout for backend {key}: closing with {backend.in_flight} request(s) unanswered.")
+            else:
+                print(f"[*] Backend {key} drained.")
+            # Tell the backend the close is deliberate, so it keeps the sessions of the clients it served
+            release = json.dumps({"type": "released"}).encode("utf-8")
+            for conn in self.server_connections.get(key, ()):
+                if not conn.writer.is_closing():
+                    conn.writer.write(conn.control_frame(release))
+            self.healthy_keys.discard(key)
+            await self._close_server_connection(key)
+        except asyncio.CancelledError:
+            print(f"[*] Stopped draining backend {key}.")
+        finally:
+            backend.draining = False
+            if key in self._drains and self._drains[key][0] is backend:
+                del self._drains[key]
+
+    def _cancel_drain(self, key):
+        """Keeps a backend the LB was draining after all (it was listed again). Returns its Backend, or None.
+
+        Backends that announced their own shutdown keep draining.
+        """
+        drain = self._drains.get(key)
+        if drain is None or drain[2]:
+            return None
+        backend, task, _ = self._drains.pop(key)
+        task.cancel()
+        backend.draining = False
+        return backend
+
+    def schedule_update(self):
+        """Debounces servers.json events: reloads once the file has been quiet for update_debounce seconds."""
+        if self._update_handle is not None:
+            self._update_handle.cancel()
+        loop = asyncio.get_running_loop()
+        self._update_handle = loop.call_later(self.update_debounce, self._run_scheduled_update)
+
+    def _run_scheduled_update(self):
+        self._update_handle = None
+        asyncio.create_task(self.update_servers(), name="UpdateServers")
+
+    def _read_server_list(self):
+        """Parses servers.json into an ordered map of key -> (host, port, weight)."""
+        with open(self.servers_path, "r") as f:
+            servers_raw = json.load(f)
+        servers = {}
+        for s in servers_raw:
+            try:
+                host, port = s["host"], int(s["port"])
+                weight = max(1, int(s.get("weight", 1)))
+            except (KeyError, TypeError, ValueError):
+                print(f"[!] Ignoring malformed servers.json entry: {s}")
+                continue
+            servers.setdefault(f"{host}:{port}", (host, port, weight)) # First entry wins on duplicates
+        return servers
+
+    def reload_limits(self):
+        """(Re)reads limits.json. Keeps the current limits if the file is unusable."""
+        if not self.limits_path or not os.path.exists(self.limits_path):
+            limits = RateLimits()
+        else:
+            try:
+                limits = load_limits(self.limits_path)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                print(f"[!] Could not load rate limits from {self.limits_path}: {e}. Keeping current limits.")
+                return
+        self.limits = limits
+        accept = limits.accept.scaled(self.accept_share) if limits.accept else None
+        self._accept_bucket = TokenBucket(accept, asyncio.get_running_loop().time()) if accept else None
+        if limits.enabled or accept:
+            print(f"[*] Rate limits: client={'%g/s' % limits.client.rate if limits.client else 'off'} "
+                  f"types={ {name: limit.rate for name, limit in limits.types.items()} } "
+                  f"accept={'%g/s' % accept.rate if accept else 'off'} "
+                  f"disconnect after {limits.max_throttled or 'never'} throttled/{limits.throttle_window:g}s")
+        else:
+            print("[*] No rate limits configured.")
 
     async def update_servers(self):
-        """Reload servers.json, perform health checks, and manage connections."""
+        """Reload servers.json and apply only what changed.
+
+        Backends that stay listed keep their connections and selection state;
+        only removed backends are closed and only added (or currently
+        disconnected) ones are health checked and connected.
+        """
         async with self._update_lock:
             print("[*] Update triggered: Reloading servers.json...")
             try:
-                with open(servers_path, "r") as f:
-                    servers_raw = json.load(f)
-                
-                # Deduplicate servers
-                seen_servers = set()
-                current_servers_list = []
-                for s in servers_raw:
-                    server_tuple = (s["host"], s["port"])
-                    if server_tuple not in seen_servers:
-                        current_servers_list.append(server_tuple)
-                        seen_servers.add(server_tuple)
-                
-                # --- Health Check Phase ---
-                print("[*] Performing health checks...")
-                health_tasks = []
-                current_healthy_indices = set()
-                for i, (host, port) in enumerate(current_servers_list):
-                    health_tasks.append(asyncio.create_task(
-                        self.check_backend_health(host, port, self.health_check_timeout),
-                        name=f"HealthCheck-{i}"
-                    ))
-                
-                health_results = await asyncio.gather(*health_tasks, return_exceptions=True)
-                
-                for i, result in enumerate(health_results):
-                    host, port = current_servers_list[i]
-                    if isinstance(result, Exception) or not result:
-                        print(f"  - Backend {host}:{port} (idx {i}) - FAILED")
-                    else:
-                        print(f"  - Backend {host}:{port} (idx {i}) - PASSED")
-                        current_healthy_indices.add(i)
-                
-                # --- Connection Management Phase ---
-                old_backend_servers = self.backend_servers
-                old_healthy_indices = self.healthy_indices
-                
-                self.backend_servers = current_servers_list # Update server list *after* health checks
-                self.healthy_indices = current_healthy_indices
-                
-                # Indices based on the *new* self.backend_servers list
-                new_indices = set(range(len(self.backend_servers)))
-                indices_to_connect = self.healthy_indices - set(self.server_connections.keys())
-                indices_to_close = set(self.server_connections.keys()) - self.healthy_indices
-                
-                close_tasks = []
-                for index_to_close in indices_to_close:
-                    close_tasks.append(self._close_server_connection(index_to_close))
-                if close_tasks:
-                    print(f"[*] Closing connections to unhealthy/removed servers: {indices_to_close}")
-                    await asyncio.gather(*close_tasks, return_exceptions=True)
-                    
-                connect_tasks = []
-                for index_to_connect in indices_to_connect:
-                    if index_to_connect in self.healthy_indices: # Double check health before connecting
-                         print(f"[*] New healthy server detected or needs connection: {self.backend_servers[index_to_connect]}")
-                         connect_tasks.append(self.connect_to_backend(index_to_connect))
-                if connect_tasks:
-                    print(f"[*] Establishing connections to new/healthy servers: {indices_to_connect}")
-                    await asyncio.gather(*connect_tasks, return_exceptions=True)
-
-                # Update Round Robin Pool
-                if self.healthy_indices:
-                    # Ensure pool uses indices present in server_connections
-                    connected_healthy_indices = sorted(list(self.healthy_indices.intersection(self.server_connections.keys())))
-                    if connected_healthy_indices:
-                         self.round_robin_pool = itertools.cycle(connected_healthy_indices)
-                         print(f"[*] Updated round robin pool with indices: {connected_healthy_indices}")
-                    else:
-                         self.round_robin_pool = None
-                         print("[!] No connected healthy servers available for round robin.")
+                try:
+                    servers = self._read_server_list()
+                except FileNotFoundError:
+                    print(f"[!] {self.servers_path} not found. No servers loaded.")
+                    servers = {}
+
+                removed = [key for key in self.backends if key not in servers]
+                added = [key for key in servers if key not in self.backends]
+
+                # --- Removal Phase ---
+                if removed:
+                    print(f"[*] Backends removed from servers.json: {removed}")
+                    # Connected ones are drained first so their in-flight requests still get answered
+                    to_close = [key for key in removed
+                                if not self.backends[key].draining
+                                and not self._start_draining(key, self.backends[key], "removed from servers.json")]
+                    await asyncio.gather(*(self._close_server_connection(key) for key in to_close),
+                                         return_exceptions=True)
+
+                # Rebuild in file order; Backend objects (in-flight counts, RTT, ejection state) carry over
+                old_backends = self.backends
+                self.backends = {}
+                weights_changed = False
+                for key, (host, port, weight) in servers.items():
+                    backend = old_backends.get(key)
+                    if backend is None:
+                        backend = self._cancel_drain(key) # Listed again while draining: keep its connections
+                    if backend is None:
+                        backend = Backend(host, port, weight)
+                    elif backend.weight != weight:
+                        backend.weight = weight
+                        weights_changed = True
+                    self.backends[key] = backend
+                if weights_changed:
+                    self.selector.refresh()
+                if added:
+                    print(f"[*] Backends added to servers.json: {added}")
+
+                # --- Health Check / Connection Phase ---
+                # New backends, plus listed ones that are currently down; connected backends are left alone
+                to_check = [key for key in self.backends if key not in self.server_connections]
+                if to_check:
+                    print(f"[*] Performing health checks on {len(to_check)} backend(s)...")
+                    health_results = await asyncio.gather(
+                        *(self.check_backend_health(self.backends[key].host, self.backends[key].port,
+                                                    self.health_check_timeout) for key in to_check),
+                        return_exceptions=True
+                    )
+                    to_connect = []
+                    for key, result in zip(to_check, health_results):
+                        if isinstance(result, Exception) or not result:
+                            print(f"  - Backend {key} - FAILED")
+                            self.healthy_keys.discard(key)
+                        else:
+                            print(f"  - Backend {key} - PASSED")
+                            self.healthy_keys.add(key)
+                            to_connect.append(key)
+                    if to_connect:
+                        print(f"[*] Establishing connections to new/healthy servers: {to_connect}")
+                        await asyncio.gather(*(self.connect_to_backend(key) for key in to_connect),
+                                             return_exceptions=True)
+
+                # Update selector membership
+                selectable_keys = self._refresh_selector()
+                if selectable_keys:
+                    print(f"[*] Updated {self.selector.name} selector with backends: {selectable_keys}")
+                elif self.healthy_keys:
+                    print("[!] No connected healthy servers available for selection.")
                 else:
-                    self.round_robin_pool = None
                     print("[!] No healthy backend servers available.")
 
-            except FileNotFoundError:
-                 print(f"[!] {servers_path} not found. No servers loaded.")
-                 self.backend_servers = []
-                 self.healthy_indices = set()
-                 self.round_robin_pool = None
-                 # Close any existing connections if file disappears
-                 close_tasks = [self._close_server_connection(idx) for idx in list(self.server_connections.keys())]
-                 if close_tasks:
-                     await asyncio.gather(*close_tasks, return_exceptions=True)
             except json.JSONDecodeError:
-                 print(f"[!] Error decoding JSON from {servers_path}. Server list not updated.")
+                 print(f"[!] Error decoding JSON from {self.servers_path}. Server list not updated.")
             except Exception as e:
                  print(f"[!] Unexpected error during server update: {e}")
 
+    def _refresh_selector(self):
+        """Offers the selector every server that is healthy, connected and not ejected."""
+        selectable_keys = [
+            key for key, backend in self.backends.items()
+            if key in self.healthy_keys and key in self.server_connections and not backend.ejected
+            and key not in self._drains
+        ]
+        self.selector.set_members(self.backends[key] for key in selectable_keys)
+        return selectable_keys
+
+    # --- Active and passive health checking ---
+
+    async def health_check_loop(self):
+        """Pings every listed backend on a schedule.
+
+        Besides detecting hung backends (which still accept TCP connections),
+        the loop reconnects backends that dropped, re-admits ejected ones once
+        their backoff has passed, and turns overdue requests into failures.
+        """
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            try:
+                async with self._update_lock:
+                    self._check_response_timeouts()
+                    await asyncio.gather(*(self._probe_backend(key) for key in list(self.backends)),
+                                         return_exceptions=True)
+                    self._refresh_selector()
+            except Exception as e:
+                print(f"[!] Unexpected error during periodic health check: {e}")
+
+    async def _probe_backend(self, key):
+        """Runs one active check of a backend: reconnect if needed, then ping every pooled connection."""
+        backend = self.backends[key]
+        now = asyncio.get_running_loop().time()
+        if backend.ejected and now < backend.ejected_until:
+            return # Still backing off
+        if key in self._drains:
+            return # Closed once drained; probed (and reconnected) again after that
+
+        if key not in self.server_connections:
+            if not await self.check_backend_health(backend.host, backend.port, self.health_check_timeout):
+                self.healthy_keys.discard(key)
+                self._record_backend_failure(key, "unreachable")
+                return
+            self.healthy_keys.add(key)
+            if not await self.connect_to_backend(key):
+                self._record_backend_failure(key, "connect failed")
+                return
+
+        pool = list(self.server_connections.get(key, ()))
+        results = await asyncio.gather(*(self._ping(conn) for conn in pool), return_exceptions=True)
+        rtts = [r for r in results if isinstance(r, float)]
+        if len(rtts) < len(pool):
+            self._record_backend_failure(key, f"{len(pool) - len(rtts)}/{len(pool)} pings unanswered")
+            return
+        for rtt in rtts:
+            backend.record_rtt(rtt, self.rtt_alpha)
+        backend.failures = 0
+        if backend.ejected:
+            backend.ejected_until = 0.0
+            backend.admitted_at = now
+            print(f"[*] Backend {key} answered pings again. Re-admitted (rtt {backend.rtt * 1000:.1f}ms).")
+        elif backend.ejections and now - backend.admitted_at > self.eject_backoff_max:
+            backend.ejections = 0 # Healthy for a full backoff period: forget past ejections
+
+    async def _ping(self, conn):
+        """Sends an application-level ping on one connection. Returns the round trip in seconds."""
+        loop = asyncio.get_running_loop()
+        self._ping_seq += 1
+        seq = self._ping_seq
+        pong = loop.create_future()
+        conn.pending_pings[seq] = pong
+        payload = json.dumps({"type": "ping", "seq": seq}).encode("utf-8")
+        started = loop.time()
+        try:
+            conn.writer.write(conn.control_frame(payload))
+            await asyncio.wait_for(conn.writer.drain(), timeout=self.health_check_timeout)
+            await asyncio.wait_for(pong, timeout=self.health_check_timeout)
+            return loop.time() - started
+        finally:
+            conn.pending_pings.pop(seq, None)
+
+    def _handle_control_frame(self, key, conn, payload):
+        """Handles a frame the backend addressed to the LB itself."""
+        try:
+            control = json.loads(bytes(payload)) # May be a view into the receive buffer
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            print(f"[!] Invalid control frame from server {key}.")
+            return
+        if control.get("type") == LOAD_REPORT_TYPE:
+            self._on_load_report(key, control)
+            return
+        if control.get("type") == "draining":
+            # The backend is shutting down (e.g. SIGTERM during a rolling restart)
+            self._start_draining(key, self.backends.get(key), "backend is shutting down", by_backend=True)
+            return
+        if control.get("type") == "pong":
+            pong = conn.pending_pings.get(control.get("seq"))
+        elif "status" in control and conn.pending_pings:
+            # A backend without ping support answers with an 'unknown request type'
+            # error; it still shows the event loop is responsive.
+            pong = conn.pending_pings[min(conn.pending_pings)]
+        else:
+            print(f"[!] Unknown control frame from server {key}: {control}")
+            return
+        if pong and not pong.done():
+            pong.set_result(None)
+
+    def _on_load_report(self, key, report):
+        """Records a backend's load report and updates its load factor."""
+        backend = self.backends.get(key)
+        if backend is None or not self.load_feedback:
+            return
+        try:
+            lag = max(0.0, float(report.get("lag", 0)))
+            pending = max(0.0, float(report.get("pending", 0)) + float(report.get("executor_queue", 0)))
+            interval = max(0.0, float(report.get("interval", 0)))
+        except (TypeError, ValueError):
+            print(f"[!] Invalid load report from server {key}: {report}")
+            return
+        now = asyncio.get_running_loop().time()
+        backend.record_load(lag, pending, interval, now, self.load_weighting.alpha)
+        if self.load_weighting.update((backend,), now):
+            self.selector.on_load_change()
+
+    async def load_weighting_loop(self):
+        """Keeps load factors current between reports: a backend whose report is overdue is treated as lagging."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.load_update_interval)
+            if self.load_weighting.update(self.backends.values(), loop.time()):
+                self.selector.on_load_change()
+
+    def _record_backend_failure(self, key, reason):
+        """Counts a failure against a backend and ejects it after eject_threshold in a row."""
+        backend = self.backends.get(key)
+        if backend is None or backend.ejected:
+            return # No longer listed, or already sitting out
+        backend.failures += 1
+        print(f"[!] Backend {key} failure {backend.failures}/{self.eject_threshold}: {reason}")
+        if backend.failures < self.eject_threshold:
+            return
+        backoff = min(self.eject_backoff_max, self.eject_backoff * (2 ** backend.ejections))
+        backend.ejections += 1
+        backend.failures = 0
+        backend.ejected_until = asyncio.get_running_loop().time() + backoff
+        self.selector.remove(backend)
+        print(f"[!] Ejecting backend {key} for {backoff:.1f}s.")
+
+    def _check_response_timeouts(self):
+        """Counts requests that have waited longer than response_timeout as backend failures."""
+        deadline = asyncio.get_running_loop().time() - self.response_timeout
+        for pending in self.client_in_flight.values():
+            for request in pending:
+                if request.sent_at > deadline:
+                    break # Everything after this was sent later
+                if request.timed:
+                    request.timed = False # Count each request once
+                    self._record_backend_failure(request.backend.key, "response timeout")
+
     # ... (check_backend_health remains the same) ...
     async def check_backend_health(self, host, port, timeout):
         """Performs a quick TCP connection check to the backend server."""
@@ -170,49 +700,116 @@ class LoadBalancer:
 
     # Remove perform_health_checks as a separate public method, logic moved into update_servers
 
-    async def connect_to_backend(self, server_index):
+    async def connect_to_backend(self, key):
         """Establishes and stores connection to a backend server."""
-        # Prevent connecting if already connected or index out of bounds
-        if server_index >= len(self.backend_servers) or server_index in self.server_connections:
-             # print(f"[*] Skipping connection attempt for index {server_index} (already connected or invalid)")
+        # Prevent connecting if already connected or no longer listed
+        backend = self.backends.get(key)
+        if backend is None or key in self.server_connections:
+             # print(f"[*] Skipping connection attempt for {key} (already connected or not listed)")
              return False 
              
-        host, port = self.backend_servers[server_index]
-        peer_name = f"server {host}:{port} (idx {server_index})"
-        print(f"[*] Attempting to connect to backend {peer_name}...")
-        try:
-            reader, writer = await asyncio.wait_for(
-                asyncio.open_connection(host, port),
+        host, port = backend.host, backend.port
+        peer_name = f"server {key}"
+        print(f"[*] Attempting to open {self.pool_size} connection(s) to backend {peer_name}...")
+        results = await asyncio.gather(
+            *(asyncio.wait_for(
+                self._open_backend_connection(host, port),
                 timeout=self.health_check_timeout * 2 # Slightly longer timeout for connection
-            )
-            print(f"[*] Successfully connected to backend {peer_name}")
-            # Create and store the reader task
-            read_task = asyncio.create_task(self.read_from_server(reader, server_index), 
-                                          name=f"ServerRead-{server_index}")
-            self.server_connections[server_index] = (reader, writer, read_task)
-            return True
-        except (asyncio.TimeoutError, ConnectionRefusedError, OSError) as e:
-            print(f"[!] Failed to connect to backend {peer_name}: {e}")
-            # Don't mark as unhealthy here, health check handles that
+            ) for _ in range(self.pool_size)),
+            return_exceptions=True
+        )
+        pool = []
+        for result in results:
+            if isinstance(result, (asyncio.TimeoutError, ConnectionRefusedError, OSError)):
+                print(f"[!] Failed to connect to backend {peer_name}: {result}")
+                # Don't mark as unhealthy here, health check handles that
+            elif isinstance(result, BaseException):
+                print(f"[!] Unexpected error connecting to backend {peer_name}: {result}")
+            else:
+                reader, writer = result
+                pool.append(BackendConnection(reader, writer, len(pool)))
+        if pool and self.protocol_version > PROTOCOL_V1:
+            negotiated = await asyncio.gather(*(self._negotiate(conn, peer_name) for conn in pool))
+            pool = [conn for conn, ok in zip(pool, negotiated) if ok]
+        if not pool:
             return False
-        except Exception as e:
-            print(f"[!] Unexpected error connecting to backend {peer_name}: {e}")
+
+        print(f"[*] Successfully connected to backend {peer_name} ({len(pool)}/{self.pool_size} connections, "
+              f"protocol v{pool[0].version})")
+        if self.backends.get(key) is not backend:
+            # servers.json dropped this backend while we were connecting
+            await asyncio.gather(*(self._close_backend_connection(conn, peer_name) for conn in pool),
+                                 return_exceptions=True)
             return False
+        self.server_connections[key] = pool
+        # Create the reader tasks, one per pooled connection
+        for conn in pool:
+            conn.read_task = asyncio.create_task(self.read_from_server(conn, key),
+                                                 name=f"ServerRead-{key}-{conn.slot}")
+        self._announce_clients(key)
+        return True
+
+    async def _open_backend_connection(self, host, port):
+        """Opens one backend connection with the configured transport. Returns (reader, writer)."""
+        if self.transport == TRANSPORT_BUFFERED:
+            loop = asyncio.get_running_loop()
+            _, protocol = await loop.create_connection(
+                lambda: BackendFrameProtocol(BACKEND_MAX_FRAME_SIZE), host, port)
+            return None, protocol
+        return await asyncio.open_connection(host, port)
+
+    async def _negotiate(self, conn, peer_name):
+        """Offers the v2 envelope on a fresh connection, before its reader task starts.
+
+        Returns False (after closing the connection) if the backend does not answer.
+        """
+        versions = [v for v in SUPPORTED_VERSIONS if v <= self.protocol_version]
+        features = [f for f in SUPPORTED_FEATURES if f != FEATURE_LOAD_REPORT or self.load_feedback]
+        hello = json.dumps({"type": "hello", "versions": versions, "features": features}).encode("utf-8")
 
-    async def read_from_server(self, server_reader, server_index):
-        """Reads responses from a server and forwards to clients."""
-        # Ensure server_index is valid before proceeding
-        if server_index >= len(self.backend_servers):
-             print(f"[!] Invalid server_index {server_index} in read_from_server. Stopping task.")
+        async def read_reply():
+            if conn.reader is None:
+                return await conn.writer.read_frame()
+            len_data = await conn.reader.readexactly(4)
+            return await conn.reader.readexactly(struct.unpack("!I", len_data)[0])
+
+        try:
+            conn.writer.write(conn.control_frame(hello))
+            await conn.writer.drain()
+            message_data = await asyncio.wait_for(read_reply(), timeout=self.health_check_timeout * 2)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionResetError, BrokenPipeError, OSError) as e:
+            print(f"[!] No protocol hello reply from {peer_name} conn {conn.slot}: {e!r}")
+            await self._close_backend_connection(conn, peer_name)
+            return False
+        try:
+            reply = json.loads(message_data[1 + message_data[0]:]) # Replies always come as v1
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            reply = {}
+        if reply.get("type") == "hello" and reply.get("version") in versions:
+            conn.version = reply["version"]
+            conn.correlated = conn.version == PROTOCOL_V2 and FEATURE_CORRELATION in (reply.get("features") or ())
+        # Anything else (e.g. an 'unknown request' error from an older backend) means staying on v1
+        return True
+
+    async def read_from_server(self, conn, key):
+        """Reads responses from one pooled server connection and forwards to clients."""
+        backend = self.backends.get(key)
+        if backend is None:
+             print(f"[!] Backend {key} is no longer listed in read_from_server. Stopping task.")
              return 
-             
-        host, port = self.backend_servers[server_index]
-        peer_name = f"server {host}:{port} (idx {server_index})"
+
+        peer_name = f"server {key} (conn {conn.slot})"
+        server_reader = conn.reader
         print(f"[*] Starting reader task for {peer_name}")
         try:
+            if server_reader is None:
+                # Buffered transport: frames are handled as they arrive, this task only waits for the end
+                conn.writer.set_frame_handler(lambda frame: self._on_server_frame(key, conn, backend, frame))
+                exc = await conn.writer.wait_lost()
+                raise exc or ConnectionResetError("Connection closed by backend")
             while True:
                 # Check if connection still exists before reading
-                if server_index not in self.server_connections:
+                if conn not in self.server_connections.get(key, ()):
                     print(f"[*] Connection for {peer_name} no longer exists. Stopping reader task.")
                     break
                     
@@ -220,121 +817,368 @@ class LoadBalancer:
                 total_msg_len = struct.unpack("!I", len_data)[0]
                 
                 # Basic sanity check for message length
-                if total_msg_len > 10 * 1024 * 1024: # e.g., 10MB limit
+                if total_msg_len > BACKEND_MAX_FRAME_SIZE:
                     print(f"[!] Excessive message length ({total_msg_len} bytes) received from {peer_name}. Closing connection.")
-                    await self._close_server_connection(server_index)
+                    await self._drop_pool_connection(key, conn)
                     break
                     
                 message_data = await server_reader.readexactly(total_msg_len)
-
-                client_id_len = struct.unpack("!B", message_data[:1])[0]
-                client_id_end = 1 + client_id_len
-                client_id = message_data[1:client_id_end].decode("utf-8")
-                server_response_data = message_data[client_id_end:]
-
-                client_info = self.client_connections.get(client_id)
-                if client_info:
-                    _, client_writer = client_info
-                    if client_writer and not client_writer.is_closing():
-                        try:
-                            client_writer.write(server_response_data)
-                            await client_writer.drain()
-                        except (ConnectionResetError, BrokenPipeError, OSError) as e:
-                            print(f"[!] Error writing to client {client_id}: {e}. Closing client connection.")
-                            if client_id in self.client_connections:
-                                cr, cw = self.client_connections.pop(client_id)
-                                if cw and not cw.is_closing():
-                                    cw.close()
-                                    # Don't await wait_closed here to avoid blocking server reader
-                    else:
-                         print(f"[!] Client {client_id} writer is closed or missing. Cannot forward response.")
-                else:
-                    print(f"[!] Received response for unknown or disconnected client ID: {client_id}")
+                self._on_server_frame(key, conn, backend, message_data)
 
         except (asyncio.IncompleteReadError, ConnectionResetError, BrokenPipeError, OSError) as e:
             print(f"[*] Connection issue with {peer_name}: {e}. Closing connection.")
             # Schedule closing in the main loop to avoid deadlocks/re-entrancy issues
-            asyncio.create_task(self._close_server_connection(server_index))
+            asyncio.create_task(self._drop_pool_connection(key, conn))
         except asyncio.CancelledError:
              print(f"[*] Reader task for {peer_name} was cancelled.")
              # Connection should be closed by the canceller (_close_server_connection)
         except Exception as e:
             print(f"[!] Unexpected error reading from {peer_name}: {e}. Closing connection.")
-            asyncio.create_task(self._close_server_connection(server_index))
+            asyncio.create_task(self._drop_pool_connection(key, conn))
         # finally:
             # print(f"[*] Reader task for {peer_name} finished.") 
             # Cleanup is handled by _close_server_connection or cancellation
 
-    # ... (read_from_client remains mostly the same, but check server connection validity) ...
-    async def read_from_client(self, client_reader, client_writer, client_id):
-        """Reads requests from a client and forwards to backend servers."""
+    def _on_server_frame(self, key, conn, backend, message_data):
+        """Routes one backend frame (without its length prefix) to its client.
+
+        message_data is bytes with the streams transport and a memoryview into
+        the receive buffer with the buffered one; only the client payload is
+        copied out of it, once, because it has to outlive this call.
+        """
+        if conn.version == PROTOCOL_V2:
+            if message_data[0] == KIND_CONTROL:
+                self._handle_control_frame(key, conn, message_data[V2_HEADER_SIZE:])
+                return
+            if message_data[0] == KIND_MULTICAST:
+                backend.failures = 0
+                self._on_multicast_frame(key, message_data[V2_HEADER_SIZE:])
+                return
+            wire_id = bytes(message_data[2:V2_HEADER_SIZE])
+            client = self.wire_clients.get(wire_id)
+            client_id = client.client_id if client else client_id_from_wire(wire_id)
+            if message_data[1] & FLAG_CORRELATED:
+                # The response to one particular request
+                correlation_id = CORRELATION_ID.unpack_from(message_data, V2_HEADER_SIZE)[0]
+                backend.failures = 0
+                self._deliver_to_client(client_id, bytes(message_data[V2_HEADER_SIZE + CORRELATION_ID.size:]),
+                                        correlation_id=correlation_id)
+                return
+            server_response_data = bytes(message_data[V2_HEADER_SIZE:])
+        else:
+            client_id_end = 1 + message_data[0]
+            client_id = str(message_data[1:client_id_end], "utf-8")
+            if not client_id:
+                self._handle_control_frame(key, conn, message_data[client_id_end:])
+                return
+            server_response_data = bytes(message_data[client_id_end:])
+        backend.failures = 0 # Any answer ends a run of consecutive failures
+
+        if self.router and self.router.is_remote(client_id):
+            # A push for a client that another worker accepted
+            droppable = peek_message_type(server_response_data) in self.droppable_types
+            if not self.router.forward(client_id, server_response_data, droppable):
+                print(f"[!] Could not forward frame for client {client_id} to its worker.")
+            return
+        self._deliver_to_client(client_id, server_response_data)
+
+    def _on_multicast_frame(self, key, body):
+        """Fans one multicast payload out to each of its target clients.
+
+        The payload is copied out of the frame once and shared: every local
+        client gets the same bytes object, framed with its own prefix.
+        """
+        try:
+            wire_ids, payload = split_multicast(body)
+        except ValueError as e:
+            print(f"[!] Invalid multicast frame from server {key}: {e}")
+            return
+        payload = bytes(payload)
+        msg_type = peek_message_type(payload)
+        droppable = msg_type in self.droppable_types
+        for wire_id in wire_ids:
+            client = self.wire_clients.get(wire_id)
+            if client:
+                self._deliver_to_client(client.client_id, payload, droppable, msg_type=msg_type, fanout=True)
+                continue
+            client_id = client_id_from_wire(wire_id)
+            if self.router and self.router.is_remote(client_id):
+                if not self.router.forward(client_id, payload, droppable):
+                    print(f"[!] Could not forward multicast frame for client {client_id} to its worker.")
+            else:
+                print(f"[!] Received multicast for unknown or disconnected client ID: {client_id}")
+
+    def _deliver_to_client(self, client_id, payload, droppable=None, correlation_id=None, msg_type=None,
+                           fanout=False):
+        """Hands a backend frame to one of this worker's clients.
+
+        fanout: one recipient of a multicast, which never answers a request.
+        """
+        if msg_type is None:
+            msg_type = peek_message_type(payload)
+        if not fanout:
+            self._complete_request(client_id, correlation_id, msg_type)
+        client = self.client_connections.get(client_id)
+        if client:
+            # Hand off to the client's own writer task; never wait on a single client here
+            if droppable is None:
+                droppable = msg_type in self.droppable_types
+            self.messages_out.inc(labels=(msg_type or "response",))
+            self.bytes_out.inc(len(payload))
+            if not client.send(payload, droppable):
+                 print(f"[!] Client {client_id} is disconnecting. Cannot forward response.")
+        else:
+            print(f"[!] Received response for unknown or disconnected client ID: {client_id}")
+
+    def _select_server(self, client_id, client_hash):
+        """Picks a healthy, connected server and one of its pooled connections.
+
+        Returns (Backend, BackendConnection) or (None, None).
+        """
+        # Each failed attempt removes a stale member, so this ends within len(selector) tries
+        for _ in range(len(self.selector)):
+            backend = self.selector.pick(client_id)
+            if backend is None:
+                break
+            key = backend.key
+            if key in self.healthy_keys:
+                conn = self._select_connection(self.server_connections.get(key), client_hash)
+                if conn:
+                    return backend, conn
+                print(f"[!] Server {key} selected but has no open connection.")
+            self.selector.remove(backend)
+        return None, None
+
+    def _select_connection(self, pool, client_hash):
+        """Chooses a connection from a backend's pool, skipping ones that are closing."""
+        if not pool:
+            return None
+        if len(pool) == 1:
+            conn = pool[0]
+        elif self.pool_select == POOL_SELECT_LEAST_QUEUED:
+            conn = min(pool, key=BackendConnection.queued_bytes)
+        else:
+            conn = pool[client_hash % len(pool)]
+        if conn.writer.is_closing():
+            open_conns = [c for c in pool if not c.writer.is_closing()]
+            return open_conns[client_hash % len(open_conns)] if open_conns else None
+        return conn
+
+    def _complete_request(self, client_id, correlation_id=None, msg_type=None):
+        """Marks the client's outstanding request that a backend frame answers, if it answers one.
+
+        A correlated response answers the request with its correlation id,
+        and the request's latencies are recorded. An uncorrelated frame
+        without a "type" is a response (v1 backends, v2 links without
+        correlation): it answers the oldest request not matched by
+        correlation id and answered by a push, or failing that the oldest
+        one that is (its validation error). A frame with a "type" is a push
+        and answers nothing, except the push listed in reply_push_types for
+        a request type (the return_app answering request_app, possibly from
+        another backend).
+        """
+        pending = self.client_in_flight.get(client_id)
+        if not pending:
+            return
+        answered_by_push = None # Oldest request_app-like request, in case the response is its error
+        for request in pending:
+            if correlation_id is not None:
+                if request.correlation_id == correlation_id:
+                    break
+            elif msg_type is None:
+                if request.correlation_id is None:
+                    if request.msg_type not in self.reply_push_types:
+                        break
+                    if answered_by_push is None:
+                        answered_by_push = request
+            elif self.reply_push_types.get(request.msg_type) == msg_type:
+                break
+        else:
+            if answered_by_push is None:
+                return # A push, or a response for a request already given up on
+            request = answered_by_push
+        if request is pending[0]:
+            pending.popleft()
+        else:
+            pending.remove(request)
+        self.selector.on_complete(request.backend)
+        if correlation_id is not None and request.written_at is not None:
+            now = time.perf_counter()
+            self.latency.record(request.msg_type, "backend", now - request.written_at)
+            self.latency.record(request.msg_type, "total", now - request.received_at)
+
+    def _release_client_requests(self, client_id):
+        """Drops all outstanding requests of a client that went away."""
+        pending = self.client_in_flight.pop(client_id, None)
+        while pending:
+            self.selector.on_complete(pending.popleft().backend)
+
+    def _send_client_error(self, client, message):
+        """Queues an LB-generated error response for a client."""
+        payload = json.dumps({"status": "error", "message": message}).encode("utf-8")
+        client.send(payload)
+
+    def _send_throttled(self, client, msg_type, retry_after):
+        """Tells a client that one of its messages was dropped by a rate limit."""
+        payload = json.dumps({
+            "status": "error",
+            "message": f"Rate limit exceeded for '{msg_type}'. Retry in {retry_after:.2f}s." if msg_type
+                       else f"Rate limit exceeded. Retry in {retry_after:.2f}s.",
+            "retry_after": round(retry_after, 3)
+        }).encode("utf-8")
+        client.send(payload)
+
+    def _answer_heartbeat(self, client, frame):
+        """Answers a client's heartbeat without involving a backend, and puts the client under the idle timeout."""
+        self.heartbeats += 1
+        if self.idle_timeout > 0 and client.client_id not in self.idle_wheel:
+            self.idle_wheel.add(client.client_id, self.idle_wheel.ticks(self.idle_timeout))
+        ack = {"type": HEARTBEAT_ACK_TYPE, "idle_timeout": self.idle_timeout}
+        try:
+            seq = json.loads(frame).get("seq") # Echoed so the client can match acks and time round trips
+        except (ValueError, AttributeError):
+            seq = None
+        if seq is not None:
+            ack["seq"] = seq
+        client.send(json.dumps(ack).encode("utf-8"))
+
+    def _on_idle_timer(self, client_id):
+        """Idle wheel callback: reaps the client if it stayed silent, else waits for the rest of the timeout."""
+        client = self.client_connections.get(client_id)
+        if client is None:
+            return
+        timeout = self.idle_wheel.ticks(self.idle_timeout)
+        idle = self.idle_wheel.now - client.last_active
+        if idle < timeout:
+            self.idle_wheel.add(client_id, timeout - idle)
+            return
+        print(f"[!] Client {client_id} sent nothing for {idle * self.idle_wheel.tick:g}s "
+              f"(idle timeout {self.idle_timeout:g}s). Disconnecting.")
+        self.idle_reaped += 1
+        self._reap_client(client)
+
+    def _reap_client(self, client):
+        """Drops a client whose peer is presumed gone. Its reader task sees EOF and does the usual cleanup."""
+        client.close()
+        transport = client.writer.transport
+        if transport is not None:
+            transport.abort() # Half-open peers never take the write buffer, so do not wait for it
+
+    async def read_from_client(self, client):
+        """Reads requests from a client, splits them into frames and forwards each to a backend."""
+        client_id = client.client_id
+        client_reader, client_writer, frame_decoder = client.reader, client.writer, client.decoder
         client_addr = client_writer.get_extra_info("peername", "unknown client")
         peer_name = f"client {client_id} ({client_addr})"
         print(f"[*] Starting reader task for {peer_name}")
-        server_writer = None # Initialize server_writer
-        server_index = -1
+        client_id_bytes = client_id.encode("utf-8")
+        client_hash = zlib.crc32(client_id_bytes)
+        loop = asyncio.get_running_loop()
         try:
             while True:
-                client_data = await client_reader.read(4096)
+                client_data = await client_reader.read(self.client_read_size)
                 if not client_data:
                     print(f"[*] {peer_name} disconnected")
                     break
+                received_at = time.perf_counter()
+                client.last_active = self.idle_wheel.now
+                self.bytes_in.inc(len(client_data))
 
-                # Select a healthy and connected server
-                selected_server = False
-                if self.round_robin_pool:
-                    attempts = 0
-                    # Use list of current healthy indices to avoid issues if set changes during iteration
-                    healthy_now = list(self.healthy_indices)
-                    max_attempts = len(healthy_now) 
-                    
-                    while attempts < max_attempts:
-                        attempts += 1
-                        try:
-                             server_index = next(self.round_robin_pool)
-                        except StopIteration: # Should not happen with cycle, but safety check
-                             print("[!] Round robin pool exhausted unexpectedly.")
-                             self.round_robin_pool = itertools.cycle(sorted(list(self.healthy_indices))) if self.healthy_indices else None
-                             if not self.round_robin_pool: break
-                             server_index = next(self.round_robin_pool)
-                             
-                        # Check if the selected index is *still* healthy and connected
-                        if server_index in self.healthy_indices and server_index in self.server_connections:
-                            _, server_writer, _ = self.server_connections[server_index]
-                            if server_writer and not server_writer.is_closing():
-                                selected_server = True
-                                break # Found a valid server
-                            else:
-                                 print(f"[!] Server index {server_index} selected but writer is closed/missing.")
-                                 # Consider removing from healthy_indices or forcing health check?
-                        # else: print(f"[*] Skipping index {server_index} (not healthy or not connected)")
-                
-                if not selected_server:
-                    print(f"[!] No healthy and connected servers available for {peer_name}. Disconnecting client.")
-                    break # Break client loop if no server available
+                try:
+                    frames = frame_decoder.feed(client_data)
+                except FrameTooLarge as e:
+                    print(f"[!] {peer_name} sent an oversized frame: {e}. Disconnecting client.")
+                    self._send_client_error(client, "Message too large")
+                    break
+                except FramingError as e:
+                    print(f"[!] {peer_name} sent unframeable data: {e}. Disconnecting client.")
+                    self._send_client_error(client, "Invalid request format (not JSON)")
+                    break
 
-                # Wrap and send data
-                client_id_bytes = client_id.encode("utf-8")
-                client_id_len = len(client_id_bytes)
-                message_payload = struct.pack("!B", client_id_len) + client_id_bytes + client_data
-                wrapped_message = struct.pack("!I", len(message_payload)) + message_payload
+                # A partial frame and unread bytes count against the client's and the LB's memory budgets
+                self.memory.account_inbound(client.outbound, reader_buffered(client_reader) + frame_decoder.buffered)
+                if not client.outbound.enforce_memory_limit():
+                    break
+                self.memory.check()
+                if client.outbound.closing:
+                    break # Shed to bring the LB back under its budget
 
-                try:
-                    server_writer.write(wrapped_message)
-                    await server_writer.drain()
-                    # print(f"[*] Forwarded data from {peer_name} to server idx {server_index}")
-                except (ConnectionResetError, BrokenPipeError, OSError) as e:
-                    print(f"[!] Error writing to server idx {server_index}: {e}. Closing server connection.")
-                    # Schedule closing in the main loop
-                    asyncio.create_task(self._close_server_connection(server_index))
-                    # Need to break or retry finding another server? For now, break client loop.
-                    print(f"[!] Disconnecting {peer_name} due to server write error.")
-                    break 
-                except Exception as e:
-                     print(f"[!] Unexpected error writing to server idx {server_index}: {e}")
-                     asyncio.create_task(self._close_server_connection(server_index))
-                     print(f"[!] Disconnecting {peer_name} due to unexpected server write error.")
-                     break
+                forward_failed = False
+                limits = self.limits
+                for frame in frames:
+                    msg_type = peek_message_type(frame)
+                    self.messages_in.inc(labels=(msg_type or "unknown",))
+                    if limits.enabled:
+                        now = loop.time()
+                        retry_after = client.limiter.check(limits, msg_type, now)
+                        if retry_after is not None:
+                            # Throttled: answered here, never forwarded
+                            self.throttled_messages += 1
+                            if client.limiter.record_throttle(now):
+                                print(f"[!] {peer_name} keeps exceeding its rate limits. Disconnecting client.")
+                                self.throttle_disconnects += 1
+                                self._send_client_error(client, "Too many requests")
+                                forward_failed = True
+                                break
+                            self._send_throttled(client, msg_type, retry_after)
+                            continue
+                    if msg_type == HEARTBEAT_TYPE:
+                        self._answer_heartbeat(client, frame)
+                        continue
+
+                    # Select a healthy and connected server for each whole message
+                    backend, server_conn = self._select_server(client_id, client_hash)
+                    if server_conn is None:
+                        print(f"[!] No healthy and connected servers available for {peer_name}. Disconnecting client.")
+                        forward_failed = True
+                        break
+
+                    # Wrap the frame; header and frame go out as separate buffers, never joined here
+                    correlation_id = None
+                    if server_conn.correlated:
+                        correlation_id = self._correlation_seq = (self._correlation_seq + 1) & MAX_CORRELATION_ID
+                        header = header_v2(KIND_REQUEST, client.wire_id, CORRELATION_ID.size + len(frame),
+                                           FLAG_CORRELATED) + CORRELATION_ID.pack(correlation_id)
+                    elif server_conn.version == PROTOCOL_V2:
+                        header = header_v2(KIND_REQUEST, client.wire_id, len(frame))
+                    else:
+                        header = header_v1(client_id_bytes, len(frame))
+
+                    self.selector.on_dispatch(backend)
+                    timed = msg_type not in self.untimed_types
+                    request = PendingRequest(backend, loop.time(), timed, msg_type, correlation_id)
+                    request.received_at = received_at
+                    self.client_in_flight.setdefault(client_id, deque()).append(request)
+                    server_writer = server_conn.writer
+                    if backend.key not in client.backends:
+                        # First frame of this client to this backend: announce the client before it
+                        client.backends.add(backend.key)
+                        self._send_control(server_conn, {"type": "client_connected", "client_id": client_id})
+                    try:
+                        write_started = time.perf_counter()
+                        server_writer.writelines((header, frame))
+                        await server_writer.drain()
+                        request.written_at = time.perf_counter()
+                        self.latency.record(msg_type, "queue", write_started - received_at)
+                        self.latency.record(msg_type, "write", request.written_at - write_started)
+                        # print(f"[*] Forwarded data from {peer_name} to server {backend.key}")
+                    except (ConnectionResetError, BrokenPipeError, OSError) as e:
+                        print(f"[!] Error writing to server {backend.key}: {e}. Closing server connection.")
+                        self._record_backend_failure(backend.key, f"write error: {e}")
+                        # Schedule closing in the main loop
+                        asyncio.create_task(self._drop_pool_connection(backend.key, server_conn))
+                        print(f"[!] Disconnecting {peer_name} due to server write error.")
+                        forward_failed = True
+                        break
+                    except Exception as e:
+                         print(f"[!] Unexpected error writing to server {backend.key}: {e}")
+                         self._record_backend_failure(backend.key, f"write error: {e}")
+                         asyncio.create_task(self._drop_pool_connection(backend.key, server_conn))
+                         print(f"[!] Disconnecting {peer_name} due to unexpected server write error.")
+                         forward_failed = True
+                         break
+                if forward_failed:
+                    break
 
         except (asyncio.IncompleteReadError, ConnectionResetError, BrokenPipeError, OSError) as e:
             print(f"[*] Connection issue with {peer_name}: {e}")
@@ -344,17 +1188,27 @@ class LoadBalancer:
             print(f"[!] Unexpected error reading from {peer_name}: {e}")
         finally:
             print(f"[*] Stopping reader task for {peer_name}")
-            if client_id in self.client_connections:
-                _, cw = self.client_connections.pop(client_id)
-                if cw and not cw.is_closing():
-                    cw.close()
-                    # Don't await wait_closed here
+            self._release_client_requests(client_id)
+            self.selector.forget(client_id)
+            self.idle_wheel.remove(client_id)
+            if self.client_connections.get(client_id) is client:
+                del self.client_connections[client_id]
+                self.wire_clients.pop(client.wire_id, None)
+            self._queue_client_gone(client)
+            self.memory.release(client.outbound)
+            # Let queued frames (e.g. a final error response) go out before the socket closes
+            client.close(flush=True)
 
     # ... (handle_client_connection remains the same) ...
     async def handle_client_connection(self, client_reader, client_writer):
         """Handles new client connections."""
-        client_id = str(uuid.uuid4())
         client_addr = client_writer.get_extra_info("peername")
+        if self._accept_bucket and not self._accept_bucket.take(asyncio.get_running_loop().time()):
+            self.rejected_connections += 1
+            print(f"[!] Connection rate limit reached. Rejecting connection from {client_addr}.")
+            client_writer.close()
+            return
+        client_id = self.router.new_client_id() if self.router else str(uuid.uuid4())
         print(f"[*] Accepted connection from {client_addr}, ID: {client_id}")
 
         if client_id in self.client_connections:
@@ -362,12 +1216,160 @@ class LoadBalancer:
             client_writer.close()
             return
 
-        self.client_connections[client_id] = (client_reader, client_writer)
+        if self.tcp_keepalive > 0:
+            set_keepalive(client_writer.get_extra_info("socket"), self.tcp_keepalive)
+        frame_decoder = ClientFrameDecoder(self.client_framing, self.max_frame_size)
+        outbound = ClientOutbound(client_writer, client_id, self.outbound_stats,
+                                  self.client_queue_high, self.client_queue_low, self.overflow_policy,
+                                  self.client_memory_limit, self.memory)
+        client = ClientConnection(client_id, client_reader, client_writer, frame_decoder, outbound)
+        self.client_connections[client_id] = client
+        self.wire_clients[client.wire_id] = client
         asyncio.create_task(
-            self.read_from_client(client_reader, client_writer, client_id),
+            self.read_from_client(client),
             name=f"ClientRead-{client_id}"
         )
 
+    def get_outbound_stats(self):
+        """Snapshot of the client outbound queue counters and current queue depths."""
+        stats = self.outbound_stats
+        depths = [client.outbound.depth() for client in self.client_connections.values()]
+        return {
+            "clients": len(depths),
+            "queued_frames": sum(client.outbound.queued_frames for client in self.client_connections.values()),
+            "queued_bytes": sum(depths),
+            "max_client_queue_bytes": max(depths, default=0),
+            "frames_queued": stats.frames_queued,
+            "frames_sent": stats.frames_sent,
+            "frames_dropped": stats.frames_dropped,
+            "bytes_dropped": stats.bytes_dropped,
+            "slow_consumer_disconnects": stats.slow_disconnects,
+        }
+
+    def get_rate_limit_stats(self):
+        return {
+            "throttled_messages": self.throttled_messages,
+            "throttle_disconnects": self.throttle_disconnects,
+            "rejected_connections": self.rejected_connections,
+        }
+
+    def get_idle_stats(self):
+        """Heartbeat and idle timeout counters."""
+        return {
+            "heartbeats": self.heartbeats,
+            "idle_timers": len(self.idle_wheel),
+            "idle_reaped": self.idle_reaped,
+        }
+
+    def _register_metrics(self):
+        """Metrics read from the LB's own state when a scrape comes in."""
+        m = self.metrics
+        m.callback("lb_clients_connected", "Connected clients", lambda: len(self.client_connections))
+
+        def per_backend(value):
+            return lambda: [((key,), value(key, backend)) for key, backend in list(self.backends.items())]
+
+        m.callback("lb_backend_up", "1 if the backend is healthy, connected and taking new requests",
+                   per_backend(lambda key, backend: int(key in self.healthy_keys and key in self.server_connections
+                                                        and not backend.ejected and not backend.draining)),
+                   ("backend",))
+        m.callback("lb_backend_connections", "Open pooled connections to the backend",
+                   per_backend(lambda key, _: len(self.server_connections.get(key, ()))), ("backend",))
+        m.callback("lb_backend_in_flight", "Requests forwarded to the backend and not yet answered",
+                   per_backend(lambda _, backend: backend.in_flight), ("backend",))
+        m.callback("lb_backend_queued_bytes", "Bytes written to the backend's connections that the kernel has not taken",
+                   per_backend(lambda key, _: sum(conn.queued_bytes() for conn in self.server_connections.get(key, ()))),
+                   ("backend",))
+        m.callback("lb_backend_ejected", "1 while the backend is ejected after repeated failures",
+                   per_backend(lambda _, backend: int(backend.ejected)), ("backend",))
+        m.callback("lb_backend_draining", "1 while the backend is draining",
+                   per_backend(lambda key, backend: int(backend.draining or key in self._drains)), ("backend",))
+        m.callback("lb_backend_failures", "Consecutive failures counted against the backend",
+                   per_backend(lambda _, backend: backend.failures), ("backend",))
+        m.callback("lb_backend_load_factor", "Share of its configured weight the backend gets, from its load reports",
+                   per_backend(lambda _, backend: backend.load_factor), ("backend",))
+        m.callback("lb_backend_loop_lag_seconds", "Smoothed event loop lag the backend reports",
+                   per_backend(lambda _, backend: backend.load_lag), ("backend",))
+        m.callback("lb_backend_pending", "Smoothed count of requests and executor jobs waiting in the backend",
+                   per_backend(lambda _, backend: backend.load_pending), ("backend",))
+        m.callback("lb_backend_rtt_seconds", "Moving average of the backend's health-check ping round trips",
+                   per_backend(lambda _, backend: backend.rtt if backend.rtt is not None else float("nan")),
+                   ("backend",))
+
+        stats = self.outbound_stats
+        m.callback("lb_client_queued_bytes", "Bytes waiting in client outbound queues",
+                   lambda: sum(client.outbound.queued_bytes for client in list(self.client_connections.values())))
+        m.callback("lb_client_frames_sent_total", "Frames written to clients", lambda: stats.frames_sent, kind="counter")
+        m.callback("lb_client_frames_dropped_total", "Droppable frames shed for slow clients",
+                   lambda: stats.frames_dropped, kind="counter")
+        m.callback("lb_slow_consumer_disconnects_total", "Clients disconnected for not keeping up",
+                   lambda: stats.slow_disconnects, kind="counter")
+        m.callback("lb_throttled_messages_total", "Client messages rejected by rate limits",
+                   lambda: self.throttled_messages, kind="counter")
+        m.callback("lb_throttle_disconnects_total", "Clients disconnected for exceeding rate limits",
+                   lambda: self.throttle_disconnects, kind="counter")
+        m.callback("lb_rejected_connections_total", "Connections rejected by the accept rate limit",
+                   lambda: self.rejected_connections, kind="counter")
+        m.callback("lb_heartbeats_total", "Client heartbeats answered by the LB",
+                   lambda: self.heartbeats, kind="counter")
+        m.callback("lb_idle_timers", "Heartbeating clients under the idle timeout", lambda: len(self.idle_wheel))
+        m.callback("lb_idle_reaped_total", "Clients disconnected after going silent past the idle timeout",
+                   lambda: self.idle_reaped, kind="counter")
+        m.callback("lb_memory_held_bytes", "Bytes held for clients: read, reassembly and outbound buffers",
+                   lambda: self.memory.usage)
+        m.callback("lb_memory_inbound_bytes", "Bytes held in client read and reassembly buffers",
+                   lambda: self.memory.inbound_bytes)
+        m.callback("lb_memory_limit_bytes", "LB-wide budget for bytes held for clients (0: none)",
+                   lambda: self.memory.limit)
+        m.callback("lb_memory_sheds_total", "Times the LB-wide memory budget was exceeded",
+                   lambda: self.memory.sheds, kind="counter")
+        m.callback("lb_memory_disconnects_total", "Clients disconnected for exceeding a memory budget",
+                   lambda: stats.memory_disconnects, kind="counter")
+        m.latency("lb_request_seconds", "Request latency by type and phase", self.latency)
+
+    async def start_metrics_server(self, host, port):
+        """Serves the metrics and starts the loop lag probe. The LB keeps running without them if the port is taken."""
+        lag_monitor = LoopLagMonitor()
+        lag_monitor.register(self.metrics, "lb")
+        metrics_server = MetricsServer(self.metrics, host, port)
+        metrics_server.routes["/debug/memory"] = self._memory_debug_route
+        try:
+            addr = await metrics_server.start()
+        except OSError as e:
+            print(f"[!] Could not start metrics listener on {host}:{port}: {e}")
+            return None
+        lag_monitor.start()
+        print(f"[*] Metrics available at http://{addr[0]}:{addr[1]}/metrics")
+        return metrics_server
+
+    def _memory_debug_route(self, query):
+        """GET /debug/memory[?top=N]: the clients holding the most memory, as JSON."""
+        try:
+            count = int(query.get("top", ["20"])[0])
+        except ValueError:
+            count = 20
+        report = {"summary": self.memory.summary(), "top": self.memory.top_consumers(count)}
+        return "application/json", json.dumps(report, indent=2) + "\n"
+
+    def print_memory_report(self):
+        print(self.memory.format_report())
+
+    def get_latency_stats(self):
+        """Per request type and phase: count, mean, percentiles and max in milliseconds."""
+        return self.latency.summary()
+
+    def print_latency_report(self):
+        print(self.latency.format_report("LB request latency"))
+
+    async def report_stats(self, interval):
+        """Prints the outbound queue, rate limit, memory and idle counters every `interval` seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            print(f"[*] Outbound stats: {self.get_outbound_stats()}")
+            print(f"[*] Rate limit stats: {self.get_rate_limit_stats()}")
+            print(f"[*] Memory stats: {self.memory.summary()}")
+            print(f"[*] Idle stats: {self.get_idle_stats()}")
+
     # Simplify initialize - let update_servers handle initial connections
     async def initialize(self):
         """Initializes the load balancer."""
@@ -378,45 +1380,223 @@ class LoadBalancer:
         print("[*] Starting filesystem watcher for servers.json")
         event_handler = ServerListHandler(self)
         self.observer = Observer()
-        # Watch the directory containing servers.json
-        watch_dir = os.path.dirname(servers_path)
-        self.observer.schedule(event_handler, path=watch_dir, recursive=False)
+        # Watch the directory containing servers.json (and limits.json, if it lives elsewhere)
+        watch_dirs = {os.path.dirname(self.servers_path)}
+        if self.limits_path:
+            watch_dirs.add(os.path.dirname(self.limits_path))
+        for watch_dir in sorted(watch_dirs):
+            if os.path.isdir(watch_dir):
+                self.observer.schedule(event_handler, path=watch_dir, recursive=False)
+                print(f"[*] Watching directory: {watch_dir}")
         self.observer.start()
-        print(f"[*] Watching directory: {watch_dir}")
 
 # ... (main function remains the same) ...
-async def main():
+def parse_args():
     parser = argparse.ArgumentParser(description="Async TCP Load Balancer")
     parser.add_argument("--lb", type=str, default="127.0.0.1", help="Load Balancer host")
     parser.add_argument("--port", type=int, default=8000, help="Load Balancer port")
+    parser.add_argument("--workers", type=int, default=1,
+                       help="Accept processes sharing the port via SO_REUSEPORT (default: 1)")
+    parser.add_argument("--loop", choices=LOOP_CHOICES, default=LOOP_AUTO,
+                       help="Event loop implementation; 'auto' uses uvloop/winloop when installed (default: auto)")
+    parser.add_argument("--protocol", type=int, choices=SUPPORTED_VERSIONS, default=PROTOCOL_V2,
+                       help="Highest LB<->backend envelope version to negotiate (default: 2)")
+    parser.add_argument("--servers-file", type=str, default=servers_path,
+                       help="Backend list to load and watch (default: servers.json next to this script)")
     parser.add_argument("--health-check-timeout", type=float, default=1.0, 
                        help="Health check timeout in seconds")
+    parser.add_argument("--health-check-interval", type=float, default=5.0,
+                       help="Seconds between ping health checks of every backend (0 disables them)")
+    parser.add_argument("--response-timeout", type=float, default=10.0,
+                       help="Seconds without a reply before a forwarded request counts as a backend failure")
+    parser.add_argument("--eject-threshold", type=int, default=3,
+                       help="Consecutive failures (missed pings, write errors, timeouts) before a backend is ejected")
+    parser.add_argument("--eject-backoff", type=float, default=2.0,
+                       help="Seconds an ejected backend sits out before it is probed again; doubles per ejection")
+    parser.add_argument("--eject-backoff-max", type=float, default=60.0,
+                       help="Upper bound on the ejection backoff in seconds")
+    parser.add_argument("--drain-timeout", type=float, default=30.0,
+                       help="Seconds a backend removed from servers.json (or shutting down) is kept connected "
+                            "for its in-flight requests; 0 closes it at once (default: 30)")
+    parser.add_argument("--update-debounce", type=float, default=0.5,
+                       help="Seconds servers.json must be quiet after a change before it is reloaded")
+    parser.add_argument("--limits-file", type=str, default=None,
+                       help="Rate limit config (default: limits.json next to the servers file; "
+                            "no limits if it does not exist). Reloaded when it changes")
+    parser.add_argument("--client-framing", choices=FRAMING_MODES, default=FRAMING_AUTO,
+                       help="How client messages are delimited: 'json' for bare JSON objects, "
+                            "'length' for a 4-byte length prefix, 'auto' to detect per client (default: auto)")
+    parser.add_argument("--strategy", choices=sorted(SELECTION_STRATEGIES), default=DEFAULT_STRATEGY,
+                       help=f"Backend selection strategy (default: {DEFAULT_STRATEGY}). 'rendezvous' keeps each "
+                            "client on one backend; 'weighted', 'rendezvous', 'p2c' and 'least_latency' use the "
+                            "optional 'weight' field of servers.json entries, scaled down by the backends' load "
+                            "reports ('rendezvous' only spills new clients off an overloaded backend)")
+    parser.add_argument("--no-load-feedback", action="store_true",
+                       help="Ignore backend load reports and select backends by their configured weights only")
+    parser.add_argument("--load-lag-target", type=float, default=0.05,
+                       help="Reported loop lag in seconds at which a backend gets half its share of new requests "
+                            "(default: 0.05)")
+    parser.add_argument("--load-pending-target", type=float, default=8.0,
+                       help="Reported pending requests at which a backend gets half its share of new requests "
+                            "(default: 8)")
+    parser.add_argument("--load-stale-after", type=float, default=10.0,
+                       help="Seconds after which a backend's last load report is ignored (default: 10)")
+    parser.add_argument("--pool-size", type=int, default=1,
+                       help="Connections opened to each backend (default: 1)")
+    parser.add_argument("--pool-select", choices=POOL_SELECT_MODES, default=POOL_SELECT_HASH,
+                       help="How a backend connection is chosen from the pool: 'hash' keeps each client on one "
+                            "connection, 'least_queued' uses the one with the fewest unsent bytes (default: hash)")
+    parser.add_argument("--transport", choices=TRANSPORT_MODES, default=TRANSPORT_STREAMS,
+                       help="How backend connections are read: 'streams' uses asyncio streams, 'buffered' "
+                            "receives into a preallocated buffer and parses frames in place (default: streams)")
+    parser.add_argument("--client-queue-high", type=int, default=DEFAULT_HIGH_WATERMARK,
+                       help="Bytes queued for one client before the overflow policy applies")
+    parser.add_argument("--client-queue-low", type=int, default=DEFAULT_LOW_WATERMARK,
+                       help="Queue size that dropping droppable frames brings a client back down to")
+    parser.add_argument("--overflow-policy", choices=OVERFLOW_POLICIES, default=OVERFLOW_DROP_OLDEST,
+                       help="What to do with a client whose queue passes the high watermark (default: drop_oldest)")
+    parser.add_argument("--droppable-types", type=str, default="screen_data",
+                       help="Comma-separated push types that may be dropped for slow clients (default: screen_data)")
+    parser.add_argument("--idle-timeout", type=float, default=60.0,
+                       help="Seconds a client that sends heartbeats may stay silent before it is disconnected; "
+                            "0 disables (default: 60)")
+    parser.add_argument("--tcp-keepalive", type=float, default=60.0,
+                       help="Seconds a client connection may be silent before the kernel starts keepalive probes, "
+                            "which close half-open connections; 0 disables (default: 60)")
+    parser.add_argument("--stats-interval", type=float, default=0,
+                       help="Print outbound queue counters every N seconds (default: off)")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                       help="Serve Prometheus metrics at http://<metrics-host>:<port>/metrics (default: off). "
+                            "With --workers, worker N uses port + N")
+    parser.add_argument("--metrics-host", type=str, default="127.0.0.1",
+                       help="Address the metrics listener binds to (default: 127.0.0.1)")
+    parser.add_argument("--max-frame-size", type=int, default=DEFAULT_MAX_FRAME_SIZE,
+                       help="Largest client message in bytes before the client is disconnected")
+    parser.add_argument("--client-read-size", type=int, default=64 * 1024,
+                       help="Bytes read from a client at a time; its read buffer is limited to about twice this")
+    parser.add_argument("--client-memory-limit", type=int, default=DEFAULT_CLIENT_MEMORY_LIMIT,
+                       help="Bytes one client may hold in read, reassembly and outbound buffers before its "
+                            "droppable frames are shed, then it is disconnected; 0 disables (default: 16 MB)")
+    parser.add_argument("--memory-limit", type=int, default=DEFAULT_MEMORY_LIMIT,
+                       help="Bytes all clients together may hold before droppable frames are shed from the "
+                            "largest consumers, then the largest are disconnected; 0 disables (default: 512 MB)")
     args = parser.parse_args()
+    if args.client_queue_low > args.client_queue_high:
+        parser.error("--client-queue-low must not exceed --client-queue-high")
+    if args.eject_threshold < 1:
+        parser.error("--eject-threshold must be at least 1")
+    if args.client_read_size < 1:
+        parser.error("--client-read-size must be at least 1")
+    if args.client_memory_limit and args.client_memory_limit < args.max_frame_size + 2 * args.client_read_size:
+        parser.error("--client-memory-limit must fit a frame of --max-frame-size plus two reads of --client-read-size")
+    if args.load_lag_target <= 0 or args.load_pending_target <= 0:
+        parser.error("--load-lag-target and --load-pending-target must be positive")
+    if args.pool_size < 1:
+        parser.error("--pool-size must be at least 1")
+    if args.client_framing != "json" and args.max_frame_size > 0xFFFFFF:
+        parser.error("--max-frame-size must be below 16MB unless --client-framing is 'json'")
+    if not 1 <= args.workers <= MAX_WORKERS:
+        parser.error(f"--workers must be between 1 and {MAX_WORKERS}")
+    args.servers_file = os.path.abspath(args.servers_file)
+    if args.limits_file is None:
+        args.limits_file = os.path.join(os.path.dirname(args.servers_file), "limits.json")
+    args.limits_file = os.path.abspath(args.limits_file)
+    return args
 
-    lb = LoadBalancer()
-    lb.health_check_timeout = args.health_check_timeout
-    
+def set_keepalive(sock, idle):
+    """Turns on TCP keepalive: probes after `idle` seconds of silence, the connection dropped after 3 unanswered."""
+    if sock is None:
+        return
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, "TCP_KEEPIDLE"): # Linux; elsewhere the system defaults apply
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, max(1, int(idle)))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, int(idle) // 3))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+    except OSError as e:
+        print(f"[!] Could not enable TCP keepalive: {e}")
+
+def ensure_servers_file(path):
     # Ensure servers.json directory exists
-    servers_dir = os.path.dirname(servers_path)
+    servers_dir = os.path.dirname(path)
     if not os.path.exists(servers_dir):
         os.makedirs(servers_dir)
         print(f"[*] Created directory: {servers_dir}")
         
     # Create initial servers.json if it doesn't exist
-    if not os.path.exists(servers_path):
-        with open(servers_path, "w") as f:
+    if not os.path.exists(path):
+        with open(path, "w") as f:
             json.dump([], f)
-            print(f"[*] Created initial empty servers.json at {servers_path}")
+            print(f"[*] Created initial empty servers.json at {path}")
+
+async def main(args, worker_id=None, socket_dir=None):
+    lb = LoadBalancer()
+    lb.servers_path = args.servers_file
+    lb.health_check_timeout = args.health_check_timeout
+    lb.health_check_interval = args.health_check_interval
+    lb.update_debounce = args.update_debounce
+    lb.drain_timeout = args.drain_timeout
+    lb.response_timeout = args.response_timeout
+    lb.eject_threshold = args.eject_threshold
+    lb.eject_backoff = args.eject_backoff
+    lb.eject_backoff_max = args.eject_backoff_max
+    lb.protocol_version = args.protocol
+    lb.client_framing = args.client_framing
+    lb.max_frame_size = args.max_frame_size
+    lb.selector = make_selector(args.strategy)
+    lb.load_feedback = not args.no_load_feedback
+    lb.load_weighting = LoadWeighting(args.load_lag_target, args.load_pending_target, args.load_stale_after)
+    lb.pool_size = args.pool_size
+    lb.pool_select = args.pool_select
+    lb.transport = args.transport
+    lb.client_queue_high = args.client_queue_high
+    lb.client_queue_low = args.client_queue_low
+    lb.overflow_policy = args.overflow_policy
+    lb.droppable_types = {t.strip() for t in args.droppable_types.split(",") if t.strip()}
+    lb.client_read_size = args.client_read_size
+    lb.client_memory_limit = args.client_memory_limit
+    lb.memory = MemoryGovernor(lb.client_connections, lb.outbound_stats, args.memory_limit)
+    lb.limits_path = args.limits_file
+    lb.idle_timeout = args.idle_timeout
+    lb.tcp_keepalive = args.tcp_keepalive
+    if worker_id is not None:
+        lb.accept_share = 1.0 / args.workers # The kernel spreads accepts evenly over the workers
+        lb.router = WorkerRouter(worker_id, args.workers, socket_dir, lb._deliver_to_client,
+                                 args.client_queue_high, args.client_queue_low, args.overflow_policy)
+        await lb.router.start()
 
+    lb.reload_limits()
+    try:
+        # SIGUSR1 prints the request latency histograms, SIGUSR2 the clients holding the most memory
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, lb.print_latency_report)
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR2, lb.print_memory_report)
+    except (NotImplementedError, AttributeError):
+        pass # No loop signal handlers (or SIGUSR1) on Windows
     await lb.initialize()
+    if args.health_check_interval > 0:
+        asyncio.create_task(lb.health_check_loop(), name="HealthChecker")
+    if lb.load_feedback:
+        asyncio.create_task(lb.load_weighting_loop(), name="LoadWeighting")
+    if args.idle_timeout > 0:
+        lb.idle_wheel.start()
+    if args.stats_interval > 0:
+        asyncio.create_task(lb.report_stats(args.stats_interval), name="StatsReporter")
+    if args.metrics_port:
+        # Workers each serve their own metrics, on consecutive ports
+        await lb.start_metrics_server(args.metrics_host, args.metrics_port + (worker_id or 0))
 
     server = None
     try:
         server = await asyncio.start_server(
-            lb.handle_client_connection, args.lb, args.port
+            lb.handle_client_connection, args.lb, args.port,
+            limit=args.client_read_size, # Each client's read buffer holds at most about twice this
+            reuse_port=worker_id is not None # Let the kernel spread accepts over the workers
         )
         addr = server.sockets[0].getsockname()
-        print(f"[*] Load Balancer listening on {addr}")
+        if worker_id is None:
+            print(f"[*] Load Balancer listening on {addr}")
+        else:
+            print(f"[*] Load Balancer worker {worker_id}/{args.workers} listening on {addr}")
         
         async with server:
             await server.serve_forever()
@@ -434,17 +1614,16 @@ async def main():
             
         # Close all client connections
         client_close_tasks = []
-        for client_id, (cr, cw) in list(lb.client_connections.items()):
+        for client_id, client in list(lb.client_connections.items()):
              print(f"[*] Closing client connection {client_id}")
-             if cw and not cw.is_closing():
-                  cw.close()
-                  # Don't await here to avoid blocking shutdown
+             client.close()
+             # Don't await here to avoid blocking shutdown
         lb.client_connections.clear()
         
         # Close all server connections
         server_close_tasks = []
-        for server_index in list(lb.server_connections.keys()):
-             server_close_tasks.append(lb._close_server_connection(server_index))
+        for key in list(lb.server_connections.keys()):
+             server_close_tasks.append(lb._close_server_connection(key))
         if server_close_tasks:
              print("[*] Waiting for server connections to close...")
              await asyncio.gather(*server_close_tasks, return_exceptions=True)
@@ -454,12 +1633,74 @@ async def main():
              server.close()
              await server.wait_closed()
              print("[*] LB server socket closed.")
+        if lb.router:
+            await lb.router.close()
         print("[*] Load Balancer shutdown complete.")
 
-if __name__ == "__main__":
+def run_worker(args, worker_id, socket_dir):
+    install_event_loop(args.loop) # Spawned (non-fork) workers do not inherit the parent's policy
     try:
-        asyncio.run(main())
+        asyncio.run(main(args, worker_id, socket_dir))
     except KeyboardInterrupt:
-        print("\n[*] KeyboardInterrupt received.")
+        pass # The parent reports the shutdown
     except Exception as e:
-        print(f"[!] Critical error running LB: {e}", file=sys.stderr)
+        print(f"[!] Critical error in LB worker {worker_id}: {e}", file=sys.stderr)
+
+def run_workers(args):
+    """Runs args.workers LB processes that accept on the same port.
+
+    Each worker has its own event loop, backend pools and clients; frames for
+    a client owned by another worker are forwarded over unix sockets in a
+    private temporary directory.
+    """
+    socket_dir = tempfile.mkdtemp(prefix="lb-workers-")
+    workers = [
+        multiprocessing.Process(target=run_worker, args=(args, i, socket_dir), name=f"LBWorker-{i}")
+        for i in range(args.workers)
+    ]
+
+    def stop_workers(signum, frame):
+        # Workers inherit the default SIGTERM action; pass the stop on as the Ctrl+C they handle cleanly
+        for worker in workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGINT)
+        raise KeyboardInterrupt
+
+    def report_workers(signum, frame):
+        # Each worker prints its own latency histograms or memory report
+        for worker in workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signum)
+
+    print(f"[*] Starting {args.workers} load balancer workers on port {args.port}")
+    try:
+        for worker in workers:
+            worker.start()
+        signal.signal(signal.SIGTERM, stop_workers)
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, report_workers)
+            signal.signal(signal.SIGUSR2, report_workers)
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        print("\n[*] Stopping workers...")
+        for worker in workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+    finally:
+        shutil.rmtree(socket_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    args = parse_args()
+    ensure_servers_file(args.servers_file)
+    print(f"[*] Event loop: {install_event_loop(args.loop)}")
+    if args.workers > 1:
+        run_workers(args)
+    else:
+        try:
+            asyncio.run(main(args))
+        except KeyboardInterrupt:
+            print("\n[*] KeyboardInterrupt received.")
+        except Exception as e:
+            print(f"[!] Critical error running LB: {e}", file=sys.stderr)
@@ -0,0 +1,143 @@
+"""Accounting of the memory the LB holds on behalf of its clients, and the LB-wide budget for it.
+
+Per client the LB holds:
+  read buffer   bytes the StreamReader has received but the LB not yet read
+  reassembly    a partially received frame, in the ClientFrameDecoder
+  outbound      frames queued for the client, plus the transport's write buffer
+
+Each client has its own budget (ClientOutbound.memory_limit), and all of
+them together have the LB-wide one enforced here. When the total passes
+the limit, load is shed in this order until it is back under the low mark:
+  1. droppable frames (e.g. screen_data), oldest first, from the clients
+     holding the most memory first
+  2. whole clients, again the largest first
+Frames that must be delivered are never dropped from a client that stays
+connected.
+"""
+from typing import Dict, List
+
+from outbound import OutboundStats
+
+DEFAULT_CLIENT_MEMORY_LIMIT = 16 * 1024 * 1024
+DEFAULT_MEMORY_LIMIT = 512 * 1024 * 1024
+DEFAULT_LOW_FRACTION = 0.9
+
+
+def reader_buffered(reader) -> int:
+    """Bytes received into a StreamReader and not yet read out of it."""
+    buffer = getattr(reader, "_buffer", None) # StreamReader keeps no public count
+    return len(buffer) if buffer is not None else 0
+
+
+class MemoryGovernor:
+    """Keeps the memory held for all clients of one LB process under `limit` bytes (0: no limit).
+
+    Outbound queues are counted incrementally by OutboundStats; inbound
+    buffers are reported by the client reader tasks through
+    account_inbound(). Checking the budget is therefore O(1); only
+    shedding looks at every client. Transport write buffers are left out of
+    this total (a client's writer keeps at most about one frame there) but
+    count against each client's own budget.
+    """
+
+    def __init__(self, clients: Dict[str, object], stats: OutboundStats, limit: int = DEFAULT_MEMORY_LIMIT,
+                 low_fraction: float = DEFAULT_LOW_FRACTION):
+        self.clients = clients # Map: client_id -> ClientConnection (the LB's own dict)
+        self.stats = stats
+        self.limit = limit
+        self.low_mark = int(limit * low_fraction)
+        self.inbound_bytes = 0
+        self.sheds = 0 # Times the LB-wide budget was hit
+        self.bytes_shed = 0 # Droppable bytes dropped to get back under it
+        self._shedding = False
+
+    @property
+    def usage(self) -> int:
+        return self.stats.queued_bytes + self.inbound_bytes
+
+    def account_inbound(self, outbound, held: int):
+        """Records how many bytes a client's read and reassembly buffers hold now."""
+        self.inbound_bytes += held - outbound.inbound_bytes
+        outbound.inbound_bytes = held
+
+    def release(self, outbound):
+        """Forgets a client's inbound buffers (it disconnected)."""
+        self.inbound_bytes -= outbound.inbound_bytes
+        outbound.inbound_bytes = 0
+
+    def check(self):
+        """Sheds load if the LB-wide budget is exceeded. Cheap enough to call on every frame."""
+        if self.limit and not self._shedding and self.usage > self.limit:
+            self._shed()
+
+    def _shed(self):
+        self._shedding = True # Closing clients below re-enters enqueue paths
+        try:
+            self.sheds += 1
+            before = self.usage
+            consumers = sorted(self.clients.values(), key=lambda c: c.outbound.memory_usage(), reverse=True)
+            for client in consumers:
+                excess = self.usage - self.low_mark
+                if excess <= 0:
+                    break
+                outbound = client.outbound
+                self.bytes_shed += outbound.drop_droppable(max(0, outbound.depth() - excess))
+            disconnected = 0
+            for client in consumers:
+                if self.usage <= self.low_mark:
+                    break
+                if client.outbound.closing:
+                    continue
+                print(f"[!] Disconnecting client {client.client_id} ({client.outbound.memory_usage()} bytes) "
+                      f"to bring the LB back under its memory budget.")
+                client.outbound.close() # Drops its queue at once
+                self.release(client.outbound)
+                self.stats.memory_disconnects += 1
+                disconnected += 1
+            print(f"[!] LB memory budget of {self.limit} bytes exceeded ({before} held): "
+                  f"shed down to {self.usage} bytes, {disconnected} client(s) disconnected.")
+        finally:
+            self._shedding = False
+
+    def top_consumers(self, count: int = 20) -> List[dict]:
+        """The clients holding the most memory, largest first, with a breakdown per buffer."""
+        report = []
+        for client_id, client in list(self.clients.items()):
+            outbound = client.outbound
+            transport = outbound.writer.transport
+            report.append({
+                "client_id": client_id,
+                "total": outbound.memory_usage(),
+                "read_buffer": reader_buffered(client.reader),
+                "reassembly": client.decoder.buffered,
+                "outbound_queued": outbound.queued_bytes,
+                "outbound_frames": outbound.queued_frames,
+                "transport_buffered": transport.get_write_buffer_size() if transport else 0,
+            })
+        report.sort(key=lambda entry: entry["total"], reverse=True)
+        return report[:count]
+
+    def summary(self) -> dict:
+        return {
+            "limit": self.limit,
+            "held": self.usage,
+            "outbound_queued": self.stats.queued_bytes,
+            "inbound": self.inbound_bytes,
+            "clients": len(self.clients),
+            "sheds": self.sheds,
+            "bytes_shed": self.bytes_shed,
+            "memory_disconnects": self.stats.memory_disconnects,
+        }
+
+    def format_report(self, count: int = 20) -> str:
+        summary = self.summary()
+        lines = [f"[*] LB client memory: {summary['held']} bytes held of {summary['limit'] or 'unlimited'} "
+                 f"({summary['clients']} clients, {summary['sheds']} sheds, "
+                 f"{summary['memory_disconnects']} memory disconnects). Top consumers:",
+                 f"{'client_id':<36} {'total':>10} {'read':>8} {'reassembly':>10} {'queued':>10} "
+                 f"{'frames':>6} {'transport':>9}"]
+        for entry in self.top_consumers(count):
+            lines.append(f"{entry['client_id']:<36} {entry['total']:>10} {entry['read_buffer']:>8} "
+                         f"{entry['reassembly']:>10} {entry['outbound_queued']:>10} {entry['outbound_frames']:>6} "
+                         f"{entry['transport_buffered']:>9}")
+        return "\n".join(lines)
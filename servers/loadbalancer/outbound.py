@@ -0,0 +1,202 @@
+import asyncio
+from collections import deque
+
+# What to do when a client's outbound queue passes its high watermark
+OVERFLOW_DROP_OLDEST = "drop_oldest" # Shed droppable frames oldest-first, disconnect only if that is not enough
+OVERFLOW_DISCONNECT = "disconnect"   # Disconnect the slow client straight away
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_DISCONNECT)
+
+DEFAULT_HIGH_WATERMARK = 4 * 1024 * 1024
+DEFAULT_LOW_WATERMARK = 1 * 1024 * 1024
+
+
+class OutboundStats:
+    """Counters shared by every client queue in one LB process."""
+    __slots__ = ("frames_queued", "frames_sent", "frames_dropped", "bytes_dropped", "slow_disconnects",
+                 "queued_bytes", "memory_disconnects")
+
+    def __init__(self):
+        self.frames_queued = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.bytes_dropped = 0
+        self.slow_disconnects = 0
+        self.queued_bytes = 0 # Bytes in every client queue right now
+        self.memory_disconnects = 0 # Clients disconnected for exceeding a memory budget
+
+
+class ClientOutbound:
+    """Bounded outbound queue and writer task for one client connection.
+
+    enqueue() never awaits, so a backend reader can hand off a frame and move
+    on even when this client's socket is backed up. The writer task writes one
+    frame at a time and waits for the socket before taking the next, so frames
+    stay in the queue (where they can still be dropped) instead of piling up
+    in the transport buffer.
+    """
+
+    def __init__(self, writer, client_id, stats: OutboundStats,
+                 high_watermark: int = DEFAULT_HIGH_WATERMARK,
+                 low_watermark: int = DEFAULT_LOW_WATERMARK,
+                 policy: str = OVERFLOW_DROP_OLDEST,
+                 memory_limit: int = 0, governor=None):
+        self.writer = writer
+        self.client_id = client_id
+        self.stats = stats
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.policy = policy
+        self.memory_limit = memory_limit # Budget for everything held for this client (0: none)
+        self.governor = governor # MemoryGovernor enforcing the LB-wide budget, if any
+        self.inbound_bytes = 0 # Held on the receiving side (read and reassembly buffers), kept up to date by the LB
+        self.queued_bytes = 0
+        self._queue = deque() # (payload, droppable)
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        self._task = asyncio.create_task(self._run(), name=f"ClientWrite-{client_id}")
+
+    @property
+    def closing(self) -> bool:
+        return self._closing
+
+    @property
+    def queued_frames(self) -> int:
+        return len(self._queue)
+
+    def depth(self) -> int:
+        """Bytes waiting for this client: our queue plus the transport's buffer."""
+        transport = self.writer.transport
+        buffered = transport.get_write_buffer_size() if transport else 0
+        return self.queued_bytes + buffered
+
+    def memory_usage(self) -> int:
+        """Bytes held for this client in all: outbound (depth()) plus inbound buffers."""
+        return self.depth() + self.inbound_bytes
+
+    def enqueue(self, payload: bytes, droppable: bool = False) -> bool:
+        """Queues a frame for the client. Returns False if the client is being disconnected."""
+        if self._closing:
+            return False
+        self._queue.append((payload, droppable))
+        self.queued_bytes += len(payload)
+        self.stats.queued_bytes += len(payload)
+        self.stats.frames_queued += 1
+        if self.depth() > self.high_watermark and not self._shed_load():
+            return False
+        if self.memory_limit and self.memory_usage() > self.memory_limit and not self.enforce_memory_limit():
+            return False
+        if self.governor:
+            self.governor.check()
+            if self._closing:
+                return False # Shed by the LB-wide budget
+        self._wakeup.set()
+        return True
+
+    def write_or_enqueue(self, parts, droppable: bool = False) -> bool:
+        """Sends a frame given as several buffers (e.g. length prefix and payload).
+
+        When nothing is waiting for this client the parts go straight to the
+        socket with writelines(), so they are never joined into one buffer
+        here. Otherwise they are joined and queued behind the waiting frames,
+        where the overflow policy can still see them.
+        """
+        if self._closing:
+            return False
+        if not self._queue and self.depth() == 0 and not self.writer.is_closing():
+            self.writer.writelines(parts)
+            self.stats.frames_queued += 1
+            self.stats.frames_sent += 1
+            return True
+        return self.enqueue(parts[0] if len(parts) == 1 else b"".join(parts), droppable)
+
+    def close(self, flush: bool = False):
+        """Stops the writer. With flush=True frames already queued are sent first."""
+        if self._closing:
+            return
+        self._closing = True
+        if not flush:
+            self._drop_all()
+            self._task.cancel()
+        self._wakeup.set()
+
+    def drop_droppable(self, target_depth: int) -> int:
+        """Drops droppable frames oldest-first until depth() is at most target_depth. Returns the bytes freed."""
+        freed = 0
+        kept = deque()
+        while self._queue and self.depth() > target_depth:
+            payload, droppable = self._queue.popleft()
+            if droppable:
+                self.queued_bytes -= len(payload)
+                self.stats.queued_bytes -= len(payload)
+                self.stats.frames_dropped += 1
+                self.stats.bytes_dropped += len(payload)
+                freed += len(payload)
+            else:
+                kept.append((payload, droppable))
+        kept.extend(self._queue)
+        self._queue = kept
+        return freed
+
+    def enforce_memory_limit(self) -> bool:
+        """Brings this client back within memory_limit. Returns False if it had to be disconnected.
+
+        Droppable frames go first; inbound buffers cannot be shed, so if
+        they plus the frames that must be delivered still exceed the budget,
+        the client is disconnected.
+        """
+        if not self.memory_limit or self.memory_usage() <= self.memory_limit:
+            return True
+        self.drop_droppable(self.memory_limit - self.inbound_bytes)
+        if self.memory_usage() <= self.memory_limit:
+            return True
+        print(f"[!] Client {self.client_id} holds {self.memory_usage()} bytes, over its budget of "
+              f"{self.memory_limit}. Disconnecting.")
+        self.stats.memory_disconnects += 1
+        self.close()
+        return False
+
+    def _shed_load(self) -> bool:
+        """Applies the overflow policy. Returns False if the client was disconnected."""
+        if self.policy == OVERFLOW_DROP_OLDEST:
+            # Walk oldest-first and drop droppable frames until back under the low watermark
+            self.drop_droppable(self.low_watermark)
+            if self.depth() <= self.high_watermark:
+                return True
+        print(f"[!] Client {self.client_id} is not keeping up ({self.depth()} bytes queued). Disconnecting.")
+        self.stats.slow_disconnects += 1
+        self.close()
+        return False
+
+    def _drop_all(self):
+        for payload, _ in self._queue:
+            self.stats.frames_dropped += 1
+            self.stats.bytes_dropped += len(payload)
+        self._queue.clear()
+        self.stats.queued_bytes -= self.queued_bytes
+        self.queued_bytes = 0
+
+    async def _run(self):
+        writer = self.writer
+        try:
+            while True:
+                while not self._queue:
+                    if self._closing:
+                        return
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                payload, _ = self._queue.popleft()
+                self.queued_bytes -= len(payload)
+                self.stats.queued_bytes -= len(payload)
+                writer.write(payload)
+                self.stats.frames_sent += 1
+                await writer.drain()
+        except (ConnectionResetError, BrokenPipeError, OSError) as e:
+            print(f"[!] Error writing to client {self.client_id}: {e}. Closing client connection.")
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._closing = True
+            self._drop_all()
+            # Closing the transport also ends the client's reader task, which does the cleanup
+            if not writer.is_closing():
+                writer.close()
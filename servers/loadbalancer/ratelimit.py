@@ -0,0 +1,137 @@
+import json
+from typing import Dict, Optional
+
+DEFAULT_THROTTLE_WINDOW = 10.0
+
+
+class Limit:
+    """A token bucket setting: `rate` tokens per second, up to `burst` saved up."""
+    __slots__ = ("rate", "burst")
+
+    def __init__(self, rate: float, burst: float):
+        if rate <= 0 or burst < 1:
+            raise ValueError(f"Invalid limit: rate={rate} burst={burst}")
+        self.rate = float(rate)
+        self.burst = float(burst)
+
+    @classmethod
+    def from_dict(cls, raw) -> "Limit":
+        return cls(float(raw["rate"]), float(raw.get("burst", raw["rate"])))
+
+    def scaled(self, factor: float) -> "Limit":
+        return Limit(self.rate * factor, max(1.0, self.burst * factor))
+
+
+class TokenBucket:
+    __slots__ = ("limit", "tokens", "updated")
+
+    def __init__(self, limit: Limit, now: float):
+        self.limit = limit
+        self.tokens = limit.burst # Start full so a fresh client is not throttled
+        self.updated = now
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.limit.burst, self.tokens + elapsed * self.limit.rate)
+            self.updated = now
+
+    def available(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= 1.0
+
+    def take(self, now: float) -> bool:
+        if not self.available(now):
+            return False
+        self.tokens -= 1.0
+        return True
+
+    def retry_after(self) -> float:
+        """Seconds until the next token, as of the last refill."""
+        return max(0.0, (1.0 - self.tokens) / self.limit.rate)
+
+
+class RateLimits:
+    """The limits configured in limits.json. Anything not configured is not limited.
+
+    Example:
+        {
+            "client": {"rate": 100, "burst": 200},
+            "types": {"screen_data": {"rate": 30, "burst": 60}},
+            "accept": {"rate": 200, "burst": 400},
+            "offenders": {"max_throttled": 100, "window": 10}
+        }
+    """
+
+    def __init__(self, client: Optional[Limit] = None, types: Optional[Dict[str, Limit]] = None,
+                 accept: Optional[Limit] = None, max_throttled: int = 0,
+                 throttle_window: float = DEFAULT_THROTTLE_WINDOW):
+        self.client = client        # Every message of one client
+        self.types = types or {}    # Messages of one type from one client
+        self.accept = accept        # New client connections, LB-wide
+        self.max_throttled = max_throttled # Throttled messages within throttle_window before disconnecting (0: never)
+        self.throttle_window = throttle_window
+
+    @classmethod
+    def from_dict(cls, raw) -> "RateLimits":
+        client = Limit.from_dict(raw["client"]) if raw.get("client") else None
+        types = {name: Limit.from_dict(limit) for name, limit in (raw.get("types") or {}).items()}
+        accept = Limit.from_dict(raw["accept"]) if raw.get("accept") else None
+        offenders = raw.get("offenders") or {}
+        return cls(client, types, accept, int(offenders.get("max_throttled", 0)),
+                   float(offenders.get("window", DEFAULT_THROTTLE_WINDOW)))
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.client or self.types)
+
+
+def load_limits(path: str) -> RateLimits:
+    """Reads limits.json. Raises OSError, ValueError (including JSON errors), KeyError or TypeError if it is unusable."""
+    with open(path, "r") as f:
+        return RateLimits.from_dict(json.load(f))
+
+
+class ClientRateLimiter:
+    """The token buckets of one client: one for all its messages and one per limited message type."""
+    __slots__ = ("limits", "client_bucket", "type_buckets", "throttled", "throttle_started")
+
+    def __init__(self):
+        self.limits = None
+        self.client_bucket = None
+        self.type_buckets = {}
+        self.throttled = 0 # Throttled messages in the current window
+        self.throttle_started = 0.0
+
+    def check(self, limits: RateLimits, msg_type: Optional[str], now: float) -> Optional[float]:
+        """Admits one message. Returns None if it may pass, else the seconds until it would.
+
+        Buckets start over when the limits are reloaded.
+        """
+        if limits is not self.limits:
+            self.limits = limits
+            self.client_bucket = TokenBucket(limits.client, now) if limits.client else None
+            self.type_buckets = {}
+        type_bucket = None
+        type_limit = limits.types.get(msg_type)
+        if type_limit:
+            type_bucket = self.type_buckets.get(msg_type)
+            if type_bucket is None:
+                type_bucket = self.type_buckets[msg_type] = TokenBucket(type_limit, now)
+        # Only take tokens once both buckets allow it, so a rejected message costs nothing
+        for bucket in (type_bucket, self.client_bucket):
+            if bucket and not bucket.available(now):
+                return bucket.retry_after()
+        for bucket in (type_bucket, self.client_bucket):
+            if bucket:
+                bucket.take(now)
+        return None
+
+    def record_throttle(self, now: float) -> bool:
+        """Counts a throttled message. Returns True once the client should be disconnected."""
+        limits = self.limits
+        if now - self.throttle_started > limits.throttle_window:
+            self.throttle_started = now
+            self.throttled = 0
+        self.throttled += 1
+        return 0 < limits.max_throttled <= self.throttled
@@ -0,0 +1,55 @@
+from balancing import Backend, RendezvousSelector
+
+CLIENTS = [f"client-{n}" for n in range(300)]
+
+
+def assign(selector):
+    return {client_id: selector.pick(client_id) for client_id in CLIENTS}
+
+
+def test_rendezvous_join_moves_only_the_joiners_clients():
+    a, b, c = (Backend("127.0.0.1", port) for port in (9001, 9002, 9003))
+    selector = RendezvousSelector()
+    selector.set_members([a, b])
+    before = assign(selector)
+
+    selector.set_members([a, b, c])
+    after = assign(selector)
+    moved = [client_id for client_id in CLIENTS if after[client_id] is not before[client_id]]
+    assert moved and all(after[client_id] is c for client_id in moved)
+    assert 50 < len(moved) < 150 # About a third
+
+    # c leaves and is admitted again: its clients go back to it, nobody else moves
+    selector.set_members([a, b])
+    assert all(selector.pick(client_id) is before[client_id] for client_id in CLIENTS)
+    selector.set_members([a, b, c])
+    assert assign(selector) == after
+
+
+def test_rendezvous_load_spills_new_clients_only():
+    a, b = Backend("127.0.0.1", 9001), Backend("127.0.0.1", 9002)
+    selector = RendezvousSelector()
+    selector.set_members([a, b])
+    before = assign(selector)
+
+    a.load_factor = 0.1
+    selector.on_load_change()
+    assert assign(selector) == before # Assigned clients stay
+    newcomers = [selector.pick(f"new-{n}") for n in range(100)]
+    assert all(backend is b for backend in newcomers)
+
+    b.load_factor = 0.1 # Both overloaded: the hash decides again
+    assert {selector.pick(f"later-{n}") for n in range(100)} == {a, b}
+
+
+def test_rendezvous_weight_change_moves_only_clients_whose_top_changed():
+    a, b = Backend("127.0.0.1", 9001), Backend("127.0.0.1", 9002)
+    selector = RendezvousSelector()
+    selector.set_members([a, b])
+    before = assign(selector)
+
+    b.weight = 3
+    selector.refresh()
+    after = assign(selector)
+    moved = [client_id for client_id in CLIENTS if after[client_id] is not before[client_id]]
+    assert moved and all(before[client_id] is a and after[client_id] is b for client_id in moved)
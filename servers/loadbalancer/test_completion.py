@@ -0,0 +1,65 @@
+import json
+from collections import deque
+from types import SimpleNamespace
+
+from balancing import Backend
+from loadbalancer import LoadBalancer, PendingRequest
+from utils.envelope import PROTOCOL_V1
+
+CLIENT_ID = "client-1"
+
+
+def make_lb(*msg_types):
+    lb = LoadBalancer()
+    backend = Backend("127.0.0.1", 9001)
+    lb.client_in_flight[CLIENT_ID] = deque(PendingRequest(backend, 0.0, True, msg_type) for msg_type in msg_types)
+    backend.in_flight = len(msg_types)
+    return lb, backend
+
+
+def v1_frame(message):
+    client_id = CLIENT_ID.encode("utf-8")
+    return bytes([len(client_id)]) + client_id + json.dumps(message).encode("utf-8")
+
+
+def deliver_v1(lb, backend, message):
+    lb._on_server_frame(("127.0.0.1", 9001), SimpleNamespace(version=PROTOCOL_V1), backend, v1_frame(message))
+
+
+def pending_types(lb):
+    return [request.msg_type for request in lb.client_in_flight.get(CLIENT_ID, ())]
+
+
+def test_push_does_not_complete_a_request():
+    lb, backend = make_lb("login")
+    deliver_v1(lb, backend, {"type": "notification", "message": "hello"})
+    assert pending_types(lb) == ["login"]
+    assert backend.in_flight == 1
+
+    deliver_v1(lb, backend, {"status": "success", "message": "Login successful"})
+    assert pending_types(lb) == []
+    assert backend.in_flight == 0
+
+
+def test_multicast_recipient_does_not_complete_a_request():
+    lb, backend = make_lb("notify")
+    lb._deliver_to_client(CLIENT_ID, b'{"status": "success", "message": "broadcast"}', fanout=True)
+    assert pending_types(lb) == ["notify"]
+
+
+def test_request_app_is_answered_by_return_app_not_by_responses():
+    lb, backend = make_lb("request_app", "refresh")
+    deliver_v1(lb, backend, {"status": "success", "message": "refreshed"})
+    assert pending_types(lb) == ["request_app"]
+
+    deliver_v1(lb, backend, {"type": "request_app", "sender_client_id": "client-2"})
+    assert pending_types(lb) == ["request_app"]
+
+    deliver_v1(lb, backend, {"type": "return_app", "app_data": []})
+    assert pending_types(lb) == []
+
+
+def test_request_app_error_response_completes_it():
+    lb, backend = make_lb("request_app")
+    deliver_v1(lb, backend, {"status": "error", "message": "Invalid request app data"})
+    assert pending_types(lb) == []
@@ -0,0 +1,77 @@
+import json
+import struct
+
+import pytest
+
+from framing import (
+    ClientFrameDecoder, FramingError, FrameTooLarge, FRAMING_AUTO, FRAMING_JSON, FRAMING_LENGTH,
+    peek_message_type
+)
+
+# Escaped quotes and backslashes, brackets inside strings, and multi-byte UTF-8
+MESSAGE = json.dumps({"type": "notify", "noti_message": 'say "hi" \\ {not [a] bracket} — Tiếng Việt 🎓',
+                      "nested": {"list": [1, {"a": "]"}]}}, ensure_ascii=False).encode("utf-8")
+
+
+def test_json_frame_split_at_every_point():
+    for split in range(1, len(MESSAGE)):
+        decoder = ClientFrameDecoder(FRAMING_JSON)
+        assert decoder.feed(MESSAGE[:split]) == []
+        assert decoder.feed(MESSAGE[split:] + b"\r\n" + MESSAGE) == [MESSAGE, MESSAGE]
+        assert decoder.buffered == 0
+
+
+def test_json_frames_fed_byte_by_byte():
+    decoder = ClientFrameDecoder(FRAMING_JSON)
+    stream = MESSAGE + b" " + MESSAGE
+    frames = [frame for i in range(len(stream)) for frame in decoder.feed(stream[i:i + 1])]
+    assert frames == [MESSAGE, MESSAGE]
+    assert all(json.loads(frame)["type"] == "notify" for frame in frames)
+
+
+def test_json_rejects_a_non_object():
+    with pytest.raises(FramingError):
+        ClientFrameDecoder(FRAMING_JSON).feed(b'"just a string"')
+
+
+def test_auto_detects_length_prefixed_clients():
+    prefixed = struct.pack("!I", len(MESSAGE)) + MESSAGE
+    decoder = ClientFrameDecoder(FRAMING_AUTO)
+    assert decoder.feed(prefixed[:3]) == []
+    assert decoder.mode == FRAMING_LENGTH
+    assert decoder.feed(prefixed[3:] + prefixed) == [MESSAGE, MESSAGE]
+    assert decoder.encode(b"{}") == b"\x00\x00\x00\x02{}"
+    assert decoder.encode_parts(b"{}") == (b"\x00\x00\x00\x02", b"{}")
+
+
+def test_auto_detects_json_clients():
+    decoder = ClientFrameDecoder(FRAMING_AUTO)
+    assert decoder.feed(MESSAGE) == [MESSAGE]
+    assert decoder.mode == FRAMING_JSON
+    assert decoder.encode(b"{}") == b"{}"
+
+
+def test_length_frame_too_large():
+    decoder = ClientFrameDecoder(FRAMING_LENGTH, max_frame_size=16)
+    assert decoder.feed(struct.pack("!I", 16) + b"x" * 16) == [b"x" * 16]
+    with pytest.raises(FrameTooLarge):
+        decoder.feed(struct.pack("!I", 17))
+
+
+def test_json_frame_too_large():
+    decoder = ClientFrameDecoder(FRAMING_JSON, max_frame_size=32)
+    assert decoder.feed(b'{"a": "' + b"x" * 20 + b'"}') != []
+    with pytest.raises(FrameTooLarge):
+        decoder.feed(b'{"a": "' + b"x" * 40) # Still open: the partial frame alone is over the limit
+
+
+def test_length_mode_limit_must_fit_the_prefix():
+    with pytest.raises(ValueError):
+        ClientFrameDecoder(FRAMING_AUTO, max_frame_size=1 << 24)
+    ClientFrameDecoder(FRAMING_JSON, max_frame_size=1 << 24)
+
+
+def test_peek_message_type():
+    assert peek_message_type(MESSAGE) == "notify"
+    assert peek_message_type(b'{"status": "success", "message": "ok"}') is None
+    assert peek_message_type(b'{"image_data": "' + b"A" * 200 + b'", "type": "screen_data"}') is None
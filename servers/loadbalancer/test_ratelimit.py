@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from ratelimit import ClientRateLimiter, Limit, RateLimits, TokenBucket, load_limits
+
+
+def test_bucket_starts_full_and_refills():
+    bucket = TokenBucket(Limit(rate=2, burst=3), now=100.0)
+    assert [bucket.take(100.0) for _ in range(4)] == [True, True, True, False]
+    assert bucket.retry_after() == pytest.approx(0.5)
+    assert not bucket.take(100.25)
+    assert bucket.retry_after() == pytest.approx(0.25)
+    assert bucket.take(100.5)
+    # A long pause saves up no more than the burst
+    assert [bucket.take(200.0) for _ in range(4)] == [True, True, True, False]
+
+
+def test_invalid_limits():
+    for rate, burst in ((0, 1), (-1, 5), (1, 0.5)):
+        with pytest.raises(ValueError):
+            Limit(rate, burst)
+    assert Limit(10, 20).scaled(0.01).burst == 1.0
+
+
+def test_type_limit_and_client_limit_both_apply():
+    limits = RateLimits(client=Limit(rate=1, burst=3), types={"screen_data": Limit(rate=1, burst=1)})
+    limiter = ClientRateLimiter()
+    assert limiter.check(limits, "screen_data", 0.0) is None
+    assert limiter.check(limits, "screen_data", 0.0) == pytest.approx(1.0) # Its type bucket is empty
+    # The rejected message took nothing from the client bucket
+    assert limiter.check(limits, "refresh", 0.0) is None
+    assert limiter.check(limits, None, 0.0) is None
+    assert limiter.check(limits, "refresh", 0.0) == pytest.approx(1.0)
+    assert limiter.check(limits, "screen_data", 0.5) == pytest.approx(0.5)
+
+
+def test_reloaded_limits_start_new_buckets():
+    limiter = ClientRateLimiter()
+    old = RateLimits(client=Limit(rate=1, burst=1))
+    assert limiter.check(old, None, 0.0) is None
+    assert limiter.check(old, None, 0.0) is not None
+    assert limiter.check(RateLimits(client=Limit(rate=1, burst=1)), None, 0.0) is None
+
+
+def test_offender_is_disconnected_after_max_throttled_in_the_window():
+    limits = RateLimits(client=Limit(rate=1, burst=1), max_throttled=3, throttle_window=10.0)
+    limiter = ClientRateLimiter()
+    limiter.check(limits, None, 0.0)
+    assert [limiter.record_throttle(now) for now in (20.0, 21.0)] == [False, False]
+    # The window ran out: counting starts over
+    assert [limiter.record_throttle(now) for now in (31.0, 32.0, 33.0)] == [False, False, True]
+
+
+def test_offenders_are_never_disconnected_by_default():
+    limits = RateLimits(client=Limit(rate=1, burst=1))
+    limiter = ClientRateLimiter()
+    limiter.check(limits, None, 0.0)
+    assert not any(limiter.record_throttle(1.0) for _ in range(1000))
+
+
+def test_load_limits(tmp_path):
+    path = tmp_path / "limits.json"
+    path.write_text(json.dumps({"client": {"rate": 100, "burst": 200}, "types": {"screen_data": {"rate": 30}},
+                                "offenders": {"max_throttled": 50, "window": 5}}))
+    limits = load_limits(str(path))
+    assert limits.enabled and limits.accept is None
+    assert (limits.client.rate, limits.client.burst) == (100.0, 200.0)
+    assert limits.types["screen_data"].burst == 30.0 # Burst defaults to the rate
+    assert (limits.max_throttled, limits.throttle_window) == (50, 5.0)
+    assert not RateLimits.from_dict({"accept": {"rate": 5}}).enabled
@@ -0,0 +1,78 @@
+import pytest
+
+from timerwheel import TimerWheel
+
+
+def make_wheel(**kwargs):
+    fired = {} # Map: key -> tick it expired at
+    wheel = TimerWheel(lambda key: fired.setdefault(key, wheel.now), **kwargs)
+    return wheel, fired
+
+
+def run(wheel, ticks):
+    for _ in range(ticks):
+        wheel.advance()
+
+
+@pytest.mark.parametrize("start", [0, 1, 3, 4, 15, 16, 17, 50])
+def test_every_deadline_expires_on_its_tick(start):
+    # 4 slots over 3 levels: deadlines 1..63 ticks ahead cascade through every level
+    wheel, fired = make_wheel(slot_bits=2, levels=3)
+    run(wheel, start)
+    for ticks in range(1, 64):
+        wheel.add(ticks, ticks)
+    assert len(wheel) == 63
+    run(wheel, 70)
+    assert fired == {ticks: start + ticks for ticks in range(1, 64)}
+    assert len(wheel) == 0 and wheel.expired == 63
+
+
+def test_deadline_past_the_span_is_clamped():
+    wheel, fired = make_wheel(slot_bits=2, levels=3)
+    run(wheel, 5)
+    wheel.add("far", 1000)
+    wheel.add("edge", 64)
+    run(wheel, 200)
+    assert fired == {"far": 5 + 64, "edge": 5 + 64}
+
+
+def test_default_wheel_cascades_from_the_top_levels():
+    wheel, fired = make_wheel()
+    run(wheel, 7)
+    deadlines = {"level1": 100, "level2": 64 * 64 + 5, "level2-edge": 64 * 64 * 2}
+    for key, ticks in deadlines.items():
+        wheel.add(key, ticks)
+    run(wheel, 64 * 64 * 2 + 1)
+    assert fired == {key: 7 + ticks for key, ticks in deadlines.items()}
+
+
+def test_move_and_remove():
+    wheel, fired = make_wheel(slot_bits=2, levels=3)
+    wheel.add("moved", 3)
+    wheel.add("removed", 2)
+    wheel.add("moved", 40)
+    wheel.remove("removed")
+    wheel.remove("unknown")
+    assert "moved" in wheel and "removed" not in wheel
+    run(wheel, 50)
+    assert fired == {"moved": 40}
+
+
+def test_failing_callback_does_not_stop_the_others():
+    fired = []
+
+    def on_expire(key):
+        if key == "bad":
+            raise RuntimeError("boom")
+        fired.append(key)
+
+    wheel = TimerWheel(on_expire)
+    for key in ("a", "bad", "b"):
+        wheel.add(key, 1)
+    wheel.advance()
+    assert sorted(fired) == ["a", "b"] and wheel.expired == 3
+
+
+def test_ticks_round_up():
+    wheel = TimerWheel(lambda key: None, tick=0.5)
+    assert [wheel.ticks(seconds) for seconds in (0, 0.1, 0.5, 0.6, 30)] == [1, 1, 1, 2, 60]
@@ -0,0 +1,57 @@
+import asyncio
+
+from outbound import OVERFLOW_DROP_OLDEST
+from workers import WorkerRouter
+
+
+def make_router(worker_id, socket_dir, delivered, high_watermark=1 << 20, low_watermark=1 << 18):
+    return WorkerRouter(worker_id, 2, str(socket_dir), lambda client_id, payload: delivered.append(payload),
+                        high_watermark, low_watermark, OVERFLOW_DROP_OLDEST)
+
+
+def test_frames_wait_for_the_peer_link(tmp_path):
+    async def scenario():
+        delivered = []
+        router = make_router(0, tmp_path, [])
+        peer = make_router(1, tmp_path, delivered)
+        await router.start() # Worker 1 is not listening yet
+        client_id = peer.new_client_id()
+        assert router.is_remote(client_id)
+        for n in range(5):
+            assert router.forward(client_id, f"frame {n}".encode(), droppable=n % 2 == 1)
+        assert router.frames_pending == 5
+
+        await peer.start()
+        for _ in range(100):
+            if len(delivered) == 5:
+                break
+            await asyncio.sleep(0.02)
+        assert router.frames_pending == 0
+        router.forward(client_id, b"frame 5") # Straight over the link now
+        await asyncio.sleep(0.05)
+        await router.close()
+        await peer.close()
+        return delivered
+
+    delivered = asyncio.run(scenario())
+    assert delivered == [f"frame {n}".encode() for n in range(6)]
+
+
+def test_pending_frames_shed_droppable_ones_first(tmp_path):
+    async def scenario():
+        # Frames are 44 bytes with their header: two fit under the high watermark
+        router = make_router(0, tmp_path, [], high_watermark=100, low_watermark=50)
+        client_id = "01" + "x" * 34
+        payload = b"p" * 3
+        assert router.forward(client_id, payload, droppable=True)
+        assert router.forward(client_id, payload)
+        assert router.forward(client_id, payload) # The droppable one makes room
+        assert not router.forward(client_id, payload) # Nothing droppable left: refused
+        assert router.forward(client_id, payload, droppable=True) is False
+        pending = list(router._pending[1])
+        await router.close()
+        return router, pending
+
+    router, pending = asyncio.run(scenario())
+    assert [droppable for _, droppable in pending] == [False, False]
+    assert router.stats.frames_dropped == 5 # Shed, refused twice, then the two dropped at close
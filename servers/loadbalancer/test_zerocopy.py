@@ -0,0 +1,102 @@
+import asyncio
+import random
+import struct
+
+from zerocopy import BackendFrameProtocol
+
+
+class FakeTransport:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def is_closing(self):
+        return self.closed
+
+
+def frame(payload: bytes) -> bytes:
+    return struct.pack("!I", len(payload)) + payload
+
+
+def make_protocol(buffer_size, received, max_frame_size=1 << 20):
+    protocol = BackendFrameProtocol(max_frame_size, buffer_size)
+    protocol.connection_made(FakeTransport())
+    protocol.set_frame_handler(received.append)
+    return protocol
+
+
+def receive(protocol, data: bytes):
+    """Feeds data the way the event loop does: into whatever buffer the protocol hands out."""
+    while data:
+        buffer = protocol.get_buffer(-1)
+        n = min(len(buffer), len(data))
+        buffer[:n] = data[:n]
+        protocol.buffer_updated(n)
+        data = data[n:]
+
+
+def test_randomly_split_frames():
+    async def scenario():
+        rng = random.Random(1234)
+        payloads = [rng.randbytes(rng.randrange(0, 300)) for _ in range(300)]
+        stream = b"".join(frame(payload) for payload in payloads)
+        received = []
+        protocol = make_protocol(64, received)
+        handler = protocol._handler
+        protocol.set_frame_handler(lambda view: handler(bytes(view)))
+        position = 0
+        while position < len(stream):
+            step = rng.randrange(1, 200)
+            receive(protocol, stream[position:position + step])
+            position += step
+        assert received == payloads
+        assert protocol._start == protocol._end == 0
+
+    asyncio.run(scenario())
+
+
+def test_frame_bigger_than_the_buffer_grows_it():
+    async def scenario():
+        received = []
+        protocol = make_protocol(16, received)
+        small, big = frame(b"abc"), frame(b"x" * 100)
+        old_buf = protocol._buf
+        receive(protocol, small + big[:10])
+        assert protocol._buf is not old_buf and len(protocol._buf) >= len(big)
+        # The view handed out before the switch still reads the old buffer
+        assert bytes(received[0]) == b"abc"
+        receive(protocol, big[10:])
+        assert bytes(received[1]) == b"x" * 100
+        assert len(old_buf) == 16
+
+    asyncio.run(scenario())
+
+
+def test_partial_frame_is_moved_to_the_front():
+    async def scenario():
+        received = []
+        protocol = make_protocol(32, received)
+        first, second = frame(b"a" * 10), frame(b"b" * 20) # 14 and 24 bytes
+        buf = protocol._buf
+        receive(protocol, first + second[:6])
+        # The second frame fits the buffer, just not behind the first one
+        assert protocol._buf is buf and len(buf) == 32
+        assert (protocol._start, protocol._end) == (0, 6)
+        receive(protocol, second[6:])
+        assert bytes(received[-1]) == b"b" * 20
+        assert (protocol._start, protocol._end) == (0, 0)
+
+    asyncio.run(scenario())
+
+
+def test_oversized_frame_closes_the_connection():
+    async def scenario():
+        received = []
+        protocol = make_protocol(64, received, max_frame_size=8)
+        receive(protocol, frame(b"12345678") + frame(b"123456789"))
+        assert [bytes(view) for view in received] == [b"12345678"]
+        assert protocol.transport.closed
+
+    asyncio.run(scenario())
@@ -0,0 +1,120 @@
+"""Hierarchical timing wheel for timeouts of very many connections.
+
+One asyncio timer per connection costs a heap entry per socket, and moving a
+deadline means cancelling and re-creating it. The wheel instead hashes each
+deadline into a slot: level 0 has one slot per tick, and each higher level
+has slots that each cover a whole turn of the level below. Adding, moving and
+removing a timer is a dict operation; a tick expires one slot, and whenever
+a level turns over, one slot of the level above is spread into the levels
+below (at most once per timer per level).
+
+With the defaults (1s ticks, 64 slots, 4 levels) deadlines up to about
+194 days ahead are exact to the tick; later ones are clamped.
+
+Timers are identified by a key and share one callback per wheel, so a
+timer costs a dict entry and no closure. Idle timeouts are best kept lazy:
+record the last activity on the connection (cheap, on every message) and,
+when the timer fires, re-add it for the time remaining if there was activity
+meanwhile, instead of moving the timer on every message.
+"""
+import asyncio
+import math
+from typing import Callable, Dict, Hashable, List
+
+
+class TimerWheel:
+    def __init__(self, on_expire: Callable[[Hashable], None], tick: float = 1.0, slot_bits: int = 6,
+                 levels: int = 4):
+        self.on_expire = on_expire # Called with the key of every timer that expires
+        self.tick = tick # Seconds per tick
+        self.now = 0 # Ticks processed so far
+        self._bits = slot_bits
+        self._mask = (1 << slot_bits) - 1
+        self._span = 1 << (slot_bits * levels) # Ticks ahead the wheel can hold exactly
+        self._levels: List[List[Dict[Hashable, int]]] = [
+            [{} for _ in range(1 << slot_bits)] for _ in range(levels)
+        ] # Per level, per slot: key -> deadline tick
+        self._slot_of: Dict[Hashable, Dict[Hashable, int]] = {} # Map: key -> slot holding its timer
+        self.expired = 0 # Timers expired since start
+        self._task = None
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def __contains__(self, key) -> bool:
+        return key in self._slot_of
+
+    def ticks(self, seconds: float) -> int:
+        """Whole ticks covering `seconds` (at least one)."""
+        return max(1, math.ceil(seconds / self.tick))
+
+    def add(self, key: Hashable, ticks: int):
+        """Starts (or moves) the timer for `key` to expire `ticks` ticks from now."""
+        self.remove(key)
+        self._insert(key, self.now + max(1, ticks), self.now + 1)
+
+    def remove(self, key: Hashable):
+        slot = self._slot_of.pop(key, None)
+        if slot is not None:
+            del slot[key]
+
+    def _insert(self, key, deadline: int, base: int):
+        """Files a timer relative to `base`, the next tick to be processed."""
+        delta = deadline - base
+        if delta < 0:
+            deadline, delta = base, 0
+        elif delta >= self._span:
+            deadline, delta = base + self._span - 1, self._span - 1
+        level = 0
+        while delta >> (self._bits * (level + 1)):
+            level += 1
+        slot = self._levels[level][(deadline >> (self._bits * level)) & self._mask]
+        slot[key] = deadline
+        self._slot_of[key] = slot
+
+    def _cascade(self, level: int, tick: int) -> int:
+        """Spreads the slot of `level` that `tick` starts into the levels below. Returns its index."""
+        index = (tick >> (self._bits * level)) & self._mask
+        slots = self._levels[level]
+        entries, slots[index] = slots[index], {}
+        for key, deadline in entries.items():
+            self._insert(key, deadline, tick)
+        return index
+
+    def advance(self):
+        """Processes one tick: expires the timers due at it."""
+        tick = self.now + 1
+        index = tick & self._mask
+        if index == 0:
+            level = 1
+            while level < len(self._levels) and self._cascade(level, tick) == 0:
+                level += 1
+        slots = self._levels[0]
+        due, slots[index] = slots[index], {}
+        self.now = tick
+        for key in due:
+            del self._slot_of[key]
+        self.expired += len(due)
+        for key in due:
+            try:
+                self.on_expire(key)
+            except Exception as e:
+                print(f"[!] Timer callback failed for {key}: {type(e).__name__} - {e}")
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="TimerWheel")
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        """Advances the wheel in step with the loop clock, catching up on ticks missed while the loop was busy."""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        while True:
+            await asyncio.sleep(self.tick)
+            target = int((loop.time() - started) / self.tick)
+            while self.now < target:
+                self.advance()
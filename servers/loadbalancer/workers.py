@@ -0,0 +1,199 @@
+import asyncio
+import os
+import struct
+import uuid
+from collections import deque
+
+from outbound import ClientOutbound, OutboundStats
+
+MAX_WORKERS = 256 # Worker ids are the first two hex digits of a client id
+
+PEER_RETRY_DELAY = 0.2 # Seconds between attempts to reach a worker that is not up yet
+
+
+def worker_socket_path(socket_dir: str, worker_id: int) -> str:
+    return os.path.join(socket_dir, f"worker-{worker_id}.sock")
+
+
+class WorkerRouter:
+    """Routes backend frames between LB worker processes that share one port.
+
+    Every worker owns the clients it accepted, and stamps its id into the
+    first two hex digits of their client ids. Backends send pushes on
+    whichever connection the triggering request came in on, so a worker can
+    receive frames for clients that belong to another worker; those are
+    handed to the owner over a unix socket link, framed exactly like
+    backend->LB frames. Each link has a bounded queue (the same one client
+    connections use), so a stalled worker sheds droppable frames instead of
+    blocking the backend reader that found the frame.
+
+    While a link is not up (the peer is still starting, or the link is being
+    re-established) frames for that peer wait in a pending queue bounded by
+    the same watermarks, and go out once the link connects. Past the high
+    watermark the pending queue sheds droppable frames oldest-first; only
+    if that is not enough is a frame that must be delivered refused.
+    """
+
+    def __init__(self, worker_id: int, workers: int, socket_dir: str, deliver,
+                 high_watermark: int, low_watermark: int, policy: str):
+        self.worker_id = worker_id
+        self.workers = workers
+        self.socket_dir = socket_dir
+        self.deliver = deliver # Called with (client_id, payload) for frames addressed to our clients
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.policy = policy
+        self.stats = OutboundStats()
+        self.frames_forwarded = 0
+        self.frames_received = 0
+        self._links = {} # Map: peer worker id -> ClientOutbound
+        self._connecting = {} # Map: peer worker id -> task connecting to it
+        self._pending = {} # Map: peer worker id -> deque of (frame, droppable) waiting for its link
+        self._pending_bytes = {} # Map: peer worker id -> bytes in its pending queue
+        self._server = None
+
+    def new_client_id(self) -> str:
+        return f"{self.worker_id:02x}{str(uuid.uuid4())[2:]}"
+
+    def owner_of(self, client_id: str):
+        """Returns the id of the worker that owns client_id, or None if it is not a worker-stamped id."""
+        try:
+            owner = int(client_id[:2], 16)
+        except ValueError:
+            return None
+        return owner if owner < self.workers else None
+
+    def is_remote(self, client_id: str) -> bool:
+        """True if client_id belongs to another worker."""
+        owner = self.owner_of(client_id)
+        return owner is not None and owner != self.worker_id
+
+    async def start(self):
+        path = worker_socket_path(self.socket_dir, self.worker_id)
+        if os.path.exists(path):
+            os.unlink(path)
+        self._server = await asyncio.start_unix_server(self._handle_peer, path)
+        print(f"[*] Worker {self.worker_id} accepting forwarded frames on {path}")
+        for peer in range(self.workers):
+            if peer != self.worker_id:
+                self._connect(peer)
+
+    @property
+    def frames_pending(self) -> int:
+        """Frames waiting for a link to their worker to come up."""
+        return sum(len(pending) for pending in self._pending.values())
+
+    async def close(self):
+        for task in list(self._connecting.values()):
+            task.cancel()
+        for link in self._links.values():
+            link.close()
+        self._links.clear()
+        for peer in list(self._pending):
+            self._drop_pending(peer)
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def forward(self, client_id: str, payload: bytes, droppable: bool = False) -> bool:
+        """Queues a frame for the worker that owns client_id. Returns False if it could not be queued."""
+        owner = self.owner_of(client_id)
+        client_id_bytes = client_id.encode("utf-8")
+        frame = struct.pack("!IB", len(client_id_bytes) + 1 + len(payload), len(client_id_bytes)) \
+            + client_id_bytes + payload
+        link = self._links.get(owner)
+        if link is None or link.closing or owner in self._pending:
+            if link is not None and link.closing:
+                del self._links[owner]
+            self._connect(owner)
+            return self._hold(owner, frame, droppable)
+        if not link.enqueue(frame, droppable):
+            return False
+        self.frames_forwarded += 1
+        return True
+
+    def _hold(self, peer: int, frame: bytes, droppable: bool) -> bool:
+        """Queues a frame until the link to peer is up. Returns False if it had to be refused."""
+        pending = self._pending.setdefault(peer, deque())
+        pending_bytes = self._pending_bytes.get(peer, 0)
+        if pending_bytes + len(frame) > self.high_watermark:
+            # Make room by shedding droppable frames oldest-first, down to the low watermark
+            kept = deque()
+            while pending and pending_bytes + len(frame) > self.low_watermark:
+                held, held_droppable = pending.popleft()
+                if held_droppable:
+                    pending_bytes -= len(held)
+                    self.stats.frames_dropped += 1
+                    self.stats.bytes_dropped += len(held)
+                else:
+                    kept.append((held, held_droppable))
+            kept.extend(pending)
+            pending = self._pending[peer] = kept
+            if pending_bytes + len(frame) > self.high_watermark:
+                self._pending_bytes[peer] = pending_bytes
+                self.stats.frames_dropped += 1
+                self.stats.bytes_dropped += len(frame)
+                print(f"[!] {pending_bytes} bytes already waiting for the link to worker {peer}; frame refused.")
+                return False
+        pending.append((frame, droppable))
+        self._pending_bytes[peer] = pending_bytes + len(frame)
+        return True
+
+    def _flush_pending(self, peer: int, link):
+        pending = self._pending.pop(peer, None)
+        self._pending_bytes.pop(peer, None)
+        while pending:
+            frame, droppable = pending.popleft()
+            if link.enqueue(frame, droppable):
+                self.frames_forwarded += 1
+            elif link.closing:
+                # The link broke again straight away: keep the rest for the next one
+                for frame, droppable in pending:
+                    self._hold(peer, frame, droppable)
+                self._connect(peer)
+                return
+
+    def _drop_pending(self, peer: int):
+        pending = self._pending.pop(peer, ())
+        self._pending_bytes.pop(peer, None)
+        for frame, _ in pending:
+            self.stats.frames_dropped += 1
+            self.stats.bytes_dropped += len(frame)
+
+    def _connect(self, peer: int):
+        if peer not in self._connecting:
+            self._connecting[peer] = asyncio.create_task(self._connect_peer(peer), name=f"WorkerLink-{peer}")
+
+    async def _connect_peer(self, peer: int):
+        path = worker_socket_path(self.socket_dir, peer)
+        try:
+            while True:
+                try:
+                    _, writer = await asyncio.open_unix_connection(path)
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    await asyncio.sleep(PEER_RETRY_DELAY) # Peer still starting up
+            link = self._links[peer] = ClientOutbound(writer, f"worker-{peer}", self.stats,
+                                                      self.high_watermark, self.low_watermark, self.policy)
+            print(f"[*] Worker {self.worker_id} linked to worker {peer}")
+            self._flush_pending(peer, link)
+        except OSError as e:
+            print(f"[!] Worker {self.worker_id} could not link to worker {peer}: {e}")
+        finally:
+            self._connecting.pop(peer, None)
+
+    async def _handle_peer(self, reader, writer):
+        try:
+            while True:
+                len_data = await reader.readexactly(4)
+                message_data = await reader.readexactly(struct.unpack("!I", len_data)[0])
+                client_id_end = 1 + message_data[0]
+                client_id = message_data[1:client_id_end].decode("utf-8")
+                self.frames_received += 1
+                self.deliver(client_id, message_data[client_id_end:])
+        except (asyncio.IncompleteReadError, ConnectionResetError, BrokenPipeError, OSError):
+            pass # Peer worker went away; it reconnects when it has something to send
+        except asyncio.CancelledError:
+            pass # Shutting down
+        finally:
+            writer.close()
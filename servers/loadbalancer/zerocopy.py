@@ -0,0 +1,158 @@
+import asyncio
+import struct
+from collections import deque
+
+DEFAULT_BUFFER_SIZE = 256 * 1024
+
+_LENGTH = struct.Struct("!I")
+
+
+class BackendFrameProtocol(asyncio.BufferedProtocol):
+    """Reads length-prefixed backend frames straight into a reusable buffer.
+
+    The event loop receives into a preallocated bytearray, and each complete
+    frame is handed to the frame handler as a memoryview of that buffer, so
+    a 200 KB screen frame is never copied into a bytes object on the way in.
+    The handler must finish with the view before it returns: the space is
+    reused for the next frames.
+
+    The protocol also stands in for the StreamWriter of its connection
+    (write, writelines, drain, close, wait_closed), so the rest of the LB
+    treats both transports alike.
+    """
+
+    def __init__(self, max_frame_size: int, buffer_size: int = DEFAULT_BUFFER_SIZE):
+        self.max_frame_size = max_frame_size
+        self.transport = None
+        self._buf = bytearray(buffer_size)
+        self._start = 0 # First unconsumed byte
+        self._end = 0   # End of received data
+        self._handler = None
+        self._early_frames = deque() # Frames received before a handler was set (e.g. the protocol hello reply)
+        self._frame_waiter = None
+        self._paused = False
+        self._drain_waiters = deque()
+        self._closed = asyncio.get_running_loop().create_future()
+
+    # --- Receiving ---
+
+    def set_frame_handler(self, handler):
+        """Sets the callable that receives every frame (without its length prefix) from now on."""
+        self._handler = handler
+        while self._early_frames:
+            handler(self._early_frames.popleft())
+
+    async def read_frame(self) -> bytes:
+        """Waits for the next frame. Only for use before a frame handler is set."""
+        while not self._early_frames:
+            if self._closed.done():
+                raise asyncio.IncompleteReadError(b"", None)
+            self._frame_waiter = asyncio.get_running_loop().create_future()
+            await asyncio.wait([self._frame_waiter, self._closed], return_when=asyncio.FIRST_COMPLETED)
+        return self._early_frames.popleft()
+
+    def get_buffer(self, sizehint):
+        if self._end == len(self._buf):
+            self._make_room(0)
+        return memoryview(self._buf)[self._end:]
+
+    def buffer_updated(self, nbytes):
+        self._end += nbytes
+        buf = self._buf
+        view = memoryview(buf)
+        while self._end - self._start >= 4:
+            length = _LENGTH.unpack_from(buf, self._start)[0]
+            if length > self.max_frame_size:
+                print(f"[!] Excessive message length ({length} bytes) from backend. Closing connection.")
+                self.transport.close()
+                return
+            frame_end = self._start + 4 + length
+            if frame_end > self._end:
+                if 4 + length > len(buf) - self._start:
+                    self._make_room(4 + length) # The rest of this frame will not fit behind it
+                break
+            frame = view[self._start + 4:frame_end]
+            self._start = frame_end
+            if self._handler:
+                self._handler(frame)
+            else:
+                self._early_frames.append(bytes(frame))
+                if self._frame_waiter and not self._frame_waiter.done():
+                    self._frame_waiter.set_result(None)
+        if self._start == self._end:
+            self._start = self._end = 0 # Everything consumed: reuse the buffer from the front
+
+    def _make_room(self, frame_size):
+        """Moves unconsumed bytes to the front, or into a larger buffer if frame_size needs one."""
+        pending = self._end - self._start
+        if frame_size > len(self._buf):
+            # A frame bigger than the buffer: switch to one that fits. The old buffer is
+            # not resized, so views a handler may still be looking at stay valid.
+            new_buf = bytearray(max(frame_size, 2 * len(self._buf)))
+            new_buf[:pending] = self._buf[self._start:self._end]
+            self._buf = new_buf
+        elif self._start:
+            self._buf[:pending] = self._buf[self._start:self._end] # Same-size copy, no resize
+        self._start, self._end = 0, pending
+
+    # --- Connection state ---
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        if not self._closed.done():
+            self._closed.set_result(exc)
+        if self._frame_waiter and not self._frame_waiter.done():
+            self._frame_waiter.set_result(None)
+        while self._drain_waiters:
+            waiter = self._drain_waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(ConnectionResetError("Connection lost"))
+
+    def eof_received(self):
+        return False # Close the transport
+
+    def pause_writing(self):
+        self._paused = True
+
+    def resume_writing(self):
+        self._paused = False
+        while self._drain_waiters:
+            waiter = self._drain_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def wait_lost(self):
+        """Waits until the connection is gone. Returns the exception that ended it, if any."""
+        return await asyncio.shield(self._closed)
+
+    # --- StreamWriter-compatible sending ---
+
+    def write(self, data):
+        self.transport.write(data)
+
+    def writelines(self, parts):
+        """Sends several buffers (e.g. a header and a payload) without joining them first where the loop supports it."""
+        self.transport.writelines(parts)
+
+    async def drain(self):
+        if self._closed.done():
+            raise ConnectionResetError("Connection lost")
+        if self._paused:
+            waiter = asyncio.get_running_loop().create_future()
+            self._drain_waiters.append(waiter)
+            await waiter
+
+    def is_closing(self):
+        return self.transport is None or self.transport.is_closing()
+
+    def close(self):
+        if self.transport:
+            self.transport.close()
+
+    async def wait_closed(self):
+        await self.wait_lost()
+
+    def get_extra_info(self, name, default=None):
+        return self.transport.get_extra_info(name, default)
@@ -1,284 +1,442 @@
 import asyncio
+import functools
 import struct
 import json
 import argparse
 import sys
 import os
-from typing import Dict, Optional, Callable, Awaitable
+import signal
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional
 from pydantic import ValidationError
 
 # Ensure the path includes the project root for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from database.sqlite_db import ClassroomDatabase
-# Import all necessary packet types
-from utils.packets import (
-    PacketLogin, PacketCreateRoom, PacketLogout, PacketJoinRoom, 
-    PacketRefresh, PacketNotify, PacketStreaming, PacketScreenData,
-    PacketScreenData, PacketReturnApp, PacketRequestApp
-)
+from database.async_db import AsyncClassroomDatabase, DEFAULT_READERS
+from utils.parser import describe_error, peek_request_type, ERROR_NOT_JSON, ERROR_UNKNOWN_TYPE
 from utils.logger import setup_logger # Assuming logger setup is desired
+from utils.loops import install_event_loop, LOOP_CHOICES, LOOP_AUTO
+from utils.presence import ClientPresence, DEFAULT_LINK_GRACE
+from utils.histogram import LatencyRecorder, LatencyHistogram
+from utils.metrics import MetricsRegistry, MetricsServer, LoopLagMonitor
+from utils.loadreport import LoadReporter, DEFAULT_REPORT_INTERVAL
+from utils.auth_pool import PasswordVerifier, DEFAULT_AUTH_QUEUE
+from utils.client_queues import (
+    ClientRequestQueues, DEFAULT_MAX_CONCURRENT, DEFAULT_MAX_BACKLOG, DEFAULT_MAX_PER_CLIENT
+)
+from utils.envelope import (
+    EnvelopeCodec, SUPPORTED_VERSIONS, SUPPORTED_FEATURES, FEATURE_LOAD_REPORT, PROTOCOL_V1, PROTOCOL_V2,
+    KIND_RESPONSE, KIND_PUSH, KIND_CONTROL, split_correlation, add_correlation
+)
 
-# Import all handlers
-from features.login_handler import handle_login
-from features.create_room_handler import handle_create_room
-from features.logout_handler import handle_logout
-from features.joinroom_handler import handle_joinroom
-from features.refresh_handler import handle_refresh
-from features.notify_handler import handle_notify
-from features.streaming_handler import handle_streaming_request # Import the correct handler
-from features.screen_data_handler import handle_screen_data # Import the correct handler
-from features.send_app_handler import *
-
-# Global database instance
-db: Optional[ClassroomDatabase] = None
+# Request type -> packet model, handler and how to run it; the parser for those packet models
+from features.registry import HANDLERS, CONCURRENCY_CPU, parse_message
+
+# Global database instance; queries run on its own threads, off the event loop
+db: Optional[AsyncClassroomDatabase] = None
+# Connected clients as reported by the LB; created with the database in main()
+presence: Optional[ClientPresence] = None
+
+# Open LB connections and the codec each negotiated, so a drain can be announced on all of them
+lb_connections: Dict[asyncio.StreamWriter, EnvelopeCodec] = {}
+# Set once this server is shutting down gracefully (SIGTERM)
+draining = False
+# Requests of all LB connections, run concurrently across clients and in order per client; created in main()
+request_queues: Optional[ClientRequestQueues] = None
+# Runs login password checks in worker processes; created in main() unless --auth-workers is 0
+password_verifier: Optional[PasswordVerifier] = None
+# Sends load reports to the LBs; started in main() unless --load-report-interval is 0
+load_reporter: Optional[LoadReporter] = None
+# LB connections the LB has said it is done with (after draining); their clients stay connected to the LB
+released_connections = set()
+
+# Per request type: time from reading a request to its handler starting (queue), in the handler
+# (handler), awaiting the database during the handler, its threads' queues included (db) and sending the
+# response (write)
+BACKEND_PHASES = ("queue", "handler", "db", "write")
+latency = LatencyRecorder(BACKEND_PHASES)
+# Database time of the request being handled; each client queue's worker task has its own
+_request_db_time: ContextVar[Optional[list]] = ContextVar("request_db_time", default=None)
+
+# Served on --metrics-port; callback metrics that need the database are added in main()
+metrics = MetricsRegistry()
+messages_in = metrics.counter("backend_messages_in_total", "Client requests received from the LB, by type", ("type",))
+messages_out = metrics.counter("backend_messages_out_total", "Responses and pushes sent to the LB for clients",
+                               ("kind", "type"))
+bytes_in = metrics.counter("backend_bytes_in_total", "Bytes of frames received from the LB")
+bytes_out = metrics.counter("backend_bytes_out_total", "Bytes of frames sent to the LB")
+push_failures = metrics.counter("backend_push_failures_total", "Pushes from the feature handlers that were not sent",
+                                ("reason",))
+db_query_latency = LatencyHistogram()
+
+def _add_db_time(seconds: float):
+    """AsyncClassroomDatabase.on_query_time hook: adds to the current request's database time."""
+    db_time = _request_db_time.get()
+    if db_time is not None:
+        db_time[0] += seconds
+
+def register_metrics(lag_monitor: LoopLagMonitor):
+    """Adds the metrics read from the database, the presence table and the connections at scrape time."""
+    metrics.callback("backend_lb_connections", "Open connections from Load Balancers", lambda: len(lb_connections))
+    metrics.callback("backend_clients_connected", "Clients the Load Balancers report as connected",
+                     lambda: presence.client_count if presence else 0)
+    metrics.callback("backend_draining", "1 while shutting down gracefully", lambda: int(draining))
+    metrics.callback("backend_requests_pending", "Requests queued or inside their handlers",
+                     lambda: request_queues.pending)
+    metrics.callback("backend_requests_running", "Requests inside their handlers", lambda: request_queues.running)
+    metrics.callback("backend_request_queue_clients", "Clients with requests queued or running",
+                     lambda: request_queues.clients)
+    metrics.callback("backend_requests_rejected_total", "Requests refused because their client had too many queued",
+                     lambda: request_queues.rejected, kind="counter")
+    metrics.callback("backend_requests_dropped_total",
+                     "Refused requests left unanswered because their client already had too many errors owed",
+                     lambda: request_queues.dropped, kind="counter")
+    metrics.callback("backend_requests_shed_total",
+                     "Droppable requests (screen frames) replaced by a newer one or shed for room while queued",
+                     lambda: request_queues.shed, kind="counter")
+    metrics.callback("backend_auth_checks_in_flight", "Password checks running or waiting for a worker process",
+                     lambda: password_verifier.in_flight if password_verifier else 0)
+    metrics.callback("backend_auth_checks_waiting", "Password checks waiting for a worker process",
+                     lambda: password_verifier.waiting if password_verifier else 0)
+    metrics.callback("backend_auth_checks_total", "Password checks completed by the worker processes",
+                     lambda: password_verifier.completed if password_verifier else 0, kind="counter")
+    metrics.callback("backend_auth_failed_total", "Password checks that found the password wrong",
+                     lambda: password_verifier.failed if password_verifier else 0, kind="counter")
+    metrics.callback("backend_auth_errors_total", "Password checks that raised an error",
+                     lambda: password_verifier.errors if password_verifier else 0, kind="counter")
+    metrics.callback("backend_auth_rejected_total", "Logins refused because the password check queue was full",
+                     lambda: password_verifier.rejected if password_verifier else 0, kind="counter")
+    metrics.callback("backend_db_queries_total", "Database cursor blocks run", lambda: db.query_count,
+                     kind="counter")
+    metrics.callback("backend_db_query_errors_total", "Database cursor blocks that failed",
+                     lambda: db.query_errors, kind="counter")
+    metrics.callback("backend_db_query_seconds_total", "Time spent in database cursor blocks",
+                     lambda: db.query_seconds, kind="counter")
+    metrics.callback("backend_db_writes_waiting", "Database writes waiting for the writer thread",
+                     lambda: db.writes_waiting)
+    metrics.callback("backend_db_write_batches_total", "Write transactions committed by the writer thread",
+                     lambda: db.write_batches, kind="counter")
+    metrics.callback("backend_db_batched_writes_total", "Database writes committed in those transactions",
+                     lambda: db.batched_writes, kind="counter")
+    metrics.latency("backend_db_query_seconds", "Duration of database cursor blocks", db_query_latency)
+    metrics.latency("backend_request_seconds", "Request latency by type and phase", latency)
+    lag_monitor.register(metrics, "backend")
+
+def print_latency_report():
+    print(latency.format_report("Backend request latency"))
 
 # --- Packet Handling ---
 
-def create_response_packet(client_id: str, status: str, message: str) -> bytes:
+# v1 framing, for callers that are not tied to a negotiated connection
+_V1_CODEC = EnvelopeCodec(PROTOCOL_V1)
+
+def create_response_packet(client_id: str, status: str, message: str, codec: EnvelopeCodec = _V1_CODEC) -> bytes:
     """Creates a wrapped RESPONSE packet to send back to the originating client via LB."""
     response_payload = json.dumps({
         "status": status,
         "message": message
     }).encode("utf-8")
+    return codec.encode(KIND_RESPONSE, client_id, response_payload)
 
-    client_id_bytes = client_id.encode("utf-8")
-    client_id_len = len(client_id_bytes)
-    server_response_wrapper_payload = struct.pack("!B", client_id_len) + client_id_bytes + response_payload
-    total_msg_len = len(server_response_wrapper_payload)
-    wrapped_response = struct.pack("!I", total_msg_len) + server_response_wrapper_payload
-    return wrapped_response
-
-def create_push_packet(target_client_id: str, payload: dict) -> bytes:
+def create_push_packet(target_client_id: str, payload: dict, codec: EnvelopeCodec = _V1_CODEC) -> bytes:
     """Creates a wrapped PUSH packet (notification, command, data) to send to a target client via LB."""
     push_payload_bytes = json.dumps(payload).encode("utf-8")
+    return codec.encode(KIND_PUSH, target_client_id, push_payload_bytes)
+
+def create_multicast_packet(target_client_ids: List[str], payload: dict, codec: EnvelopeCodec = _V1_CODEC) -> bytes:
+    """Creates one wrapped PUSH for several target clients; the payload is JSON-encoded once."""
+    push_payload_bytes = json.dumps(payload).encode("utf-8")
+    return codec.encode_multicast(target_client_ids, push_payload_bytes)
 
-    client_id_bytes = target_client_id.encode("utf-8")
-    client_id_len = len(client_id_bytes)
-    server_push_wrapper_payload = struct.pack("!B", client_id_len) + client_id_bytes + push_payload_bytes
-    total_msg_len = len(server_push_wrapper_payload)
-    wrapped_push_packet = struct.pack("!I", total_msg_len) + server_push_wrapper_payload
-    return wrapped_push_packet
+def create_control_packet(payload: dict, codec: EnvelopeCodec = _V1_CODEC) -> bytes:
+    """Creates a wrapped CONTROL packet for the Load Balancer itself."""
+    return codec.encode(KIND_CONTROL, None, json.dumps(payload).encode("utf-8"))
 
-async def send_push_to_client(writer: asyncio.StreamWriter, target_client_id: str, payload: dict):
+def handle_control_message(control_data: bytes, codec: EnvelopeCodec,
+                           writer: Optional[asyncio.StreamWriter] = None) -> Optional[bytes]:
+    """Handles a control frame from the Load Balancer. Returns the reply packet, if any."""
+    try:
+        control = json.loads(control_data)
+    except json.JSONDecodeError:
+        print("[!] Invalid control frame from LB (not JSON).")
+        return None
+    control_type = control.get("type")
+    if control_type == "ping":
+        # Health check: answering from the event loop proves it is not stuck
+        return create_control_packet({"type": "pong", "seq": control.get("seq")}, codec)
+    if control_type == "hello":
+        # Protocol negotiation: reply in the current version, then switch to the highest one both sides support
+        offered = control.get("versions") or [PROTOCOL_V1]
+        version = max(set(offered).intersection(SUPPORTED_VERSIONS), default=PROTOCOL_V1)
+        # Optional features (v2 only): the ones both sides listed
+        features = set(control.get("features") or []).intersection(SUPPORTED_FEATURES) if version >= PROTOCOL_V2 else set()
+        reply = create_control_packet({"type": "hello", "version": version, "features": sorted(features)}, codec)
+        codec.version = version
+        codec.features = frozenset(features)
+        print(f"[*] LB connection negotiated protocol v{version}" + (f" with {', '.join(sorted(features))}." if features else "."))
+        return reply
+    if control_type == "released":
+        # The LB drained this connection and is about to close it; no reply expected
+        released_connections.add(writer)
+        return None
+    if presence and presence.handle_control(control, writer):
+        return None # Client connect/disconnect notices; no reply expected
+    print(f"[!] Unknown control frame type '{control_type}' from LB.")
+    # Answer anyway so the LB is not left waiting on a reply that never comes
+    return create_control_packet({"status": "error", "message": f"Unknown control type: {control_type}"}, codec)
+
+async def write_to_lb(writer: asyncio.StreamWriter, packet: bytes, lock: Optional[asyncio.Lock] = None):
+    """Writes one frame to an LB connection.
+
+    Requests of different clients are handled concurrently on the same
+    connection. Each frame goes to the transport in a single write, so
+    frames never interleave; waiting for the buffer to drain happens under
+    the connection's lock, one task at a time.
+    """
+    writer.write(packet)
+    if lock is None:
+        await writer.drain()
+        return
+    async with lock:
+        await writer.drain()
+
+def send_load_report(report: dict):
+    """Sends a load report to every LB connection that asked for them in its hello."""
+    for writer, codec in list(lb_connections.items()):
+        if FEATURE_LOAD_REPORT in codec.features and not writer.is_closing():
+            packet = create_control_packet(report, codec)
+            writer.write(packet)
+            bytes_out.inc(len(packet))
+
+async def send_push_to_client(writer: asyncio.StreamWriter, target_client_id: str, payload: dict,
+                              codec: EnvelopeCodec = _V1_CODEC, lock: Optional[asyncio.Lock] = None):
     """Sends a push payload (notification, command, data) to a specific client via the Load Balancer."""
     try:
-        push_packet = create_push_packet(target_client_id, payload)
+        try:
+            push_packet = create_push_packet(target_client_id, payload, codec)
+        except ValueError:
+            # v2 ids are binary UUIDs; anything else cannot name a connected client (v1 would not route it either)
+            print(f"[!] Push target '{target_client_id}' is not a valid client id. Dropping push.")
+            push_failures.inc(labels=("invalid_target",))
+            return
         # print(f"[*] Sending push packet ({len(push_packet)} bytes) to LB for routing to client {target_client_id}")
-        writer.write(push_packet)
-        await writer.drain()
+        await write_to_lb(writer, push_packet, lock)
+        messages_out.inc(labels=("push", str(payload.get("type"))))
+        bytes_out.inc(len(push_packet))
         # print(f"[*] Successfully sent push packet for {target_client_id} to LB.")
     except ConnectionResetError:
         print(f"[!] Connection reset while trying to send push to LB (targeting {target_client_id}). LB might be down.")
+        push_failures.inc(labels=("error",))
         # Attempt to clean up the target client if possible? Difficult here.
         # db.unregister_client_by_id(target_client_id) # Risky without knowing user
         raise
     except Exception as e:
         print(f"[!] Error sending push packet for {target_client_id} to LB: {type(e).__name__} - {e}")
+        push_failures.inc(labels=("error",))
         raise
 
-# Type hint for the sender function to be passed to handlers
-PushSender = Callable[[str, dict], Awaitable[None]]
+async def send_multicast_to_clients(writer: asyncio.StreamWriter, target_client_ids: List[str], payload: dict,
+                                    codec: EnvelopeCodec = _V1_CODEC, lock: Optional[asyncio.Lock] = None):
+    """Sends the same push payload to several clients with one write to the Load Balancer."""
+    if not target_client_ids:
+        return
+    try:
+        multicast_packet = create_multicast_packet(target_client_ids, payload, codec)
+    except ValueError:
+        # At least one target is not a valid client id; send individually so only those are dropped
+        print(f"[!] Multicast target list contains invalid client ids. Sending {len(target_client_ids)} pushes individually.")
+        for target_client_id in target_client_ids:
+            await send_push_to_client(writer, target_client_id, payload, codec, lock)
+        return
+    try:
+        await write_to_lb(writer, multicast_packet, lock)
+        messages_out.inc(len(target_client_ids), ("push", str(payload.get("type"))))
+        bytes_out.inc(len(multicast_packet))
+    except ConnectionResetError:
+        print(f"[!] Connection reset while trying to send multicast to LB ({len(target_client_ids)} targets). LB might be down.")
+        push_failures.inc(len(target_client_ids), ("error",))
+        raise
+    except Exception as e:
+        print(f"[!] Error sending multicast packet for {len(target_client_ids)} targets to LB: {type(e).__name__} - {e}")
+        push_failures.inc(len(target_client_ids), ("error",))
+        raise
+
+class PushSender:
+    """Sends pushes over one LB connection; passed to the handlers as sender_func.
+
+    Calling it sends to one client. multicast() sends one payload to many
+    clients (e.g. everyone in a room) as a single frame.
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter, codec: EnvelopeCodec, lock: Optional[asyncio.Lock] = None):
+        self.writer = writer
+        self.codec = codec
+        self.lock = lock # Serializes drains of the connection's writer (see write_to_lb)
+
+    async def __call__(self, target_client_id: str, payload: dict):
+        if self.writer.is_closing():
+            print(f"[!] Attempted to send push via closed writer (targeting {target_client_id}).")
+            push_failures.inc(labels=("closed",))
+            return
+        await send_push_to_client(self.writer, target_client_id, payload, self.codec, self.lock)
+
+    async def multicast(self, target_client_ids: List[str], payload: dict):
+        if self.writer.is_closing():
+            print(f"[!] Attempted to send multicast via closed writer ({len(target_client_ids)} targets).")
+            push_failures.inc(len(target_client_ids), ("closed",))
+            return
+        await send_multicast_to_clients(self.writer, target_client_ids, payload, self.codec, self.lock)
+
+# Name the handlers use in their type hints
+NotificationSender = PushSender
+
+async def process_request(sender_func: PushSender, client_id: str, correlation_id: Optional[int],
+                          original_client_data: bytes, received_at: float):
+    """Runs one client request through its handler and sends the response. Called from the client's queue."""
+    codec = sender_func.codec
+
+    # 4. Process the original client data
+    response_packet = None # Default: No direct response needed unless specified by handler
+    request_type = None
+    db_time = [0.0]
+    db_time_token = _request_db_time.set(db_time)
+    handler_started = time.perf_counter()
+
+    try:
+        # One pass: JSON parsing and packet validation, the model picked by the "type" field
+        packet = parse_message(original_client_data)
+        request_type = packet.type
+        spec = HANDLERS.get(request_type)
+        handler_started = time.perf_counter()
+        if spec is None:
+            print(f"[!] Unknown request type '{request_type}' from client {client_id}")
+            response_packet = create_response_packet(client_id, "error", f"Unknown request type: {request_type}", codec)
+        else:
+            if spec.needs_sender:
+                status, message = await spec.handler(db, sender_func, client_id, packet)
+            else:
+                status, message = await spec.handler(db, client_id, packet)
+            if spec.responds:
+                response_packet = create_response_packet(client_id, status, message, codec)
+    except ValidationError as e:
+        error_kind, request_type = describe_error(e)
+        if error_kind == ERROR_NOT_JSON:
+            print(f"[!] Invalid JSON received from client {client_id}")
+            response_packet = create_response_packet(client_id, "error", "Invalid request format (not JSON)", codec)
+        elif error_kind == ERROR_UNKNOWN_TYPE:
+            print(f"[!] Unknown request type '{request_type}' from client {client_id}")
+            response_packet = create_response_packet(client_id, "error", f"Unknown request type: {request_type}", codec)
+        else:
+            spec = HANDLERS.get(request_type)
+            label = spec.label if spec else request_type
+            print(f"[!] Invalid {label} packet structure from client {client_id}: {e}")
+            response_packet = create_response_packet(client_id, "error", f"Invalid {label} data: {e}", codec)
+    except Exception as e:
+        print(f"[!] Unexpected error processing request for client {client_id}: {type(e).__name__} - {e}")
+        import traceback
+        traceback.print_exc()
+        response_packet = create_response_packet(client_id, "error", "Internal server error", codec)
+    finally:
+        _request_db_time.reset(db_time_token)
+    handler_finished = time.perf_counter()
+    type_label = request_type if isinstance(request_type, str) else "invalid"
+    messages_in.inc(labels=(type_label,))
+    latency.record(request_type, "queue", handler_started - received_at)
+    latency.record(request_type, "handler", handler_finished - handler_started)
+    latency.record(request_type, "db", db_time[0])
+
+    # 5. Send RESPONSE packet back (if one was generated)
+    if response_packet:
+        await send_response(sender_func, client_id, correlation_id, response_packet, type_label)
+        latency.record(request_type, "write", time.perf_counter() - handler_finished)
+
+async def send_response(sender_func: PushSender, client_id: str, correlation_id: Optional[int],
+                        response_packet: bytes, type_label: str):
+    """Sends a response to the LB, tagged with the request's correlation id if it had one."""
+    writer = sender_func.writer
+    if correlation_id is not None:
+        # Lets the LB match this response to its request
+        response_packet = add_correlation(response_packet, correlation_id)
+    if writer.is_closing():
+         print(f"[!] Writer closed before sending response to client {client_id}.")
+         return
+    try:
+        # print(f"[*] Sending response ({len(response_packet)} bytes) to LB for client {client_id}")
+        await write_to_lb(writer, response_packet, sender_func.lock)
+        messages_out.inc(labels=("response", type_label))
+        bytes_out.inc(len(response_packet))
+        # print(f"[*] Response sent to client {client_id}.")
+    except ConnectionResetError:
+         print(f"[!] Connection reset while sending response to client {client_id}.")
+    except Exception as e:
+         print(f"[!] Error sending response to client {client_id}: {type(e).__name__} - {e}")
+
+async def reject_request(sender_func: PushSender, client_id: str, correlation_id: Optional[int]):
+    """Answers a request the client's queue had no room for, in its place in the queue."""
+    print(f"[!] Too many pending requests from client {client_id}. Rejecting.")
+    response_packet = create_response_packet(client_id, "error", "Server busy: too many pending requests",
+                                             sender_func.codec)
+    await send_response(sender_func, client_id, correlation_id, response_packet, "rejected")
 
 async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
-    """Handles a single connection from the load balancer."""
+    """Handles a single connection from the load balancer.
+
+    Control frames are answered here, between reads. Client requests are
+    queued per client and run concurrently across clients (request_queues),
+    so the next frame is read while earlier requests are still being handled.
+    """
     peername = writer.get_extra_info("peername")
     print(f"[*] Accepted connection from {peername}")
-    client_id_on_this_connection: Optional[str] = None 
+    codec = EnvelopeCodec() # Starts on v1; the LB may negotiate v2 with a hello control frame
+    lb_connections[writer] = codec
 
-    # Create a sender function bound to the current writer for this connection
-    async def sender_func(target_client_id: str, payload: dict):
-        if writer.is_closing():
-            print(f"[!] Attempted to send push via closed writer (targeting {target_client_id}).")
-            return
-        await send_push_to_client(writer, target_client_id, payload)
+    # Create a sender bound to the current writer for this connection; its lock is shared by every write on it
+    sender_func = PushSender(writer, codec, asyncio.Lock())
 
     try:
         while True:
+            # Stop reading while the backlog is full: the LB then holds the requests instead
+            await request_queues.wait_for_space()
+
             # 1. Read length prefix
             len_data = await reader.readexactly(4)
             total_msg_len = struct.unpack("!I", len_data)[0]
 
             # 2. Read the wrapped message
             wrapped_message_data = await reader.readexactly(total_msg_len)
-
-            # 3. Parse wrapper: ClientID + Original Data
-            client_id_len = struct.unpack("!B", wrapped_message_data[:1])[0]
-            client_id_end = 1 + client_id_len
-            client_id = wrapped_message_data[1:client_id_end].decode("utf-8")
-            original_client_data = wrapped_message_data[client_id_end:]
+            received_at = time.perf_counter()
+            bytes_in.inc(4 + total_msg_len)
+
+            # 3. Parse wrapper: ClientID + Original Data (+ the LB's correlation id, if it sent one)
+            kind, flags, client_id, original_client_data = codec.decode(wrapped_message_data)
+            correlation_id, original_client_data = split_correlation(flags, original_client_data)
+
+            if kind == KIND_CONTROL:
+                # Control frames come from the LB itself, not a client
+                control_reply = handle_control_message(original_client_data, codec, writer)
+                if control_reply and not writer.is_closing():
+                    bytes_out.inc(len(control_reply))
+                    await write_to_lb(writer, control_reply, sender_func.lock)
+                continue
             
-            client_id_on_this_connection = client_id
-            print(f"[*] Received data from LB for client 	'{client_id}': {original_client_data.decode('utf-8', errors='ignore')}")
-
-            # 4. Process the original client data
-            response_packet = None # Default: No direct response needed unless specified by handler
-            
-            try:
-                request_json = original_client_data.decode("utf-8")
-                request_data = json.loads(request_json)
-                request_type = request_data.get("type")
-
-                # --- Request Routing --- #
-
-                if request_type == "login":
-                    try:
-                        login_packet = PacketLogin.model_validate(request_data)
-                        # handle_login performs authentication against DB users table
-                        status, message = await handle_login(db, client_id, login_packet)
-                        if status == "success":
-                            # Register the client mapping in the DB upon successful login
-                            # This now uses the database method
-                            if not db.register_client(login_packet.username, client_id):
-                                # Handle potential DB error during registration
-                                print(f"[!] Failed to register client 	'{login_packet.username}' in DB.")
-                                # Optionally change status/message, but login itself succeeded
-                                # status = "error"
-                                # message = "Login successful, but failed to update session state."
-                                pass # Continue for now
-                        response_packet = create_response_packet(client_id, status, message)
-                    except ValidationError as e:
-                        print(f"[!] Invalid login packet structure from client {client_id}: {e}")
-                        response_packet = create_response_packet(client_id, "error", f"Invalid login data: {e}")
-
-                elif request_type == "create_room":
-                    try:
-                        create_room_packet = PacketCreateRoom.model_validate(request_data)
-                        status, message = await handle_create_room(db, client_id, create_room_packet)
-                        response_packet = create_response_packet(client_id, status, message)
-                    except ValidationError as e:
-                        print(f"[!] Invalid create room packet structure from client {client_id}: {e}")
-                        response_packet = create_response_packet(client_id, "error", f"Invalid create room data: {e}")
-
-                elif request_type == "logout":
-                    try:
-                        print("++++++++LOGOUT++++++++++++++")
-                        logout_packet = PacketLogout.model_validate(request_data)
-                        # handle_logout might perform DB checks (e.g., leave rooms)
-                        status, message = await handle_logout(db, client_id, logout_packet)
-                        if status == "success":
-                             # Unregister the client mapping from the DB upon successful logout
-                             if not db.unregister_client(logout_packet.teacher):
-                                 print(f"[!] Failed to unregister client 	'{logout_packet.teacher}' from DB.")
-                                 # Logout succeeded, but cleanup failed. Log and continue.
-                        response_packet = create_response_packet(client_id, status, message)
-                    except ValidationError as e:
-                        print(f"[!] Invalid log out packet structure from client {client_id}: {e}")
-                        response_packet = create_response_packet(client_id, "error", f"Invalid logout data: {e}")
-
-
-
-                elif request_type == "join_room":
-                    try:
-                        print("++++++++JOIN_ROOM++++++++++++++")
-                        joinroom_packet = PacketJoinRoom.model_validate(request_data)
-                        status, message = await handle_joinroom(db, client_id, joinroom_packet)
-                        response_packet = create_response_packet(client_id, status, message)
-                    except ValidationError as e:
-                        print(f"[!] Invalid join room packet structure from client {client_id}: {e}")
-                        response_packet = create_response_packet(client_id, "error", f"Invalid join room data: {e}")
-
-
-
-
-
-                elif request_type == "refresh":
-                    try:
-                        print("++++++++REFRESH++++++++++++++")
-                        refresh_packet = PacketRefresh.model_validate(request_data)
-                        status, message = await handle_refresh(db, client_id, refresh_packet)
-                        response_packet = create_response_packet(client_id, status, message)
-                    except ValidationError as e:
-                        print(f"[!] Invalid refresh packet structure from client {client_id}: {e}")
-                        response_packet = create_response_packet(client_id, "error", f"Invalid refresh data: {e}")
-
-
-
-                elif request_type == "notify":
-                    try:
-                        notify_packet = PacketNotify.model_validate(request_data)
-                        # handle_notify sends pushes via sender_func, returns status to original sender
-                        status, message = await handle_notify(db, sender_func, client_id, notify_packet)
-                        response_packet = create_response_packet(client_id, status, message)
-                    except ValidationError as e:
-                        response_packet = create_response_packet(client_id, "error", f"Invalid notify data: {e}")
-
-
-
-                elif request_type == "streaming": # Request to start streaming
-                    try:
-                        print("++++++++STREAMING REQUEST++++++++++++++")
-                        streaming_packet = PacketStreaming.model_validate(request_data)
-                        # handle_streaming_request sends a push to target, returns status to initiator
-                        status, message = await handle_streaming_request(db, sender_func, client_id, streaming_packet)
-                        response_packet = create_response_packet(client_id, status, message)
-                    except ValidationError as e:
-                        print(f"[!] Invalid streaming request packet structure from client {client_id}: {e}")
-                        response_packet = create_response_packet(client_id, "error", f"Invalid streaming request data: {e}")
-                  
-                elif request_type == "screen_data":
-                    try:
-                        print("++++++++SCREEN DATA RECEIVED++++++++++++++")
-                        screen_data_packet = PacketScreenData.model_validate(request_data)
-
-                        status, message = await handle_screen_data(db, sender_func, client_id, screen_data_packet)
-                        response_packet = create_response_packet(client_id, status, message)
-                    except ValidationError as e:
-                        print(f"[!] Invalid request screen data structure from client {client_id}: {e}")
-                        response_packet = create_response_packet(client_id, "error", f"Invalid request app data: {e}")
-                
-                
-                
-                
-                elif request_type == "request_app":
-                    try:
-                        print("++++++++REQUEST APP DATA++++++++++++++")
-                        packet_request_app = PacketRequestApp.model_validate(request_data)
-                        status, message = await handle_app_request(db, sender_func, client_id, packet_request_app)
-                    except ValidationError as e:
-                        print(f"[!] Invalid request app packet structure from client {client_id}: {e}")
-                        response_packet = create_response_packet(client_id, "error", f"Invalid request app data: {e}")
-                
-                
-                elif request_type == "return_app":
-                    try:
-                        print("++++++++RETURN APP DATA++++++++++++++")
-                        packet_return_app = PacketReturnApp.model_validate(request_data)
-                        status, message = await handle_app_return(db, sender_func, client_id, packet_return_app)
-                        response_packet = create_response_packet(client_id, status, message)
-                    except ValidationError as e:
-                        print(f"[!] Invalid return app packet structure from client {client_id}: {e}")
-                        response_packet = create_response_packet(client_id, "error", f"Invalid return app data: {e}")
-                
-                else:
-         
-                  
-                    print(f"[!] Unknown request type 	'{request_type}' from client {client_id}")
-                    response_packet = create_response_packet(client_id, "error", f"Unknown request type: {request_type}")
-
-            except json.JSONDecodeError:
-                print(f"[!] Invalid JSON received from client {client_id}")
-                response_packet = create_response_packet(client_id, "error", "Invalid request format (not JSON)")
-            except Exception as e:
-                print(f"[!] Unexpected error processing request for client {client_id}: {type(e).__name__} - {e}")
-                import traceback
-                traceback.print_exc()
-                response_packet = create_response_packet(client_id, "error", "Internal server error")
-
-            # 5. Send RESPONSE packet back (if one was generated)
-            if response_packet:
-                if writer.is_closing():
-                     print(f"[!] Writer closed before sending response to client {client_id}.")
-                else:
-                    try:
-                        # print(f"[*] Sending response ({len(response_packet)} bytes) to LB for client {client_id}")
-                        writer.write(response_packet)
-                        await writer.drain()
-                        # print(f"[*] Response sent to client {client_id}.")
-                    except ConnectionResetError:
-                         print(f"[!] Connection reset while sending response to client {client_id}.")
-                    except Exception as e:
-                         print(f"[!] Error sending response to client {client_id}: {type(e).__name__} - {e}")
+            presence.seen(client_id, writer)
+            request_label = f"request #{correlation_id} " if correlation_id is not None else ""
+            print(f"[*] Received {request_label}data from LB for client 	'{client_id}': {original_client_data.decode('utf-8', errors='ignore')}")
+
+            # 4./5. Handled and answered in order with the client's other requests, under the limit of the
+            # handler's concurrency class; only the type is read here, the request is parsed by process_request
+            request_type = peek_request_type(original_client_data)
+            spec = HANDLERS.get(request_type)
+            request_queues.submit(
+                client_id,
+                functools.partial(process_request, sender_func, client_id, correlation_id,
+                                  original_client_data, received_at),
+                functools.partial(reject_request, sender_func, client_id, correlation_id),
+                concurrency=spec.concurrency if spec else None,
+                droppable=request_type if spec and spec.droppable else None)
 
     # --- Connection Cleanup --- 
     except asyncio.IncompleteReadError:
@@ -293,14 +451,19 @@ async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.Stream
         traceback.print_exc()
     finally:
         print(f"[*] Closing connection from {peername}.")
-        # Attempt DB cleanup using the last known client_id for this connection
-        if client_id_on_this_connection:
-            print(f"[*] Attempting DB cleanup for client_id 	'{client_id_on_this_connection}' on disconnect.")
-            if db: # Ensure db is initialized
-                db.unregister_client_by_id(client_id_on_this_connection)
+        lb_connections.pop(writer, None)
+        released = writer in released_connections
+        released_connections.discard(writer)
+        # Clients that came through this connection are removed when the LB reports them
+        # gone, or after a grace period if the LB does not come back for them. Not after
+        # a drain: the LB closes drained connections on purpose and their clients stay
+        # logged in, served by the other backends.
+        if presence:
+            if draining or released:
+                presence.link_released(writer)
             else:
-                 print(f"[!] DB not available for cleanup of client_id 	'{client_id_on_this_connection}'.")
-                 
+                presence.link_lost(writer)
+
         # Close the writer stream
         if writer.can_write_eof():
             try: writer.write_eof()
@@ -310,18 +473,72 @@ async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.Stream
             await writer.wait_closed()
         except Exception as e: print(f"[!] Error during writer close for {peername}: {e}")
 
-async def main(host, port):
+async def drain_and_stop(server: asyncio.AbstractServer, drain_timeout: float, stopped: asyncio.Event):
+    """Graceful shutdown: stop accepting, tell every LB to stop sending new requests, and wait for them to let go."""
+    global draining
+    if draining:
+        return
+    draining = True
+    print(f"[*] Draining: telling {len(lb_connections)} Load Balancer connection(s) to stop sending new requests.")
+    server.close() # No new LB connections; the ones open keep working
+    for writer, codec in list(lb_connections.items()):
+        if not writer.is_closing():
+            writer.write(create_control_packet({"type": "draining"}, codec))
+    # Each LB closes its connections once the requests in flight here are answered
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + drain_timeout
+    while lb_connections and loop.time() < deadline:
+        await asyncio.sleep(0.2)
+    if lb_connections:
+        print(f"[!] Drain timeout: {len(lb_connections)} Load Balancer connection(s) still open. Stopping anyway.")
+    else:
+        print("[*] Drained: all Load Balancer connections closed.")
+    stopped.set()
+
+async def start_metrics_server(metrics_host: str, metrics_port: int):
+    """Starts the metrics listener and the loop lag probe. The server keeps running without them if the port is taken."""
+    lag_monitor = LoopLagMonitor()
+    register_metrics(lag_monitor)
+    metrics_server = MetricsServer(metrics, metrics_host, metrics_port)
+    try:
+        addr = await metrics_server.start()
+    except OSError as e:
+        print(f"[!] Could not start metrics listener on {metrics_host}:{metrics_port}: {e}")
+        return None
+    lag_monitor.start()
+    print(f"[*] Metrics available at http://{addr[0]}:{addr[1]}/metrics")
+    return metrics_server
+
+async def main(host, port, drain_timeout=30.0, link_grace=DEFAULT_LINK_GRACE, metrics_port=0, metrics_host="127.0.0.1",
+               load_report_interval=DEFAULT_REPORT_INTERVAL, max_concurrent=DEFAULT_MAX_CONCURRENT,
+               max_backlog=DEFAULT_MAX_BACKLOG, max_client_backlog=DEFAULT_MAX_PER_CLIENT, auth_workers=None,
+               auth_queue=DEFAULT_AUTH_QUEUE, db_readers=DEFAULT_READERS):
     """Main function to start the server."""
-    global db
+    global db, presence, load_reporter, request_queues, password_verifier
     script_dir = os.path.dirname(os.path.abspath(__file__))
     db_path = os.path.join(script_dir, "database", "classroom.db")
     print(f"[*] Using database at: {db_path}")
     try:
-        db = ClassroomDatabase(db_path=db_path)
+        sync_db = ClassroomDatabase(db_path=db_path)
+        db = AsyncClassroomDatabase(sync_db, readers=db_readers)
+        db.on_cursor_time = db_query_latency.record
+        db.on_query_time = _add_db_time
         print("[*] Database connection established.")
+        presence = ClientPresence(db, link_grace=link_grace)
     except Exception as e:
         print(f"[!] CRITICAL: Failed to initialize database connection: {e}", file=sys.stderr)
         sys.exit(1)
+    if auth_workers != 0:
+        password_verifier = PasswordVerifier(auth_workers, auth_queue)
+        await password_verifier.start()
+        db.password_verifier = password_verifier
+        print(f"[*] Password checks run in {password_verifier.workers} worker process(es), "
+              f"at most {auth_queue} waiting.")
+    # Logins run under a limit of their own: as many as the password checks can take (pool or reader threads)
+    cpu_limit = password_verifier.workers + auth_queue if password_verifier else db_readers
+    request_queues = ClientRequestQueues(max_concurrent, max_backlog, max_client_backlog,
+                                         limits={CONCURRENCY_CPU: cpu_limit})
+    presence.request_queues = request_queues
 
     try:
         server = await asyncio.start_server(handle_connection, host, port)
@@ -332,9 +549,34 @@ async def main(host, port):
     addr = server.sockets[0].getsockname()
     print(f"[*] Server listening on {addr}")
     print("[*] Ready to accept connections from Load Balancer.")
+    if metrics_port:
+        await start_metrics_server(metrics_host, metrics_port)
+    if load_report_interval > 0:
+        load_reporter = LoadReporter(send_load_report, load_report_interval)
+        load_reporter.sources["pending"] = lambda: request_queues.pending
+        if password_verifier:
+            load_reporter.sources["executor_queue"] = lambda: password_verifier.waiting
+        load_reporter.start()
+
+    # SIGTERM drains before exiting (rolling restarts); Ctrl+C still stops at once
+    stopped = asyncio.Event()
+    try:
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(
+            signal.SIGTERM, lambda: asyncio.create_task(drain_and_stop(server, drain_timeout, stopped)))
+        # SIGUSR1 prints the request latency histograms
+        loop.add_signal_handler(signal.SIGUSR1, print_latency_report)
+    except (NotImplementedError, AttributeError):
+        pass # No loop signal handlers (or SIGUSR1) on Windows
 
-    async with server:
-        await server.serve_forever()
+    try:
+        async with server:
+            await stopped.wait()
+        print("[*] Server stopped after draining.")
+    finally:
+        if password_verifier:
+            password_verifier.close()
+        db.close()
 
 def register_with_load_balancer(host, port):
     # (Keep existing registration logic)
@@ -381,15 +623,53 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Classroom Backend Server (Multi-Server Ready)")
     parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to bind the server to (default: 127.0.0.1)")
     parser.add_argument("--port", type=int, required=True, help="Port to bind the server to")
+    parser.add_argument("--loop", choices=LOOP_CHOICES, default=LOOP_AUTO,
+                        help="Event loop implementation; 'auto' uses uvloop/winloop when installed (default: auto)")
+    parser.add_argument("--drain-timeout", type=float, default=30.0,
+                        help="On SIGTERM, longest wait for the Load Balancer to finish with this server (default: 30)")
+    parser.add_argument("--link-grace", type=float, default=DEFAULT_LINK_GRACE,
+                        help="Seconds the clients of a broken LB connection are kept before being "
+                             f"removed from active_clients, unless the LB reports them again (default: {DEFAULT_LINK_GRACE:g})")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="Serve Prometheus metrics at http://<metrics-host>:<port>/metrics (default: off)")
+    parser.add_argument("--metrics-host", type=str, default="127.0.0.1",
+                        help="Address the metrics listener binds to (default: 127.0.0.1)")
+    parser.add_argument("--load-report-interval", type=float, default=DEFAULT_REPORT_INTERVAL,
+                        help="Seconds between load reports (loop lag, pending requests) sent to the Load Balancers "
+                             f"for their backend selection; 0 disables (default: {DEFAULT_REPORT_INTERVAL:g})")
+    parser.add_argument("--max-concurrent", type=int, default=DEFAULT_MAX_CONCURRENT,
+                        help="Requests handled at the same time, across all clients; logins have a limit of their own, "
+                             f"--auth-queue plus the auth workers (default: {DEFAULT_MAX_CONCURRENT})")
+    parser.add_argument("--max-backlog", type=int, default=DEFAULT_MAX_BACKLOG,
+                        help="Queued requests at which the server stops reading from the Load Balancers "
+                             f"(default: {DEFAULT_MAX_BACKLOG})")
+    parser.add_argument("--max-client-backlog", type=int, default=DEFAULT_MAX_PER_CLIENT,
+                        help="Queued requests per client; further ones are answered with a 'server busy' error "
+                             f"(default: {DEFAULT_MAX_PER_CLIENT})")
+    parser.add_argument("--auth-workers", type=int, default=None,
+                        help="Worker processes for login password checks; 0 checks them on the event loop "
+                             "(default: one per CPU core)")
+    parser.add_argument("--auth-queue", type=int, default=DEFAULT_AUTH_QUEUE,
+                        help="Password checks that may wait for a worker; logins past that are refused as busy "
+                             f"(default: {DEFAULT_AUTH_QUEUE})")
+    parser.add_argument("--db-readers", type=int, default=DEFAULT_READERS,
+                        help=f"Threads running database reads; writes have one thread of their own (default: {DEFAULT_READERS})")
+    parser.add_argument("--no-register", action="store_true",
+                        help="Do not add this server to loadbalancer/servers.json (e.g. for benchmarks)")
     args = parser.parse_args()
     host = args.host
     port = args.port
     
     # setup_logger()
-    register_with_load_balancer(host, port)
+    if not args.no_register:
+        register_with_load_balancer(host, port)
 
+    print(f"[*] Event loop: {install_event_loop(args.loop)}")
     try:
-        asyncio.run(main(host, port))
+        asyncio.run(main(host, port, args.drain_timeout, args.link_grace, args.metrics_port, args.metrics_host,
+                         args.load_report_interval, args.max_concurrent, args.max_backlog,
+                         args.max_client_backlog, args.auth_workers, args.auth_queue,
+                         args.db_readers))
     except KeyboardInterrupt:
         print("\n[*] Server shutting down gracefully.")
     except Exception as e:
@@ -1,2 +1,2 @@
 from .logger import setup_logger
-from .parser import parse_message
+from .parser import make_message_parser, describe_error
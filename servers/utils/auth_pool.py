@@ -0,0 +1,84 @@
+"""Password verification off the event loop.
+
+bcrypt.checkpw is deliberately slow (about 200-300 ms at the default cost)
+and, run inline, stalls every request on the backend for that long. The
+PasswordVerifier runs it in a dedicated process pool instead, one worker
+per core by default.
+
+The queue in front of the workers is bounded: once `max_queue` checks are
+waiting for a worker, verify() raises AuthQueueFull straight away instead of
+queueing more. A login burst then costs its tail a quick "busy, try again"
+rather than a wait of many seconds, and the backlog cannot grow without bound.
+"""
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import bcrypt
+
+DEFAULT_AUTH_QUEUE = 64
+
+
+class AuthQueueFull(Exception):
+    """Raised by PasswordVerifier.verify when too many checks are already waiting."""
+
+
+def _checkpw(password: bytes, hashed: bytes) -> bool:
+    # Runs in a worker process; module level so it can be pickled
+    return bcrypt.checkpw(password, hashed)
+
+
+def _warm_up() -> None:
+    pass
+
+
+class PasswordVerifier:
+    def __init__(self, workers: Optional[int] = None, max_queue: int = DEFAULT_AUTH_QUEUE):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.in_flight = 0 # Checks submitted and not finished, running or waiting
+        self.completed = 0 # Checks finished, whatever their outcome
+        self.verified = 0 # Checks that found the password correct
+        self.failed = 0 # Checks that found it wrong
+        self.errors = 0 # Checks that raised (e.g. a malformed hash, a dead worker)
+        self.rejected = 0 # Checks refused because the queue was full
+
+    @property
+    def waiting(self) -> int:
+        """Checks waiting for a free worker."""
+        return max(0, self.in_flight - self.workers)
+
+    async def start(self):
+        """Starts the worker processes now rather than on the first login."""
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        await asyncio.get_running_loop().run_in_executor(self._executor, _warm_up)
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        """Checks a password against its bcrypt hash in the pool. Raises AuthQueueFull if the queue is full."""
+        if self.in_flight >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise AuthQueueFull(f"{self.waiting} password checks already waiting")
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.in_flight += 1
+        try:
+            ok = await asyncio.get_running_loop().run_in_executor(
+                self._executor, _checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+        if ok:
+            self.verified += 1
+        else:
+            self.failed += 1
+        return ok
@@ -0,0 +1,209 @@
+"""Concurrent request processing across clients, strictly in order within each client.
+
+Every client routed to a backend shares one LB connection, so handling
+requests one after the other lets a single slow request (a login hashing its
+password, a large screen_data push) hold up every other classroom on that
+backend. Here each client gets its own FIFO and a worker task that exists
+only while the FIFO has work; workers of different clients run
+concurrently, up to max_concurrent at a time. A job may name a
+concurrency class with a limit of its own (`limits`, e.g. the CPU-bound
+logins, as many as the password check pool can hold); it then runs under
+that limit instead, so logins queued for the pool do not take the slots of
+database and relay requests, and the other way round.
+
+Requests marked droppable (screen frames) are the first to go: a newer one
+of the same type replaces one still queued right before it, and when the
+client's queue is full the oldest queued droppable request is shed to make
+room. A replaced or shed request is answered with its reject in its place,
+like a rejected one.
+
+The backlog is bounded twice over:
+  - per client: past max_per_client accepted requests waiting, further ones
+    from that client are rejected. Consecutive rejections share one job in
+    the FIFO that answers them all with an error, in order with the
+    client's other responses; past max_per_client answers owed, rejected
+    requests are dropped unanswered (the LB times them out). A client
+    flooding the backend therefore costs a bounded amount of memory and
+    does not count towards the total below;
+  - in total: past max_backlog accepted requests waiting, the LB
+    connection's reader waits before reading more (wait_for_space), which
+    pushes back on the LB.
+"""
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+Job = Callable[[], Awaitable[None]]
+
+DEFAULT_MAX_CONCURRENT = 64
+DEFAULT_MAX_BACKLOG = 4096
+DEFAULT_MAX_PER_CLIENT = 64
+
+
+class _Entry:
+    __slots__ = ("job", "reject", "counted", "droppable", "slots", "shed")
+
+    def __init__(self, job: Optional[Job], reject: Optional[Job], counted: bool, slots: asyncio.Semaphore,
+                 droppable: Optional[str] = None):
+        self.job = job # None once the request was shed
+        self.reject = reject
+        self.counted = counted # An accepted request, counting towards the backlog
+        self.slots = slots # The concurrency limit the job runs under
+        self.droppable = droppable # Type a newer request may replace this one with, if droppable
+        self.shed: Optional[List[Job]] = None # Answers of requests shed in this place, sent before the job
+
+
+class _ClientQueue:
+    __slots__ = ("jobs", "waiting", "owed", "tail_rejects")
+
+    def __init__(self):
+        self.jobs: Deque[_Entry] = deque() # Oldest first
+        self.waiting = 0 # Accepted requests not started yet
+        self.owed = 0 # Rejected requests whose error answer is still queued
+        self.tail_rejects: Optional[List[Job]] = None # Answers of the reject job at the end of `jobs`, if it is last
+
+
+class ClientRequestQueues:
+    def __init__(self, max_concurrent: int = DEFAULT_MAX_CONCURRENT, max_backlog: int = DEFAULT_MAX_BACKLOG,
+                 max_per_client: int = DEFAULT_MAX_PER_CLIENT, limits: Optional[Dict[str, int]] = None):
+        self.max_concurrent = max_concurrent
+        self.max_backlog = max_backlog
+        self.max_per_client = max_per_client
+        self._queues: Dict[str, _ClientQueue] = {} # Map: client_id -> its queue, while it has work
+        self._slots = asyncio.Semaphore(max_concurrent)
+        # Map: concurrency class -> its own limit; classes not listed share max_concurrent
+        self._limits = {name: asyncio.Semaphore(limit) for name, limit in (limits or {}).items()}
+        self._space = asyncio.Event()
+        self._space.set()
+        self.queued = 0 # Accepted requests waiting in the queues
+        self.running = 0 # Jobs started and not finished
+        self.rejected = 0 # Requests answered with an error because their client's queue was full
+        self.dropped = 0 # Requests rejected or shed while their client already had max_per_client answers owed
+        self.shed = 0 # Droppable requests replaced by a newer one or shed to make room
+
+    @property
+    def pending(self) -> int:
+        return self.queued + self.running
+
+    @property
+    def clients(self) -> int:
+        return len(self._queues)
+
+    def has_pending(self, client_id: str) -> bool:
+        """Whether the client has jobs queued or running."""
+        return client_id in self._queues
+
+    async def wait_for_space(self):
+        """Waits until the total backlog is below max_backlog."""
+        while self.queued >= self.max_backlog:
+            self._space.clear()
+            await self._space.wait()
+
+    def _queue(self, client_id: str) -> _ClientQueue:
+        queue = self._queues.get(client_id)
+        if queue is None:
+            queue = self._queues[client_id] = _ClientQueue()
+            asyncio.create_task(self._run(client_id, queue), name=f"ClientQueue-{client_id}")
+        return queue
+
+    def submit(self, client_id: str, job: Job, reject: Job, concurrency: Optional[str] = None,
+               droppable: Optional[str] = None) -> bool:
+        """Queues a job behind the client's earlier ones. Queues `reject` in its place if the client's queue is full.
+
+        concurrency: the job's concurrency class, for its limit (see `limits`).
+        droppable: the request's type, if only the newest request of that type matters.
+        Returns False if the job was rejected.
+        """
+        queue = self._queue(client_id)
+        if droppable is not None and queue.jobs:
+            tail = queue.jobs[-1]
+            if tail.counted and tail.droppable == droppable:
+                # Nothing was queued after the older one: the newer one takes its place
+                self._shed(queue, tail)
+                tail.job, tail.reject = job, reject
+                return True
+        if queue.waiting >= self.max_per_client:
+            victim = next((entry for entry in queue.jobs if entry.counted and entry.droppable is not None), None)
+            if victim is not None:
+                self._shed(queue, victim)
+                victim.job = victim.reject = None
+                victim.counted = False
+                queue.waiting -= 1
+                self.queued -= 1
+        if queue.waiting < self.max_per_client:
+            queue.jobs.append(_Entry(job, reject, True, self._limits.get(concurrency, self._slots), droppable))
+            queue.tail_rejects = None
+            queue.waiting += 1
+            self.queued += 1
+            return True
+        self.rejected += 1
+        if queue.owed >= self.max_per_client:
+            self.dropped += 1
+        elif queue.tail_rejects is not None:
+            # Nothing was queued since the last rejection: answer both from the same job
+            queue.tail_rejects.append(reject)
+            queue.owed += 1
+        else:
+            queue.tail_rejects = [reject]
+            queue.jobs.append(_Entry(self._answer_rejects(queue, queue.tail_rejects), None, False, self._slots))
+            queue.owed += 1
+        return False
+
+    def _shed(self, queue: _ClientQueue, entry: _Entry):
+        """Answers a queued droppable request with its reject, in its place, instead of running it."""
+        self.shed += 1
+        if queue.owed >= self.max_per_client:
+            self.dropped += 1
+            return
+        if entry.shed is None:
+            entry.shed = []
+        entry.shed.append(entry.reject)
+        queue.owed += 1
+
+    def run_after(self, client_id: str, job: Job):
+        """Runs a job once the client's jobs queued so far have finished; at once if it has none.
+
+        For bookkeeping that must not overtake the client's requests (e.g. its
+        disconnect). Not subject to the per-client limit.
+        """
+        queue = self._queue(client_id)
+        queue.jobs.append(_Entry(job, None, False, self._slots))
+        queue.tail_rejects = None
+
+    def _answer_rejects(self, queue: _ClientQueue, rejects: List[Job]) -> Job:
+        async def answer():
+            if queue.tail_rejects is rejects:
+                queue.tail_rejects = None # Started: later rejections need a job of their own
+            queue.owed -= len(rejects)
+            for reject in rejects:
+                await reject()
+        return answer
+
+    async def _run(self, client_id: str, queue: _ClientQueue):
+        try:
+            while queue.jobs:
+                entry = queue.jobs[0] # Stays first while waiting for a slot; only its fields may change
+                async with entry.slots:
+                    queue.jobs.popleft()
+                    if entry.counted:
+                        queue.waiting -= 1
+                        self.queued -= 1
+                    if self.queued < self.max_backlog:
+                        self._space.set()
+                    if entry.shed:
+                        queue.owed -= len(entry.shed)
+                    self.running += 1
+                    try:
+                        for reject in entry.shed or ():
+                            await reject()
+                        if entry.job is not None:
+                            await entry.job()
+                    except Exception as e:
+                        print(f"[!] Request of client {client_id} failed: {type(e).__name__} - {e}")
+                    finally:
+                        self.running -= 1
+        finally:
+            # Nothing is queued between the last check and here (no await), so the queue can go
+            if self._queues.get(client_id) is queue:
+                del self._queues[client_id]
+            self.queued -= queue.waiting # Only non-zero if the task was cancelled
@@ -0,0 +1,197 @@
+"""Framing of messages between the Load Balancer and backend servers.
+
+v1: [4-byte length][1-byte client id length][client id, UTF-8][payload]
+v2: [4-byte length][1-byte kind][1-byte flags][16-byte client id][payload]
+v2 multicast (backend -> LB, client id all zeros):
+    [4-byte length][1-byte kind][1-byte flags][16 zero bytes][2-byte target count][16-byte id per target][payload]
+
+The length covers everything after itself. v2 carries the client id (always
+a UUID, generated by the LB) in binary and says what kind of message it is,
+so neither side has to encode or decode id strings per message. Every
+connection starts on v1; the LB offers v2 with a "hello" control frame and
+both sides switch once the backend accepts. Backends that predate v2 answer
+the hello with an error and the connection simply stays on v1.
+
+A multicast frame carries one payload for many clients (e.g. a room-wide
+notification), so the backend encodes and sends it once and the LB fans it
+out. v1 has no multicast: the payload is repeated in one push per target.
+
+Correlation ids (v2, when both sides list "correlation" in their hellos):
+a request with FLAG_CORRELATED carries a 4-byte id between the header and
+the payload, and the backend's response to it repeats the flag and the id.
+The LB uses it to match each response to its request exactly, e.g. to time
+requests per message type.
+
+Load reports (when both sides list "load_report"): the backend periodically
+sends a load_report control frame saying how busy it is (see
+utils/loadreport.py).
+"""
+import struct
+import uuid
+from typing import List, Optional, Tuple
+
+PROTOCOL_V1 = 1
+PROTOCOL_V2 = 2
+SUPPORTED_VERSIONS = (PROTOCOL_V1, PROTOCOL_V2)
+
+# Message kinds (v2). v1 frames only distinguish control frames (empty id) from the rest.
+KIND_REQUEST = 1  # LB -> backend: a client's message
+KIND_RESPONSE = 2 # backend -> LB: the answer to a client's message
+KIND_PUSH = 3     # backend -> LB: an unsolicited message for a client
+KIND_CONTROL = 4  # Between the LB and the backend themselves; the client id is all zeros
+KIND_MULTICAST = 5 # backend -> LB: one unsolicited message for several clients
+
+FLAG_NONE = 0 # Receivers must ignore bits they do not know
+FLAG_CORRELATED = 0x01 # A correlation id precedes the payload
+
+# Optional features a hello can list; each side uses the ones both listed
+FEATURE_CORRELATION = "correlation"
+FEATURE_LOAD_REPORT = "load_report"
+SUPPORTED_FEATURES = (FEATURE_CORRELATION, FEATURE_LOAD_REPORT)
+
+V2_HEADER = struct.Struct("!IBB16s")
+V2_HEADER_SIZE = V2_HEADER.size - 4 # Header bytes counted in the length field
+CONTROL_ID = bytes(16)
+
+CORRELATION_ID = struct.Struct("!I")
+MAX_CORRELATION_ID = 0xFFFFFFFF
+
+MULTICAST_COUNT = struct.Struct("!H")
+MAX_MULTICAST_TARGETS = 0xFFFF # Larger target lists are split over several frames
+
+_ID_CACHE_LIMIT = 65536
+
+
+def client_id_to_wire(client_id: str) -> bytes:
+    return uuid.UUID(client_id).bytes
+
+
+def client_id_from_wire(wire_id: bytes) -> str:
+    return str(uuid.UUID(bytes=wire_id))
+
+
+def header_v1(client_id_bytes: bytes, payload_len: int) -> bytes:
+    """Everything in a v1 frame before the payload, for writers that send the payload separately."""
+    return struct.pack("!IB", len(client_id_bytes) + 1 + payload_len, len(client_id_bytes)) + client_id_bytes
+
+
+def header_v2(kind: int, wire_id: bytes, payload_len: int, flags: int = FLAG_NONE) -> bytes:
+    """Everything in a v2 frame before the payload, for writers that send the payload separately."""
+    return V2_HEADER.pack(V2_HEADER_SIZE + payload_len, kind, flags, wire_id)
+
+
+def pack_v1(client_id_bytes: bytes, payload: bytes) -> bytes:
+    return header_v1(client_id_bytes, len(payload)) + payload
+
+
+def pack_v2(kind: int, wire_id: bytes, payload: bytes, flags: int = FLAG_NONE) -> bytes:
+    return header_v2(kind, wire_id, len(payload), flags) + payload
+
+
+def split_correlation(flags: int, payload) -> Tuple[Optional[int], bytes]:
+    """Takes the correlation id off a payload if the flags say it has one. Returns (id or None, payload)."""
+    if flags & FLAG_CORRELATED and len(payload) >= CORRELATION_ID.size:
+        return CORRELATION_ID.unpack_from(payload)[0], payload[CORRELATION_ID.size:]
+    return None, payload
+
+
+def add_correlation(frame: bytes, correlation_id: int) -> bytes:
+    """Adds a correlation id to a v2 frame packed without one (e.g. a response built before the id was at hand)."""
+    length, kind, flags, wire_id = V2_HEADER.unpack_from(frame)
+    return (V2_HEADER.pack(length + CORRELATION_ID.size, kind, flags | FLAG_CORRELATED, wire_id)
+            + CORRELATION_ID.pack(correlation_id) + frame[V2_HEADER.size:])
+
+
+def pack_multicast(wire_ids: List[bytes], payload: bytes, flags: int = FLAG_NONE) -> bytes:
+    targets = b"".join(wire_ids)
+    body_len = MULTICAST_COUNT.size + len(targets) + len(payload)
+    return (V2_HEADER.pack(V2_HEADER_SIZE + body_len, KIND_MULTICAST, flags, CONTROL_ID)
+            + MULTICAST_COUNT.pack(len(wire_ids)) + targets + payload)
+
+
+def split_multicast(body) -> Tuple[List[bytes], bytes]:
+    """Splits the body of a multicast frame (everything after the v2 header) into (wire ids, payload).
+
+    Raises ValueError if the target list runs past the end of the frame.
+    """
+    if len(body) < MULTICAST_COUNT.size:
+        raise ValueError("Multicast frame too short")
+    count = MULTICAST_COUNT.unpack_from(body)[0]
+    payload_start = MULTICAST_COUNT.size + 16 * count
+    if payload_start > len(body):
+        raise ValueError(f"Multicast frame lists {count} targets but is only {len(body)} bytes")
+    wire_ids = [bytes(body[i:i + 16]) for i in range(MULTICAST_COUNT.size, payload_start, 16)]
+    return wire_ids, body[payload_start:]
+
+
+class EnvelopeCodec:
+    """Encodes and decodes frames for one connection in its negotiated version.
+
+    Client ids stay strings for callers. In v2 the string <-> 16-byte
+    conversions are cached, since the same few clients send most frames on
+    a connection.
+    """
+
+    def __init__(self, version: int = PROTOCOL_V1):
+        self.version = version
+        self.features = frozenset() # Optional features both sides agreed on in the hello
+        self._from_wire = {} # Map: 16-byte id -> str
+        self._to_wire = {}   # Map: str -> 16-byte id
+
+    def _wire_id(self, client_id: str) -> bytes:
+        wire_id = self._to_wire.get(client_id)
+        if wire_id is None:
+            if len(self._to_wire) >= _ID_CACHE_LIMIT:
+                self._to_wire.clear()
+            wire_id = self._to_wire[client_id] = client_id_to_wire(client_id)
+        return wire_id
+
+    def _client_id(self, wire_id: bytes) -> str:
+        client_id = self._from_wire.get(wire_id)
+        if client_id is None:
+            if len(self._from_wire) >= _ID_CACHE_LIMIT:
+                self._from_wire.clear()
+            client_id = self._from_wire[wire_id] = client_id_from_wire(wire_id)
+        return client_id
+
+    def encode(self, kind: int, client_id: Optional[str], payload: bytes, flags: int = FLAG_NONE,
+               correlation_id: Optional[int] = None) -> bytes:
+        """Wraps a payload. client_id is ignored for control frames.
+
+        correlation_id is only sent on v2 (it is the id of the request being answered).
+        """
+        if self.version == PROTOCOL_V2:
+            if correlation_id is not None:
+                flags |= FLAG_CORRELATED
+                payload = CORRELATION_ID.pack(correlation_id) + payload
+            wire_id = CONTROL_ID if kind == KIND_CONTROL else self._wire_id(client_id)
+            return pack_v2(kind, wire_id, payload, flags)
+        client_id_bytes = b"" if kind == KIND_CONTROL else client_id.encode("utf-8")
+        return pack_v1(client_id_bytes, payload)
+
+    def encode_multicast(self, client_ids: List[str], payload: bytes, flags: int = FLAG_NONE) -> bytes:
+        """Wraps one push payload for several clients.
+
+        v2 produces multicast frames; v1 falls back to one push per client,
+        concatenated, so the caller still writes a single buffer.
+        """
+        if self.version == PROTOCOL_V2:
+            wire_ids = [self._wire_id(client_id) for client_id in client_ids]
+            return b"".join(pack_multicast(wire_ids[i:i + MAX_MULTICAST_TARGETS], payload, flags)
+                            for i in range(0, len(wire_ids), MAX_MULTICAST_TARGETS))
+        return b"".join(pack_v1(client_id.encode("utf-8"), payload) for client_id in client_ids)
+
+    def decode(self, message: bytes) -> Tuple[int, int, str, bytes]:
+        """Splits a frame (without its length prefix) into (kind, flags, client_id, payload).
+
+        v1 frames carry no kind: anything that is not a control frame is
+        reported as KIND_REQUEST.
+        """
+        if self.version == PROTOCOL_V2:
+            kind, flags = message[0], message[1]
+            if kind == KIND_CONTROL:
+                return kind, flags, "", message[18:]
+            return kind, flags, self._client_id(message[2:18]), message[18:]
+        client_id_end = 1 + message[0]
+        client_id = message[1:client_id_end].decode("utf-8")
+        return (KIND_REQUEST if client_id else KIND_CONTROL), FLAG_NONE, client_id, message[client_id_end:]
@@ -0,0 +1,158 @@
+"""Latency histograms that are cheap enough to leave on in production.
+
+LatencyHistogram buckets values the way HdrHistogram does: exact below 64
+microseconds, then 32 linear sub-buckets per power of two, so every value is
+kept to within about 3% whatever its size. The counts live in one
+preallocated array covering 1 microsecond to about an hour (longer values
+are clamped), so a histogram never grows, and recording is an index
+computation plus a few increments.
+
+There are no locks. Each histogram has a single writer, the event loop
+thread of its process; readers (stats reports, exports) copy the counts
+first and work on the copy.
+"""
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+MAX_VALUE_US = (1 << 32) - 1 # About 71 minutes
+_MAX_SHIFT = MAX_VALUE_US.bit_length() - (SUB_BUCKET_BITS + 1)
+BUCKET_COUNT = (_MAX_SHIFT + 2) * SUB_BUCKETS
+
+DEFAULT_PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+DEFAULT_MAX_TYPES = 64
+OTHER_TYPE = "other" # Where message types past max_types are counted
+
+
+def bucket_index(value_us: int) -> int:
+    if value_us < 2 * SUB_BUCKETS:
+        return value_us if value_us > 0 else 0
+    if value_us > MAX_VALUE_US:
+        value_us = MAX_VALUE_US
+    shift = value_us.bit_length() - (SUB_BUCKET_BITS + 1)
+    return (shift + 1) * SUB_BUCKETS + (value_us >> shift) - SUB_BUCKETS
+
+
+def bucket_upper_bound(index: int) -> int:
+    """Largest value (in microseconds) counted in a bucket."""
+    if index < 2 * SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    low = (index % SUB_BUCKETS + SUB_BUCKETS) << shift
+    return low + (1 << shift) - 1
+
+
+class LatencyHistogram:
+    """Counts of latencies in microseconds, with bounded relative error and fixed memory."""
+    __slots__ = ("counts", "count", "total_us", "max_us")
+
+    def __init__(self):
+        self.counts = array("Q", bytes(8 * BUCKET_COUNT))
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+
+    def record(self, seconds: float):
+        value_us = int(seconds * 1e6)
+        if value_us < 0:
+            value_us = 0
+        self.counts[bucket_index(value_us)] += 1
+        self.count += 1
+        self.total_us += value_us
+        if value_us > self.max_us:
+            self.max_us = value_us
+
+    def snapshot(self) -> "LatencyHistogram":
+        """A copy that the writer no longer touches."""
+        copy = LatencyHistogram.__new__(LatencyHistogram)
+        copy.counts = array("Q", self.counts)
+        copy.count = sum(copy.counts) # What the copied counts hold, even if count moved on meanwhile
+        copy.total_us = self.total_us
+        copy.max_us = self.max_us
+        return copy
+
+    def merge(self, other: "LatencyHistogram"):
+        for index, n in enumerate(other.counts):
+            if n:
+                self.counts[index] += n
+        self.count += other.count
+        self.total_us += other.total_us
+        self.max_us = max(self.max_us, other.max_us)
+
+    def percentiles(self, percentiles=DEFAULT_PERCENTILES) -> List[int]:
+        """Values (microseconds) at the given percentiles, in one pass over the buckets."""
+        results = [0] * len(percentiles)
+        if not self.count:
+            return results
+        wanted = sorted((max(1, -(-self.count * p // 100)), i) for i, p in enumerate(percentiles))
+        seen = 0
+        next_wanted = 0
+        for index, n in enumerate(self.counts):
+            if not n:
+                continue
+            seen += n
+            while next_wanted < len(wanted) and seen >= wanted[next_wanted][0]:
+                results[wanted[next_wanted][1]] = min(bucket_upper_bound(index), self.max_us)
+                next_wanted += 1
+            if next_wanted == len(wanted):
+                break
+        return results
+
+    def summary(self, percentiles=DEFAULT_PERCENTILES) -> Dict[str, float]:
+        """Count, mean, percentiles and max, in milliseconds."""
+        summary = {"count": self.count, "mean_ms": round(self.total_us / self.count / 1000, 3) if self.count else 0.0}
+        for p, value in zip(percentiles, self.percentiles(percentiles)):
+            summary[f"p{p:g}_ms"] = round(value / 1000, 3)
+        summary["max_ms"] = round(self.max_us / 1000, 3)
+        return summary
+
+
+class LatencyRecorder:
+    """One LatencyHistogram per (message type, phase).
+
+    Message types come from clients, so only the first max_types distinct
+    types get their own histograms; the rest are counted under "other".
+    """
+
+    def __init__(self, phases: Tuple[str, ...], max_types: int = DEFAULT_MAX_TYPES):
+        self.phases = phases
+        self.max_types = max_types
+        self._types: Dict[str, Dict[str, LatencyHistogram]] = {} # Map: type -> phase -> histogram
+
+    def _histograms(self, msg_type: Optional[str]) -> Dict[str, LatencyHistogram]:
+        msg_type = msg_type if isinstance(msg_type, str) else OTHER_TYPE
+        histograms = self._types.get(msg_type)
+        if histograms is None:
+            if len(self._types) >= self.max_types:
+                msg_type = OTHER_TYPE
+                histograms = self._types.get(msg_type)
+            if histograms is None:
+                histograms = self._types[msg_type] = {phase: LatencyHistogram() for phase in self.phases}
+        return histograms
+
+    def record(self, msg_type: Optional[str], phase: str, seconds: float):
+        self._histograms(msg_type)[phase].record(seconds)
+
+    def snapshot(self) -> Dict[str, Dict[str, LatencyHistogram]]:
+        return {msg_type: {phase: histogram.snapshot() for phase, histogram in histograms.items()}
+                for msg_type, histograms in list(self._types.items())}
+
+    def summary(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """Per type and phase: count, mean, percentiles and max in milliseconds. Phases never recorded are left out."""
+        return {msg_type: {phase: histogram.summary() for phase, histogram in histograms.items() if histogram.count}
+                for msg_type, histograms in sorted(self.snapshot().items())}
+
+    def format_report(self, title: str) -> str:
+        """The summary as a table, for printing."""
+        header = f"{'type':<14} {'phase':<8} {'count':>8} {'mean':>9} " + \
+                 " ".join(f"{'p' + format(p, 'g'):>9}" for p in DEFAULT_PERCENTILES) + f" {'max':>9}"
+        lines = [f"[*] {title} (ms):", header, "-" * len(header)]
+        for msg_type, phases in self.summary().items():
+            for phase, s in phases.items():
+                lines.append(f"{msg_type[:14]:<14} {phase:<8} {s['count']:>8} {s['mean_ms']:>9.3f} " +
+                             " ".join(f"{s[f'p{p:g}_ms']:>9.3f}" for p in DEFAULT_PERCENTILES) +
+                             f" {s['max_ms']:>9.3f}")
+        if len(lines) == 3:
+            lines.append("(no requests recorded yet)")
+        return "\n".join(lines)
@@ -0,0 +1,55 @@
+"""Load reports from a backend to its Load Balancers.
+
+Every `interval` seconds the backend sends a control frame on each LB
+connection that negotiated the "load_report" feature:
+
+    {"type": "load_report", "interval": 0.5, "lag": 0.0021, "pending": 3, "executor_queue": 0}
+
+    lag             how late the reporter's own timer fired, in seconds. A loop
+                    kept busy (e.g. hashing passwords) shows up here first.
+    pending         requests queued or inside their handlers right now
+    executor_queue  jobs waiting for a worker of the backend's executor; only
+                    sent by backends that run work in one
+
+The LB smooths these into a load factor per backend and scales its weight
+for backend selection with it (balancing.LoadWeighting).
+"""
+import asyncio
+import time
+from typing import Callable, Dict
+
+LOAD_REPORT_TYPE = "load_report"
+DEFAULT_REPORT_INTERVAL = 0.5
+
+
+class LoadReporter:
+    def __init__(self, send: Callable[[dict], None], interval: float = DEFAULT_REPORT_INTERVAL):
+        self.send = send # Called with every report, on the event loop
+        self.interval = interval
+        self.sources: Dict[str, Callable[[], int]] = {} # Map: report field -> gauge read when reporting
+        self.lag = 0.0 # Seconds, latest measurement
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="LoadReporter")
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def report(self) -> dict:
+        report = {"type": LOAD_REPORT_TYPE, "interval": self.interval, "lag": round(self.lag, 6)}
+        for field, source in self.sources.items():
+            report[field] = source()
+        return report
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, time.perf_counter() - started - self.interval)
+            try:
+                self.send(self.report())
+            except Exception as e:
+                print(f"[!] Could not send load report: {type(e).__name__} - {e}")
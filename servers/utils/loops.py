@@ -0,0 +1,48 @@
+import asyncio
+import importlib
+import sys
+
+# Event loop implementations the LB and backend can run on
+LOOP_AUTO = "auto"       # Fastest one installed, else the default asyncio loop
+LOOP_ASYNCIO = "asyncio" # The standard library loop
+LOOP_UVLOOP = "uvloop"   # libuv based loop (Linux, macOS)
+LOOP_WINLOOP = "winloop" # uvloop port for Windows
+
+LOOP_CHOICES = (LOOP_AUTO, LOOP_ASYNCIO, LOOP_UVLOOP, LOOP_WINLOOP)
+
+# Tried in order by LOOP_AUTO
+_PREFERRED = (LOOP_WINLOOP,) if sys.platform == "win32" else (LOOP_UVLOOP,)
+
+
+def _load_policy(name):
+    """Returns the event loop policy class of an optional loop module, or None if it is not installed."""
+    try:
+        module = importlib.import_module(name)
+    except ImportError:
+        return None
+    return module.EventLoopPolicy
+
+
+def available_loops():
+    """Names of the loops that can be installed here, the default asyncio loop first."""
+    return [LOOP_ASYNCIO] + [name for name in (LOOP_UVLOOP, LOOP_WINLOOP) if _load_policy(name)]
+
+
+def install_event_loop(name: str = LOOP_AUTO) -> str:
+    """Sets the event loop policy used by the following asyncio.run().
+
+    Falls back to the default asyncio loop when the requested one is not
+    installed. Returns the name of the loop that will actually be used.
+    """
+    if name not in LOOP_CHOICES:
+        raise ValueError(f"Unknown event loop: {name}")
+    if name == LOOP_ASYNCIO:
+        return LOOP_ASYNCIO
+    for candidate in (_PREFERRED if name == LOOP_AUTO else (name,)):
+        policy = _load_policy(candidate)
+        if policy:
+            asyncio.set_event_loop_policy(policy())
+            return candidate
+    if name != LOOP_AUTO:
+        print(f"[!] {name} is not installed. Falling back to the default asyncio event loop.")
+    return LOOP_ASYNCIO
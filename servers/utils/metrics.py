@@ -0,0 +1,271 @@
+"""Counters and gauges in the Prometheus text format, served over a small HTTP listener.
+
+Updating a metric is a dict lookup and an addition, cheap enough for every
+message. Values that already exist somewhere (queue depths, connection
+counts, health) are not copied into metrics on each change: callback
+metrics read them when a scrape comes in. Label values taken from client
+input (e.g. message types) are capped per metric so a client cannot grow
+the registry without bound; past the cap they are counted as "other".
+
+MetricsServer answers GET requests with asyncio streams, so a scrape is
+served between other events on the loop. Rendering only walks the bounded
+set of series.
+"""
+import asyncio
+import time
+from urllib.parse import parse_qs
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from .histogram import LatencyHistogram, LatencyRecorder, DEFAULT_PERCENTILES, OTHER_TYPE
+
+DEFAULT_MAX_SERIES = 64
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+MAX_REQUEST_HEAD = 8192
+REQUEST_TIMEOUT = 5.0
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: Tuple[str, ...], labelvalues: Tuple) -> str:
+    if not labelnames:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)) + "}"
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float):
+        if value != value:
+            return "NaN"
+        if value in (float("inf"), float("-inf")):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+
+    def samples(self) -> Iterable[Tuple[str, Tuple, object]]:
+        """(name suffix, label values, value) for every series."""
+        return ()
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {_escape(self.help)}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labelvalues, value in self.samples():
+            labelnames = self.labelnames + ("quantile",) if len(labelvalues) > len(self.labelnames) else self.labelnames
+            lines.append(f"{self.name}{suffix}{_format_labels(labelnames, labelvalues)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """A value that only goes up, per combination of label values."""
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                 max_series: int = DEFAULT_MAX_SERIES):
+        super().__init__(name, help_text, labelnames)
+        self.max_series = max_series
+        self.values: Dict[Tuple, float] = {}
+        if not labelnames:
+            self.values[()] = 0
+
+    def inc(self, amount=1, labels: Tuple = ()):
+        values = self.values
+        value = values.get(labels)
+        if value is None:
+            if len(values) >= self.max_series:
+                labels = (OTHER_TYPE,) * len(self.labelnames)
+            value = values.get(labels, 0)
+        values[labels] = value + amount
+
+    def samples(self):
+        return (("", labels, value) for labels, value in list(self.values.items()))
+
+
+class Gauge(Counter):
+    """A value that goes up and down."""
+    kind = "gauge"
+
+    def set(self, value, labels: Tuple = ()):
+        if labels not in self.values and len(self.values) >= self.max_series:
+            labels = (OTHER_TYPE,) * len(self.labelnames)
+        self.values[labels] = value
+
+    def dec(self, amount=1, labels: Tuple = ()):
+        self.inc(-amount, labels)
+
+
+class CallbackMetric(Metric):
+    """A counter or gauge whose values are read from elsewhere at scrape time.
+
+    The callback returns a number (no labels) or an iterable of
+    (label values, number).
+    """
+
+    def __init__(self, name: str, help_text: str, callback: Callable, labelnames: Tuple[str, ...] = (),
+                 kind: str = "gauge"):
+        super().__init__(name, help_text, labelnames)
+        self.callback = callback
+        self.kind = kind
+
+    def samples(self):
+        result = self.callback()
+        if not self.labelnames:
+            return (("", (), result),)
+        return (("", tuple(labels), value) for labels, value in result)
+
+
+class LatencySummary(Metric):
+    """Quantiles of LatencyHistograms, in seconds, as a Prometheus summary.
+
+    Takes a LatencyRecorder (labelled by message type and phase) or a single
+    LatencyHistogram (no labels).
+    """
+    kind = "summary"
+
+    def __init__(self, name: str, help_text: str, source, percentiles=DEFAULT_PERCENTILES):
+        labelnames = ("type", "phase") if isinstance(source, LatencyRecorder) else ()
+        super().__init__(name, help_text, labelnames)
+        self.source = source
+        self.percentiles = percentiles
+
+    def _series(self):
+        if isinstance(self.source, LatencyHistogram):
+            yield (), self.source.snapshot()
+            return
+        for msg_type, phases in sorted(self.source.snapshot().items()):
+            for phase, histogram in phases.items():
+                if histogram.count:
+                    yield (msg_type, phase), histogram
+
+    def samples(self):
+        for labels, histogram in self._series():
+            for p, value_us in zip(self.percentiles, histogram.percentiles(self.percentiles)):
+                yield "", labels + (format(p / 100, "g"),), value_us / 1e6
+            yield "_sum", labels, histogram.total_us / 1e6
+            yield "_count", labels, histogram.count
+
+
+class MetricsRegistry:
+    """The metrics of one process, rendered together on a scrape."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=(), max_series=DEFAULT_MAX_SERIES) -> Counter:
+        return self.register(Counter(name, help_text, labelnames, max_series))
+
+    def gauge(self, name, help_text, labelnames=(), max_series=DEFAULT_MAX_SERIES) -> Gauge:
+        return self.register(Gauge(name, help_text, labelnames, max_series))
+
+    def callback(self, name, help_text, callback, labelnames=(), kind="gauge") -> CallbackMetric:
+        return self.register(CallbackMetric(name, help_text, callback, labelnames, kind))
+
+    def latency(self, name, help_text, source) -> LatencySummary:
+        return self.register(LatencySummary(name, help_text, source))
+
+    def render(self) -> str:
+        parts = []
+        for metric in self._metrics:
+            try:
+                parts.append(metric.render())
+            except Exception as e:
+                # One broken callback must not take the whole scrape down
+                parts.append(f"# {metric.name} unavailable: {_escape(type(e).__name__)}")
+        return "\n".join(parts) + "\n"
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop runs a timer: a busy or blocked loop shows up as lag."""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.last = 0.0 # Seconds, latest measurement
+        self.max = 0.0  # Seconds, worst since the last read_max()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="LoopLagMonitor")
+
+    def read_max(self) -> float:
+        worst, self.max = self.max, self.last
+        return worst
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.last = max(0.0, time.perf_counter() - started - self.interval)
+            if self.last > self.max:
+                self.max = self.last
+
+    def register(self, registry: MetricsRegistry, prefix: str):
+        registry.callback(f"{prefix}_event_loop_lag_seconds", "How late the latest loop lag probe timer fired",
+                          lambda: self.last)
+        registry.callback(f"{prefix}_event_loop_lag_max_seconds", "Worst loop lag since the previous scrape",
+                          self.read_max)
+
+
+class MetricsServer:
+    """Minimal HTTP/1.0 listener: GET /metrics renders the registry.
+
+    More paths can be added to `routes`: path -> callable taking the query
+    parameters (name -> list of values) and returning (content type, body text).
+    """
+
+    def __init__(self, registry: MetricsRegistry, host: str = "127.0.0.1", port: int = 0):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.routes: Dict[str, Callable[[dict], Tuple[str, str]]] = {
+            "/metrics": lambda query: (CONTENT_TYPE, self.registry.render()),
+        }
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, limit=MAX_REQUEST_HEAD)
+        return self._server.sockets[0].getsockname()
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=REQUEST_TIMEOUT)
+            request_line = head.split(b"\r\n", 1)[0].decode("latin-1").split()
+            if len(request_line) < 2 or request_line[0] not in ("GET", "HEAD"):
+                status, content_type, body = "405 Method Not Allowed", "text/plain", "Only GET is supported\n"
+            else:
+                path, _, query = request_line[1].partition("?")
+                route = self.routes.get(path)
+                if route is None:
+                    status, content_type, body = "404 Not Found", "text/plain", "Not found\n"
+                else:
+                    content_type, body = route(parse_qs(query))
+                    status = "200 OK"
+            data = body.encode("utf-8")
+            writer.write(f"HTTP/1.0 {status}\r\nContent-Type: {content_type}\r\n"
+                         f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode("latin-1"))
+            if request_line and request_line[0] != "HEAD":
+                writer.write(data)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ConnectionResetError, BrokenPipeError, OSError):
+            pass
+        except Exception as e:
+            print(f"[!] Error serving metrics request: {type(e).__name__} - {e}")
+        finally:
+            writer.close()
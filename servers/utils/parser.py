@@ -1,27 +1,50 @@
-from .packets import *
-import json
-
-MESSAGE_TYPES = {
-    "login": PacketLogin,
-    "create_room": PacketCreateRoom,
-    "logout": PacketLogout,
-}
-
-def parse_message(raw_data: bytes):
-    from json import JSONDecodeError
-    from pydantic import ValidationError
-    
-    try:
-        json_data = raw_data.decode().strip()
-        message_type = json.loads(json_data).get('type')
-        
-        if not message_type or message_type not in MESSAGE_TYPES:
-            raise ValueError("Invalid message type")
- 
-        model = MESSAGE_TYPES[message_type]
-        return model.model_validate_json(json_data)
-        
-    except JSONDecodeError:
-        raise ValidationError("Invalid JSON format")
-    except KeyError:
-        raise ValidationError("Missing required fields")
+import re
+from typing import Annotated, Callable, Iterable, Optional, Tuple, Type, Union
+from pydantic import ConfigDict, Field, TypeAdapter, ValidationError
+
+from .packets import PacketBase
+
+# What kind of problem a ValidationError from a message parser is
+ERROR_NOT_JSON = "not_json"         # Not JSON, or not a JSON object
+ERROR_UNKNOWN_TYPE = "unknown_type" # No "type", or one without a packet model
+ERROR_INVALID = "invalid"           # A known type whose fields do not validate
+
+# A request's "type" sits near its start; scheduling only needs that much of it
+_TYPE_FIELD = re.compile(rb'"type"\s*:\s*"([A-Za-z0-9_]{1,64})"')
+_TYPE_PEEK_BYTES = 128
+
+
+def make_message_parser(models: Iterable[Type[PacketBase]]) -> Callable[[bytes], PacketBase]:
+    """Returns a function that parses and validates a client request into one of `models`.
+
+    The models are told apart by their "type" field. Validating raw bytes
+    against their union parses the JSON and checks the packet in one pass:
+    the discriminator picks the model straight away instead of trying each in
+    turn. A type with no model is an unknown type. The function raises
+    ValidationError (see describe_error).
+    """
+    models = tuple(models)
+    adapter = TypeAdapter(Annotated[Union[models], Field(discriminator="type")],
+                          config=ConfigDict(title="ClientPacket"))
+    return adapter.validate_json
+
+
+def peek_request_type(raw_data: bytes) -> Optional[str]:
+    """Returns a request's "type" from its first bytes, without parsing it; None if it is not there."""
+    match = _TYPE_FIELD.search(raw_data, 0, _TYPE_PEEK_BYTES)
+    return match.group(1).decode("ascii") if match else None
+
+
+def describe_error(error: ValidationError) -> Tuple[str, Optional[str]]:
+    """Returns (ERROR_* kind, the request's type if it could be told) for a message parser's error."""
+    first = error.errors()[0]
+    kind = first["type"]
+    if kind in ("json_invalid", "dict_type", "model_attributes_type"):
+        return ERROR_NOT_JSON, None
+    if kind == "union_tag_not_found":
+        return ERROR_UNKNOWN_TYPE, None
+    if kind == "union_tag_invalid":
+        return ERROR_UNKNOWN_TYPE, first.get("ctx", {}).get("tag")
+    # Field errors are located under the tag of the model that was picked
+    loc = first.get("loc") or (None,)
+    return ERROR_INVALID, loc[0] if isinstance(loc[0], str) else None
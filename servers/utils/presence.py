@@ -0,0 +1,112 @@
+"""Which clients are connected, as reported by the Load Balancer.
+
+The LB sends control frames about client connections:
+
+    {"type": "client_connected", "client_id": ...}     first frame of a client routed to this backend
+    {"type": "client_disconnected", "client_id": ...}  that client closed its LB connection
+    {"type": "clients_connected", "client_ids": [...]} after (re)connecting: clients already routed here
+    {"type": "clients_gone", "client_ids": [...]}      disconnects batched up, e.g. while the link was down
+
+Disconnects are applied to active_clients in batches, one transaction per
+batch, and only after the client's requests still queued or running
+(request_queues) have finished: a login completing after the disconnect
+would otherwise register the client again, leaving a row for a client that
+is gone. When an LB link breaks without being released, its clients are given
+a grace period to show up again (the LB re-announces them once it
+reconnects) before they are removed; this covers an LB that went away for
+good.
+"""
+import asyncio
+import functools
+from typing import Dict, Iterable, List
+
+DEFAULT_BATCH_DELAY = 0.1
+DEFAULT_LINK_GRACE = 30.0
+
+
+class ClientPresence:
+    def __init__(self, db, batch_delay: float = DEFAULT_BATCH_DELAY, link_grace: float = DEFAULT_LINK_GRACE):
+        self.db = db
+        self.batch_delay = batch_delay
+        self.link_grace = link_grace
+        self._links: Dict[str, object] = {} # Map: client_id -> LB connection (writer) it was last seen on
+        self._gone: List[str] = []
+        self._flush_handle = None
+        self.request_queues = None # Optional ClientRequestQueues; removals wait for the client's requests in it
+
+    @property
+    def client_count(self) -> int:
+        return len(self._links)
+
+    def seen(self, client_id: str, link):
+        """Records that a client is connected through an LB connection."""
+        if client_id:
+            self._links[client_id] = link
+
+    def seen_many(self, client_ids: Iterable[str], link):
+        for client_id in client_ids:
+            if client_id:
+                self._links[client_id] = link
+
+    def gone(self, client_ids: Iterable[str]):
+        """Queues clients that disconnected for removal from active_clients."""
+        for client_id in client_ids:
+            if not client_id:
+                continue
+            self._links.pop(client_id, None)
+            if self.request_queues and self.request_queues.has_pending(client_id):
+                self.request_queues.run_after(client_id, functools.partial(self._after_requests, client_id))
+            else:
+                self._remove(client_id)
+
+    async def _after_requests(self, client_id: str):
+        self._remove(client_id)
+
+    def _remove(self, client_id: str):
+        self._gone.append(client_id)
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.batch_delay, self._flush)
+
+    def link_released(self, link):
+        """The LB closed a link on purpose (after draining it): its clients are still connected elsewhere."""
+        for client_id in [c for c, l in self._links.items() if l is link]:
+            del self._links[client_id]
+
+    def link_lost(self, link):
+        """A link broke. Its clients are removed unless they are seen on another link within link_grace."""
+        orphans = [c for c, l in self._links.items() if l is link]
+        if orphans:
+            print(f"[*] LB link lost with {len(orphans)} client(s); removing them in {self.link_grace:g}s "
+                  f"unless the Load Balancer reports them again.")
+            asyncio.get_running_loop().call_later(self.link_grace, self._purge, link, orphans)
+
+    def _purge(self, link, orphans):
+        self.gone([c for c in orphans if self._links.get(c) is link])
+
+    def _flush(self):
+        self._flush_handle = None
+        batch, self._gone = self._gone, []
+        if batch and self.db:
+            asyncio.create_task(self._unregister(batch), name="PresenceFlush")
+
+    async def _unregister(self, client_ids: List[str]):
+        try:
+            await self.db.unregister_clients_by_ids(client_ids)
+        except Exception as e:
+            print(f"[!] Could not remove {len(client_ids)} disconnected client(s) from active_clients: "
+                  f"{type(e).__name__} - {e}")
+
+    def handle_control(self, control: dict, link) -> bool:
+        """Applies a presence control frame. Returns False if it is not one."""
+        control_type = control.get("type")
+        if control_type == "client_connected":
+            self.seen(control.get("client_id"), link)
+        elif control_type == "clients_connected":
+            self.seen_many(control.get("client_ids") or [], link)
+        elif control_type == "client_disconnected":
+            self.gone([control.get("client_id")])
+        elif control_type == "clients_gone":
+            self.gone(control.get("client_ids") or [])
+        else:
+            return False
+        return True
@@ -0,0 +1,30 @@
+import asyncio
+
+import bcrypt
+import pytest
+
+from utils.auth_pool import PasswordVerifier, AuthQueueFull
+
+
+def test_queue_full_at_workers_plus_max_queue():
+    hashed = bcrypt.hashpw(b"secret", bcrypt.gensalt(10)).decode("utf-8")
+
+    async def scenario():
+        verifier = PasswordVerifier(workers=1, max_queue=2)
+        await verifier.start()
+        try:
+            checks = [asyncio.ensure_future(verifier.verify(password, stored))
+                      for password, stored in (("secret", hashed), ("wrong", hashed), ("secret", "not a hash"))]
+            await asyncio.sleep(0) # All three are in flight: one running, two waiting
+            assert (verifier.in_flight, verifier.waiting) == (3, 2)
+            with pytest.raises(AuthQueueFull):
+                await verifier.verify("secret", hashed)
+            results = await asyncio.gather(*checks, return_exceptions=True)
+        finally:
+            verifier.close()
+        return verifier, results
+
+    verifier, results = asyncio.run(scenario())
+    assert results[:2] == [True, False] and isinstance(results[2], ValueError)
+    assert verifier.rejected == 1
+    assert (verifier.completed, verifier.verified, verifier.failed, verifier.errors) == (3, 1, 1, 1)
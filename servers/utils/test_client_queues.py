@@ -0,0 +1,182 @@
+import asyncio
+import random
+
+from utils.client_queues import ClientRequestQueues
+
+
+def test_per_client_order_under_concurrency():
+    async def scenario():
+        queues = ClientRequestQueues(max_concurrent=8)
+        done = {f"client-{c}": [] for c in range(6)}
+        running = peak = 0
+
+        def job(client_id, n):
+            async def run():
+                nonlocal running, peak
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(random.uniform(0, 0.003))
+                done[client_id].append(n)
+                running -= 1
+            return run
+
+        for n in range(20):
+            for client_id in done:
+                assert queues.submit(client_id, job(client_id, n), None)
+        while queues.pending:
+            await asyncio.sleep(0.01)
+        return done, peak, queues
+
+    done, peak, queues = asyncio.run(scenario())
+    for order in done.values():
+        assert order == list(range(20))
+    assert 1 < peak <= 8 # Clients ran side by side, within the cap
+    assert queues.clients == 0
+
+
+def test_per_client_cap_bounds_a_flooding_client():
+    async def scenario():
+        queues = ClientRequestQueues(max_concurrent=2, max_backlog=3, max_per_client=2)
+        release = asyncio.Event()
+        answers = []
+
+        def job(n):
+            async def run():
+                await release.wait()
+                answers.append(("ok", n))
+            return run
+
+        def reject(n):
+            async def run():
+                answers.append(("busy", n))
+            return run
+
+        accepted = [queues.submit("flood", job(n), reject(n)) for n in range(100)]
+        assert accepted[:2] == [True, True] and not any(accepted[2:])
+        # Two requests accepted, one job answering the first two rejections, the rest dropped
+        assert len(queues._queues["flood"].jobs) == 3
+        assert (queues.queued, queues.rejected, queues.dropped) == (2, 98, 96)
+        # The flood does not count towards the LB-wide backlog
+        await asyncio.wait_for(queues.wait_for_space(), 0.1)
+
+        # The flood's two requests now hold both slots; other clients fill the backlog and the reader waits
+        for n in range(100, 103):
+            assert queues.submit(f"other-{n}", job(n), reject(n))
+        waiter = asyncio.ensure_future(queues.wait_for_space())
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        release.set()
+        await asyncio.wait_for(waiter, 1)
+        while queues.pending:
+            await asyncio.sleep(0.01)
+        return answers
+
+    answers = asyncio.run(scenario())
+    flood = [a for a in answers if a[1] < 100]
+    assert flood == [("ok", 0), ("ok", 1), ("busy", 2), ("busy", 3)]
+
+
+def test_rejections_keep_their_place_in_the_order():
+    async def scenario():
+        queues = ClientRequestQueues(max_concurrent=1, max_per_client=1)
+        gate = asyncio.Event()
+        answers = []
+
+        def job(n, wait=False):
+            async def run():
+                if wait:
+                    await gate.wait()
+                answers.append(("ok", n))
+            return run
+
+        def reject(n):
+            async def run():
+                answers.append(("busy", n))
+            return run
+
+        queues.submit("c", job(0, wait=True), reject(0))
+        await asyncio.sleep(0) # Job 0 starts and blocks, leaving room for one more
+        queues.submit("c", job(1), reject(1))
+        queues.submit("c", job(2), reject(2)) # Full: answered after 1
+        gate.set()
+        await asyncio.sleep(0)
+        while queues.pending:
+            await asyncio.sleep(0.01)
+        return answers
+
+    assert asyncio.run(scenario()) == [("ok", 0), ("ok", 1), ("busy", 2)]
+
+
+def recorder(answers, name, gate=None):
+    async def run():
+        if gate is not None:
+            await gate.wait()
+        answers.append(name)
+    return run
+
+
+def test_newer_droppable_request_replaces_a_queued_one():
+    async def scenario():
+        queues = ClientRequestQueues(max_concurrent=1)
+        gate = asyncio.Event()
+        answers = []
+
+        def submit(name, droppable=None, wait=False):
+            return queues.submit("c", recorder(answers, f"ok {name}", gate if wait else None),
+                                 recorder(answers, f"busy {name}"), droppable=droppable)
+
+        submit("login", wait=True)
+        await asyncio.sleep(0) # Running and blocked
+        for n in range(3):
+            assert submit(f"screen {n}", "screen_data")
+        submit("notify")
+        submit("screen 3", "screen_data") # Not replaced: a notify was queued after screen 2
+        assert queues.queued == 3
+        gate.set()
+        while queues.pending:
+            await asyncio.sleep(0.01)
+        return queues, answers
+
+    queues, answers = asyncio.run(scenario())
+    assert answers == ["ok login", "busy screen 0", "busy screen 1", "ok screen 2", "ok notify", "ok screen 3"]
+    assert (queues.shed, queues.rejected) == (2, 0)
+
+
+def test_full_queue_sheds_a_droppable_request_first():
+    async def scenario():
+        queues = ClientRequestQueues(max_concurrent=1, max_per_client=2)
+        gate = asyncio.Event()
+        answers = []
+        queues.submit("c", recorder(answers, "ok login", gate), None)
+        await asyncio.sleep(0)
+        queues.submit("c", recorder(answers, "ok screen"), recorder(answers, "busy screen"), droppable="screen_data")
+        queues.submit("c", recorder(answers, "ok refresh"), recorder(answers, "busy refresh"))
+        assert queues.submit("c", recorder(answers, "ok notify"), recorder(answers, "busy notify"))
+        assert not queues.submit("c", recorder(answers, "ok join"), recorder(answers, "busy join"))
+        gate.set()
+        while queues.pending:
+            await asyncio.sleep(0.01)
+        return queues, answers
+
+    queues, answers = asyncio.run(scenario())
+    assert answers == ["ok login", "busy screen", "ok refresh", "ok notify", "busy join"]
+    assert (queues.shed, queues.rejected, queues.queued) == (1, 1, 0)
+
+
+def test_concurrency_class_runs_under_its_own_limit():
+    async def scenario():
+        queues = ClientRequestQueues(max_concurrent=1, limits={"cpu": 1})
+        gate = asyncio.Event()
+        answers = []
+        queues.submit("a", recorder(answers, "login a", gate), None, concurrency="cpu")
+        queues.submit("b", recorder(answers, "login b"), None, concurrency="cpu")
+        queues.submit("c", recorder(answers, "refresh c"), None, concurrency="db")
+        await asyncio.sleep(0.01)
+        # Login a holds the only CPU slot: login b waits for it, refresh c does not
+        assert answers == ["refresh c"] and queues.running == 1
+        gate.set()
+        while queues.pending:
+            await asyncio.sleep(0.01)
+        return answers
+
+    assert asyncio.run(scenario()) == ["refresh c", "login a", "login b"]
@@ -0,0 +1,114 @@
+import struct
+import uuid
+
+import pytest
+
+from utils.envelope import (
+    EnvelopeCodec, PROTOCOL_V1, PROTOCOL_V2, KIND_REQUEST, KIND_RESPONSE, KIND_PUSH, KIND_CONTROL,
+    KIND_MULTICAST, FLAG_NONE, FLAG_CORRELATED, V2_HEADER_SIZE, MAX_MULTICAST_TARGETS, add_correlation,
+    client_id_from_wire, client_id_to_wire, header_v1, header_v2, pack_multicast, pack_v1, pack_v2,
+    split_correlation, split_multicast
+)
+
+CLIENT_ID = str(uuid.uuid4())
+PAYLOAD = '{"type": "refresh", "room_id": "phòng-1"}'.encode("utf-8")
+
+
+def unframe(frame: bytes) -> bytes:
+    """Checks the length prefix and returns what follows it."""
+    assert struct.unpack_from("!I", frame)[0] == len(frame) - 4
+    return frame[4:]
+
+
+def test_v1_round_trip():
+    codec = EnvelopeCodec(PROTOCOL_V1)
+    frame = codec.encode(KIND_PUSH, CLIENT_ID, PAYLOAD)
+    assert frame == pack_v1(CLIENT_ID.encode("utf-8"), PAYLOAD)
+    assert frame == header_v1(CLIENT_ID.encode("utf-8"), len(PAYLOAD)) + PAYLOAD
+    assert codec.decode(unframe(frame)) == (KIND_REQUEST, FLAG_NONE, CLIENT_ID, PAYLOAD)
+    # v1 has no correlation ids: they are left out
+    assert codec.encode(KIND_RESPONSE, CLIENT_ID, PAYLOAD, correlation_id=7) == frame
+
+
+def test_v1_control_frames_have_an_empty_client_id():
+    codec = EnvelopeCodec(PROTOCOL_V1)
+    frame = codec.encode(KIND_CONTROL, None, b'{"type": "ping"}')
+    assert frame[4] == 0
+    assert codec.decode(unframe(frame)) == (KIND_CONTROL, FLAG_NONE, "", b'{"type": "ping"}')
+
+
+def test_v2_round_trip():
+    codec = EnvelopeCodec(PROTOCOL_V2)
+    wire_id = client_id_to_wire(CLIENT_ID)
+    assert client_id_from_wire(wire_id) == CLIENT_ID
+    for kind in (KIND_REQUEST, KIND_RESPONSE, KIND_PUSH):
+        frame = codec.encode(kind, CLIENT_ID, PAYLOAD)
+        assert frame == pack_v2(kind, wire_id, PAYLOAD)
+        assert frame == header_v2(kind, wire_id, len(PAYLOAD)) + PAYLOAD
+        assert len(unframe(frame)) == V2_HEADER_SIZE + len(PAYLOAD)
+        assert codec.decode(unframe(frame)) == (kind, FLAG_NONE, CLIENT_ID, PAYLOAD)
+    control = codec.encode(KIND_CONTROL, "ignored", b"{}")
+    assert codec.decode(unframe(control)) == (KIND_CONTROL, FLAG_NONE, "", b"{}")
+
+
+def test_v2_correlation_ids():
+    codec = EnvelopeCodec(PROTOCOL_V2)
+    for correlation_id in (0, 1, 0xFFFFFFFF):
+        kind, flags, client_id, payload = codec.decode(
+            unframe(codec.encode(KIND_REQUEST, CLIENT_ID, PAYLOAD, correlation_id=correlation_id)))
+        assert flags & FLAG_CORRELATED and client_id == CLIENT_ID
+        assert split_correlation(flags, payload) == (correlation_id, PAYLOAD)
+
+    # A response packed before its request's id was known gets it added afterwards
+    response = codec.encode(KIND_RESPONSE, CLIENT_ID, b'{"status": "success"}')
+    correlated = add_correlation(response, 42)
+    kind, flags, client_id, payload = codec.decode(unframe(correlated))
+    assert (kind, client_id) == (KIND_RESPONSE, CLIENT_ID)
+    assert split_correlation(flags, payload) == (42, b'{"status": "success"}')
+
+
+def test_uncorrelated_payload_is_left_alone():
+    assert split_correlation(FLAG_NONE, PAYLOAD) == (None, PAYLOAD)
+    assert split_correlation(FLAG_CORRELATED, b"ab") == (None, b"ab") # Too short to hold an id
+
+
+def multicast_frames(buffer: bytes):
+    """Splits consecutive multicast frames by their length prefix into (wire ids, payload) pairs."""
+    frames = []
+    while buffer:
+        length = struct.unpack_from("!I", buffer)[0]
+        message, buffer = buffer[4:4 + length], buffer[4 + length:]
+        assert len(message) == length and message[0] == KIND_MULTICAST
+        frames.append(split_multicast(message[V2_HEADER_SIZE:]))
+    return frames
+
+
+def test_multicast_round_trip():
+    wire_ids = [uuid.uuid4().bytes for _ in range(3)]
+    assert multicast_frames(pack_multicast(wire_ids, PAYLOAD)) == [(wire_ids, PAYLOAD)]
+    assert multicast_frames(pack_multicast([], PAYLOAD)) == [([], PAYLOAD)]
+
+
+def test_multicast_over_the_target_limit_is_split():
+    client_ids = [str(uuid.uuid4()) for _ in range(MAX_MULTICAST_TARGETS + 2)]
+    frames = multicast_frames(EnvelopeCodec(PROTOCOL_V2).encode_multicast(client_ids, PAYLOAD))
+    assert [len(wire_ids) for wire_ids, _ in frames] == [MAX_MULTICAST_TARGETS, 2]
+    assert all(payload == PAYLOAD for _, payload in frames)
+    assert [client_id_from_wire(wire_id) for wire_ids, _ in frames for wire_id in wire_ids] == client_ids
+
+
+def test_multicast_with_a_truncated_target_list():
+    body = pack_multicast([uuid.uuid4().bytes for _ in range(3)], b"")[4 + V2_HEADER_SIZE:]
+    with pytest.raises(ValueError):
+        split_multicast(body[:-1])
+    with pytest.raises(ValueError):
+        split_multicast(struct.pack("!H", 1)) # Counts a target it does not carry
+    with pytest.raises(ValueError):
+        split_multicast(b"\x00")
+
+
+def test_v1_multicast_falls_back_to_one_push_per_client():
+    client_ids = [str(uuid.uuid4()) for _ in range(3)]
+    codec = EnvelopeCodec(PROTOCOL_V1)
+    buffer = codec.encode_multicast(client_ids, PAYLOAD)
+    assert buffer == b"".join(codec.encode(KIND_PUSH, client_id, PAYLOAD) for client_id in client_ids)
@@ -0,0 +1,71 @@
+import asyncio
+import sqlite3
+
+from database.sqlite_db import ClassroomDatabase
+from database.async_db import AsyncClassroomDatabase
+from utils.client_queues import ClientRequestQueues
+from utils.presence import ClientPresence
+
+
+def make_db(tmp_path):
+    sync_db = ClassroomDatabase(str(tmp_path / "classroom.db"))
+    with sync_db._get_cursor() as cursor:
+        cursor.execute("INSERT INTO users VALUES ('stu1', 'x', 'student')")
+    return AsyncClassroomDatabase(sync_db)
+
+
+def active_clients(db):
+    with sqlite3.connect(db.sync_db.db_path) as conn:
+        return conn.execute("SELECT username, client_id FROM active_clients").fetchall()
+
+
+def test_disconnect_waits_for_a_slow_login(tmp_path):
+    db = make_db(tmp_path)
+
+    async def scenario():
+        queues = ClientRequestQueues()
+        presence = ClientPresence(db, batch_delay=0.01)
+        presence.request_queues = queues
+
+        async def slow_login():
+            await asyncio.sleep(0.2) # Waiting on the password check
+            await db.register_client("stu1", "client-1")
+
+        queues.submit("client-1", slow_login, None)
+        presence.seen("client-1", "link")
+        presence.gone(["client-1"]) # The LB reports the disconnect before the login is answered
+        while queues.pending or presence._gone or presence._flush_handle:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05) # The flush's write
+
+    try:
+        asyncio.run(scenario())
+        assert active_clients(db) == []
+    finally:
+        db.close()
+
+
+def test_lost_link_purges_clients_not_seen_again(tmp_path):
+    db = make_db(tmp_path)
+    with db.sync_db._get_cursor() as cursor:
+        cursor.execute("INSERT INTO users VALUES ('stu2', 'x', 'student')")
+
+    async def scenario():
+        presence = ClientPresence(db, batch_delay=0.01, link_grace=0.1)
+        await db.register_client("stu1", "client-1")
+        await db.register_client("stu2", "client-2")
+        presence.handle_control({"type": "clients_connected", "client_ids": ["client-1", "client-2"]}, "link-a")
+        presence.link_lost("link-a")
+        await asyncio.sleep(0.05)
+        # The LB reconnects on another link and re-announces only client-2
+        presence.handle_control({"type": "clients_connected", "client_ids": ["client-2"]}, "link-b")
+        assert len(active_clients(db)) == 2 # Nothing removed within the grace period
+        await asyncio.sleep(0.15) # Past the grace period and the flush
+        return presence
+
+    try:
+        presence = asyncio.run(scenario())
+        assert active_clients(db) == [("stu2", "client-2")]
+        assert presence.client_count == 1
+    finally:
+        db.close()